@@ -266,7 +266,7 @@ async def add_demo_products():
     """Добавление демонстрационных товаров"""
     from src.database.session import AsyncSessionLocal, init_db
     from src.database.models import Product, Category
-    from src.ai.vector_store import ProductVectorStore
+    from src.ai.vector_store import get_vector_store
     from sqlalchemy import select
     
     logger.info("Инициализация базы данных...")
@@ -335,13 +335,14 @@ async def add_demo_products():
         
         # Синхронизируем в векторное хранилище
         logger.info("Синхронизация в векторное хранилище...")
-        vector_store = ProductVectorStore()
+        vector_store = get_vector_store()
         
         # Загружаем категории для товаров
         for product in products:
             await session.refresh(product, ["category"])
         
         vector_store.add_products(products)
+        vector_store.flush()
         logger.info(f"Товаров в векторном хранилище: {vector_store.count}")
 
 
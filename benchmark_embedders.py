@@ -0,0 +1,149 @@
+"""
+Бенчмарк бэкендов модели эмбеддингов: PyTorch против ONNX Runtime
+
+Каждый бэкенд запускается в отдельном процессе, чтобы честно измерить
+время загрузки и пиковое потребление памяти (RSS). Векторы ONNX-моделей
+сравниваются с PyTorch по косинусной близости.
+
+Пример (после python export_onnx.py --quantize):
+    python benchmark_embedders.py --backends torch,onnx:./data/onnx/model.onnx,onnx:./data/onnx/model_int8.onnx
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+# Настройка логирования
+logger.remove()
+logger.add(
+    sys.stdout,
+    format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
+    level="INFO"
+)
+
+PRODUCTS = ["холодильник", "духовой шкаф", "посудомоечная машина", "варочная панель", "вытяжка"]
+BRANDS = ["Bosch", "Miele", "Samsung", "LG", "Electrolux", "Smeg"]
+
+
+def make_texts(count: int, seed: int = 42):
+    """Запросы и описания товаров разной длины"""
+    rng = np.random.default_rng(seed)
+    queries = [
+        f"{PRODUCTS[i % len(PRODUCTS)]} {BRANDS[int(rng.integers(len(BRANDS)))]} до {int(rng.integers(20, 300))} тысяч"
+        for i in range(count)
+    ]
+    documents = [
+        f"Товар: {PRODUCTS[i % len(PRODUCTS)].capitalize()} {BRANDS[i % len(BRANDS)]} модель {i} | "
+        f"Бренд: {BRANDS[i % len(BRANDS)]} | "
+        + " ".join(["Надёжная техника с расширенными функциями и высоким классом энергоэффективности."]
+                   * int(rng.integers(1, 6)))
+        for i in range(count)
+    ]
+    return queries, documents
+
+
+def run_worker(backend: str, model_name: str, queries_count: int, batch_size: int, output: Path):
+    """Измерения одного бэкенда (выполняется в отдельном процессе)"""
+    from export_onnx import VALIDATION_TEXTS
+    
+    queries, documents = make_texts(queries_count)
+    
+    started = time.perf_counter()
+    from src.ai.embedders import create_embedder
+    name, _, onnx_path = backend.partition(":")
+    embedder = create_embedder(name, model_name=model_name, onnx_path=Path(onnx_path))
+    embedder.encode("прогрев")
+    load_seconds = time.perf_counter() - started
+    
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        embedder.encode(query)
+        latencies.append((time.perf_counter() - started) * 1000)
+    
+    started = time.perf_counter()
+    embedder.encode(documents, batch_size=batch_size)
+    throughput = len(documents) / (time.perf_counter() - started)
+    
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss_mb = rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+    
+    np.save(output.with_suffix(".npy"), np.asarray(embedder.encode(VALIDATION_TEXTS), dtype=np.float32))
+    output.write_text(json.dumps({
+        "load_s": load_seconds,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "docs_per_s": throughput,
+        "peak_rss_mb": rss_mb,
+    }))
+
+
+def main():
+    from src.ai.embedders import EMBEDDING_MODEL
+    
+    parser = argparse.ArgumentParser(description="Бенчмарк бэкендов модели эмбеддингов")
+    parser.add_argument(
+        "--backends",
+        default="torch,onnx:./data/onnx/model.onnx",
+        help="Бэкенды через запятую: torch, onnx:<путь к .onnx>",
+    )
+    parser.add_argument("--model", default=EMBEDDING_MODEL, help="Модель sentence-transformers")
+    parser.add_argument("--queries", type=int, default=200, help="Одиночных запросов и документов")
+    parser.add_argument("--batch-size", type=int, default=64, help="Размер батча документов")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.worker:
+        run_worker(args.worker, args.model, args.queries, args.batch_size, Path(args.output))
+        return
+    
+    from export_onnx import compare
+    
+    report = {}
+    vectors = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for i, backend in enumerate(args.backends.split(",")):
+            output = Path(tmp) / f"backend_{i}.json"
+            process = subprocess.run([
+                sys.executable, __file__,
+                "--worker", backend,
+                "--output", str(output),
+                "--model", args.model,
+                "--queries", str(args.queries),
+                "--batch-size", str(args.batch_size),
+            ])
+            if process.returncode != 0:
+                logger.error(f"{backend}: замер завершился с ошибкой")
+                continue
+            
+            stats = json.loads(output.read_text())
+            report[backend] = stats
+            vectors[backend] = np.load(output.with_suffix(".npy"))
+            
+            logger.info(
+                f"{backend}: загрузка {stats['load_s']:.1f} с | "
+                f"запрос p50 {stats['p50_ms']:.1f} мс, p95 {stats['p95_ms']:.1f} мс | "
+                f"{stats['docs_per_s']:.0f} документов/с | RSS {stats['peak_rss_mb']:.0f} МБ"
+            )
+    
+    if "torch" in vectors:
+        for backend, candidate in vectors.items():
+            if backend == "torch":
+                continue
+            result = compare(vectors["torch"], candidate)
+            logger.info(
+                f"{backend} против torch: мин. косинус {result['min_cosine']:.5f}, "
+                f"средний {result['mean_cosine']:.5f}, макс. расхождение {result['max_abs_diff']:.5f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
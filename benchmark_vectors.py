@@ -0,0 +1,260 @@
+"""
+Бенчмарк бэкендов векторного индекса на синтетическом каталоге
+
+Модель эмбеддингов не нужна: индексы заполняются случайными векторами
+с реалистичными метаданными (категории, бренды, цены, наличие), а запросы
+выполняются с тем же набором фильтров, что использует агент.
+
+Холодный старт (открытие индекса и первый поиск, как у новой реплики бота
+или API) замеряется в отдельном процессе. Для NumPy-индексов дополнительно
+замеряется открытие снимка (VECTOR_BACKEND=snapshot).
+
+Суффикс @category включает шарды по категориям (VECTOR_PARTITION_BY=category);
+задержки выводятся отдельно для запросов с фильтром категории и без него.
+
+Пример:
+    python benchmark_vectors.py --products 50000 --queries 500
+    python benchmark_vectors.py --backends numpy,numpy:float16,numpy:int8
+    python benchmark_vectors.py --backends chroma,chroma@category,numpy,numpy@category
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+from loguru import logger
+
+# Настройка логирования
+logger.remove()
+logger.add(
+    sys.stdout,
+    format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
+    level="INFO"
+)
+
+CATEGORIES = [f"Категория {i}" for i in range(20)]
+BRANDS = [f"Бренд {i}" for i in range(50)]
+
+
+def make_catalog(products: int, dim: int, seed: int = 42):
+    """Синтетический каталог: векторы сгруппированы по категориям"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(len(CATEGORIES), dim)).astype(np.float32)
+    
+    categories = rng.integers(0, len(CATEGORIES), size=products)
+    embeddings = centers[categories] + 0.5 * rng.normal(size=(products, dim)).astype(np.float32)
+    
+    ids = [str(i + 1) for i in range(products)]
+    documents = [f"Товар {i + 1}" for i in range(products)]
+    metadatas = [
+        {
+            "product_id": i + 1,
+            "name": f"Товар {i + 1}",
+            "brand": BRANDS[int(rng.integers(0, len(BRANDS)))],
+            "price": float(rng.integers(5_000, 500_000)),
+            "in_stock": bool(rng.random() < 0.8),
+            "category": CATEGORIES[int(categories[i])],
+        }
+        for i in range(products)
+    ]
+    return ids, embeddings, documents, metadatas
+
+
+def make_queries(count: int, dim: int, seed: int = 7) -> List[Dict[str, Any]]:
+    """Запросы со случайным набором фильтров, как у search_products"""
+    rng = np.random.default_rng(seed)
+    queries = []
+    for _ in range(count):
+        filters: Dict[str, Any] = {"in_stock_only": bool(rng.random() < 0.7)}
+        if rng.random() < 0.6:
+            filters["category"] = CATEGORIES[int(rng.integers(0, len(CATEGORIES)))]
+        if rng.random() < 0.4:
+            filters["brand"] = BRANDS[int(rng.integers(0, len(BRANDS)))]
+        if rng.random() < 0.3:
+            filters["max_price"] = float(rng.integers(20_000, 200_000))
+        queries.append({
+            "embedding": rng.normal(size=(1, dim)).astype(np.float32),
+            "filters": filters,
+        })
+    return queries
+
+
+def fill(index, ids, embeddings, documents, metadatas, chunk_size: int) -> float:
+    """Заполнить индекс порциями, вернуть время в секундах"""
+    started = time.perf_counter()
+    chunk_size = min(chunk_size, index.max_batch_size)
+    for start in range(0, len(ids), chunk_size):
+        end = start + chunk_size
+        index.upsert(ids[start:end], embeddings[start:end], documents[start:end], metadatas[start:end])
+    index.flush()
+    return time.perf_counter() - started
+
+
+def run_queries(index, queries: List[Dict[str, Any]], n_results: int) -> Dict[str, float]:
+    """Прогнать запросы и собрать статистику задержек"""
+    latencies = []
+    by_category = []
+    short = 0
+    results = []
+    
+    for query in queries:
+        started = time.perf_counter()
+        found = index.query(query["embedding"], n_results, query["filters"])[0]
+        latencies.append((time.perf_counter() - started) * 1000)
+        by_category.append("category" in query["filters"])
+        results.append([hit["id"] for hit in found])
+        if len(found) < n_results:
+            short += 1
+    
+    latencies = np.array(latencies)
+    by_category = np.array(by_category)
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "category_p50_ms": float(np.percentile(latencies[by_category], 50)) if by_category.any() else 0.0,
+        "other_p50_ms": float(np.percentile(latencies[~by_category], 50)) if (~by_category).any() else 0.0,
+        "qps": float(len(queries) / (latencies.sum() / 1000)),
+        "short_results": short,
+        "results": results,
+    }
+
+
+def open_index(kind: str, path: Path, dtype: str = "float32"):
+    """Открыть сохранённый индекс: chroma, numpy или snapshot (@category — с шардами)"""
+    from src.ai.indexes import create_index
+    
+    backend, _, partition_by = kind.partition("@")
+    return create_index(
+        backend,
+        chroma_path=path,
+        numpy_path=path,
+        vector_dtype=dtype,
+        snapshot_path=path,
+        partition_by=partition_by,
+    )
+
+
+def run_cold_start_worker(kind: str, path: Path, dtype: str, dim: int) -> None:
+    """Открыть индекс и выполнить первый поиск (выполняется в отдельном процессе)"""
+    import src.ai.indexes  # время импорта не входит в замер
+    
+    query = make_queries(1, dim)[0]
+    
+    started = time.perf_counter()
+    index = open_index(kind, path, dtype)
+    index.query(query["embedding"], 1, query["filters"])
+    seconds = time.perf_counter() - started
+    
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "seconds": seconds,
+        "peak_rss_mb": rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024,
+    }))
+
+
+def cold_start(kind: str, path: Path, dtype: str, dim: int) -> Dict[str, float]:
+    """Замерить холодный старт индекса в новом процессе"""
+    output = subprocess.run(
+        [sys.executable, __file__, "--dim", str(dim), "--worker", f"{kind}|{dtype}|{path}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк векторных индексов")
+    parser.add_argument("--products", type=int, default=20000, help="Размер каталога")
+    parser.add_argument("--queries", type=int, default=300, help="Количество запросов")
+    parser.add_argument("--dim", type=int, default=384, help="Размерность эмбеддингов")
+    parser.add_argument("--top-k", type=int, default=5, help="Результатов на запрос")
+    parser.add_argument(
+        "--backends",
+        default="chroma,numpy,numpy:float16,numpy:int8",
+        help="Бэкенды через запятую (chroma, numpy[:float16|int8], с суффиксом @category — шарды)",
+    )
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.worker:
+        kind, dtype, path = args.worker.split("|", 2)
+        run_cold_start_worker(kind, Path(path), dtype, args.dim)
+        return
+    
+    from src.ai.indexes import NumpyIndex
+    
+    logger.info(f"Каталог: {args.products} товаров, размерность {args.dim}")
+    ids, embeddings, documents, metadatas = make_catalog(args.products, args.dim)
+    queries = make_queries(args.queries, args.dim)
+    
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in args.backends.split(","):
+            name, _, partition_by = backend.partition("@")
+            suffix = f"_{partition_by}" if partition_by else ""
+            if name == "chroma":
+                kind, path, dtype = "chroma", Path(tmp) / f"chroma{suffix}", "float32"
+            elif name.startswith("numpy"):
+                dtype = name.partition(":")[2] or "float32"
+                kind, path = "numpy", Path(tmp) / f"numpy_{dtype}{suffix}.npz"
+            else:
+                logger.warning(f"Неизвестный бэкенд: {backend}")
+                continue
+            
+            if partition_by:
+                kind = f"{kind}@{partition_by}"
+            index = open_index(kind, path, dtype)
+            build_seconds = fill(index, ids, embeddings, documents, metadatas, chunk_size=1000)
+            stats = run_queries(index, queries, args.top_k)
+            stats["build_s"] = build_seconds
+            report[backend] = stats
+            
+            memory = ""
+            if isinstance(index, NumpyIndex):
+                memory = (
+                    f" | векторы {index.memory_bytes() / 1024 / 1024:.1f} МБ"
+                    f" | файл {index.path.stat().st_size / 1024 / 1024:.1f} МБ"
+                )
+            
+            logger.info(
+                f"{backend:>15}: построение {build_seconds:.1f} с | "
+                f"p50 {stats['p50_ms']:.2f} мс | p95 {stats['p95_ms']:.2f} мс | "
+                f"p50 с категорией {stats['category_p50_ms']:.2f} мс, без {stats['other_p50_ms']:.2f} мс | "
+                f"{stats['qps']:.0f} запросов/с | неполных выдач: {stats['short_results']}"
+                f"{memory}"
+            )
+            
+            starts = {backend: cold_start(kind, path, dtype, args.dim)}
+            if isinstance(index, NumpyIndex):
+                snapshot_path = path.with_suffix(".snapshot")
+                index.save_snapshot(snapshot_path)
+                starts[f"{backend} (снимок)"] = cold_start("snapshot", snapshot_path, dtype, args.dim)
+            for name, start in starts.items():
+                logger.info(
+                    f"{name}: холодный старт {start['seconds']:.2f} с, "
+                    f"пиковая память {start['peak_rss_mb']:.0f} МБ"
+                )
+    
+    # Точный поиск NumPy (float32) служит эталоном для оценки полноты
+    # HNSW и сжатых представлений векторов
+    if "numpy" in report:
+        exact = report["numpy"]["results"]
+        for backend, stats in report.items():
+            if backend == "numpy":
+                continue
+            recall = np.mean([
+                len(set(a) & set(e)) / len(e) if e else 1.0
+                for a, e in zip(stats["results"], exact)
+            ])
+            logger.info(f"Полнота (recall@{args.top_k}) {backend} относительно точного поиска: {recall:.3f}")
+
+
+if __name__ == "__main__":
+    main()
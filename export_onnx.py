@@ -0,0 +1,100 @@
+"""
+Экспорт модели эмбеддингов в ONNX для бэкенда EMBEDDING_BACKEND=onnx
+
+После экспорта векторы ONNX-модели сравниваются с исходной моделью
+на PyTorch; при расхождении больше допустимого скрипт завершается с ошибкой.
+
+Пример:
+    python export_onnx.py --quantize
+    # затем в .env: EMBEDDING_BACKEND=onnx, ONNX_MODEL_PATH=./data/onnx/model_int8.onnx
+"""
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+# Настройка логирования
+logger.remove()
+logger.add(
+    sys.stdout,
+    format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
+    level="INFO"
+)
+
+# Тексты для проверки: запросы покупателей и описания товаров
+VALIDATION_TEXTS = [
+    "холодильник",
+    "Samsung RB37A5470SA",
+    "встраиваемый духовой шкаф Bosch с пиролизом",
+    "тихая посудомоечная машина 45 см",
+    "Товар: Варочная панель Miele KM 7201 FR | Бренд: Miele | Категория: Варочные панели | "
+    "Индукционная варочная панель с функцией PowerFlex и автоматическим определением посуды",
+    "Вытяжка купольная 90 см, производительность 800 м3/ч, сенсорное управление",
+    "what is the quietest dishwasher",
+    "",
+]
+
+
+def compare(reference: np.ndarray, candidate: np.ndarray) -> dict:
+    """Косинусная близость и максимальное расхождение векторов"""
+    reference = np.asarray(reference, dtype=np.float32)
+    candidate = np.asarray(candidate, dtype=np.float32)
+    cosine = (reference * candidate).sum(axis=1) / np.maximum(
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1), 1e-12
+    )
+    return {
+        "min_cosine": float(cosine.min()),
+        "mean_cosine": float(cosine.mean()),
+        "max_abs_diff": float(np.abs(reference - candidate).max()),
+    }
+
+
+def main():
+    from src.ai.embedders import EMBEDDING_MODEL, OnnxEmbedder, TorchEmbedder, export_onnx
+    
+    parser = argparse.ArgumentParser(description="Экспорт модели эмбеддингов в ONNX")
+    parser.add_argument("--model", default=EMBEDDING_MODEL, help="Модель sentence-transformers")
+    parser.add_argument("--output", default="./data/onnx", help="Каталог для экспорта")
+    parser.add_argument("--quantize", action="store_true", help="Дополнительно сохранить int8-версию")
+    parser.add_argument(
+        "--min-cosine",
+        type=float,
+        default=0.999,
+        help="Минимально допустимая косинусная близость к PyTorch",
+    )
+    parser.add_argument(
+        "--min-cosine-int8",
+        type=float,
+        default=0.98,
+        help="То же для int8-версии",
+    )
+    args = parser.parse_args()
+    
+    model_path = export_onnx(args.model, Path(args.output), quantize=args.quantize)
+    
+    candidates = {Path(args.output) / "model.onnx": args.min_cosine}
+    if args.quantize:
+        candidates[model_path] = args.min_cosine_int8
+    
+    reference = TorchEmbedder(args.model).encode(VALIDATION_TEXTS)
+    failed = False
+    for path, min_cosine in candidates.items():
+        result = compare(reference, OnnxEmbedder(path).encode(VALIDATION_TEXTS))
+        logger.info(
+            f"{path.name} против PyTorch: мин. косинус {result['min_cosine']:.5f}, "
+            f"средний {result['mean_cosine']:.5f}, макс. расхождение {result['max_abs_diff']:.5f}"
+        )
+        if result["min_cosine"] < min_cosine:
+            logger.error(f"{path.name}: векторы расходятся с исходной моделью (порог {min_cosine})")
+            failed = True
+    
+    if failed:
+        sys.exit(1)
+    
+    logger.info(f"Готово. Укажите в .env: EMBEDDING_BACKEND=onnx, ONNX_MODEL_PATH={model_path}")
+
+
+if __name__ == "__main__":
+    main()
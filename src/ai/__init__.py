@@ -1,5 +1,4 @@
 from src.ai.agent import SalesAgent
-from src.ai.vector_store import ProductVectorStore
-
-__all__ = ["SalesAgent", "ProductVectorStore"]
+from src.ai.vector_store import ProductVectorStore, get_vector_store, init_vector_store
 
+__all__ = ["SalesAgent", "ProductVectorStore", "get_vector_store", "init_vector_store"]
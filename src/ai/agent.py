@@ -2,16 +2,23 @@
 AI-агент продавец бытовой техники
 """
 import json
-from typing import List, Optional, Dict, Any, Tuple
+import time
+import asyncio
+from typing import AsyncIterator, List, Optional, Dict, Any, Tuple
 from loguru import logger
-from openai import AsyncOpenAI
+from openai.types.chat.chat_completion_message_tool_call import ChatCompletionMessageToolCall, Function
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload
 
 from src.config import get_settings
-from src.database.models import Product, Category
-from src.ai.vector_store import ProductVectorStore
+from src.database.models import Product
+from src.ai.vector_store import ProductVectorStore, get_vector_store
+from src.ai.memory import ConversationMemory, get_token_counter
+from src.ai.projection import compact_product, compact_products
+from src.ai.answer_cache import AnswerCache, get_answer_cache
+from src.ai.tool_cache import get_tool_cache
+from src.ai.openai_client import get_openai_client
 
 settings = get_settings()
 
@@ -64,7 +71,8 @@ class SalesAgent:
 - get_product_recommendations: рекомендации товаров
 - create_product_set: подбор комплекта техники
 
-Всегда используй эти функции для получения актуальной информации о товарах."""
+Всегда используй эти функции для получения актуальной информации о товарах.
+Поиск и рекомендации возвращают краткие данные о товарах (cat — категория, desc — описание, specs — главные характеристики, stock — наличие, old — цена до скидки). Полное описание и все характеристики получай через get_product_details."""
 
     TOOLS = [
         {
@@ -116,6 +124,12 @@ class SalesAgent:
                         "product_id": {
                             "type": "integer",
                             "description": "ID товара"
+                        },
+                        "detail": {
+                            "type": "string",
+                            "enum": ["standard", "full"],
+                            "description": "Уровень детализации: standard — описание и основные характеристики, full — полное описание и все характеристики (только если клиенту нужны подробности)",
+                            "default": "standard"
                         }
                     },
                     "required": ["product_id"]
@@ -126,7 +140,7 @@ class SalesAgent:
             "type": "function", 
             "function": {
                 "name": "get_categories",
-                "description": "Получить список всех категорий товаров",
+                "description": "Получить список всех категорий товаров с количеством товаров и диапазоном цен",
                 "parameters": {
                     "type": "object",
                     "properties": {}
@@ -181,12 +195,50 @@ class SalesAgent:
             }
         }
     ]
+    
+    # Значения аргументов по умолчанию из описания функций (для ключей кэша результатов)
+    TOOL_DEFAULTS = {
+        tool["function"]["name"]: {
+            name: spec["default"]
+            for name, spec in tool["function"]["parameters"]["properties"].items()
+            if "default" in spec
+        }
+        for tool in TOOLS
+    }
 
-    def __init__(self, db_session: AsyncSession):
-        self.client = AsyncOpenAI(api_key=settings.openai_api_key)
+    SUMMARY_PROMPT = """Ты ведёшь краткое содержание разговора консультанта магазина бытовой техники с клиентом.
+Дополни краткое содержание новыми репликами. Сохрани потребности, бюджет и предпочтения клиента, товары, о которых шла речь (название, модель, цена), и договорённости. Пиши кратко, без вступлений."""
+    
+    FALLBACK_RESPONSE = "Извините, не могу ответить на этот вопрос."
+    ERROR_RESPONSE = "Извините, произошла техническая ошибка. Пожалуйста, попробуйте ещё раз или свяжитесь с нами по телефону."
+    
+    def __init__(
+        self,
+        db_session: AsyncSession,
+        vector_store: Optional[ProductVectorStore] = None
+    ):
+        # Клиент общий для процесса: соединения с API переиспользуются между сообщениями
+        self.client = get_openai_client()
         self.db = db_session
-        self.vector_store = ProductVectorStore()
+        # Вызовы функций выполняются параллельно, а AsyncSession не допускает
+        # одновременных запросов: обращения к БД идут по очереди
+        self._db_lock = asyncio.Lock()
+        # Хранилище общее для процесса: модель эмбеддингов не загружается на каждое сообщение.
+        # Пока оно создаётся, get_vector_store() блокирует поток, поэтому
+        # асинхронные обработчики передают хранилище из aget_vector_store()
+        self.vector_store = vector_store or get_vector_store()
         self.model = settings.openai_model
+        # История в запросе ограничена бюджетом токенов, ранние реплики сворачиваются
+        self.memory = ConversationMemory(
+            get_token_counter(self.model),
+            settings.history_token_budget,
+            self._summarize,
+        )
+        self.usage: Dict[str, int] = {}
+        # Ответы на типовые вопросы, общие для процесса
+        self.answer_cache = get_answer_cache()
+        # Результаты функций, общие для процесса: одинаковые вызовы выполняются один раз
+        self.tool_cache = get_tool_cache()
         
         # Подготавливаем системный промпт
         self.system_prompt = self.SYSTEM_PROMPT.format(
@@ -209,7 +261,7 @@ class SalesAgent:
         limit: int = 5
     ) -> List[Dict[str, Any]]:
         """Поиск товаров через векторное хранилище"""
-        results = self.vector_store.search(
+        results = await self.vector_store.asearch(
             query=query,
             n_results=limit,
             category=category,
@@ -219,32 +271,46 @@ class SalesAgent:
             in_stock_only=in_stock_only,
         )
         
-        # Получаем полные данные из БД
-        products = []
-        for result in results:
-            product_id = result.get("id") or result.get("metadata", {}).get("product_id")
-            if product_id:
-                product = await self.db.get(Product, product_id)
-                if product:
-                    products.append(product.to_dict())
+        # Получаем полные данные из БД одним запросом
+        return await self._load_products([
+            result.get("id") or result.get("metadata", {}).get("product_id")
+            for result in results
+        ])
+    
+    async def _load_products(self, product_ids: List[Optional[int]]) -> List[Dict[str, Any]]:
+        """Загрузить товары из БД одним запросом, сохранив порядок ID"""
+        product_ids = [product_id for product_id in product_ids if product_id]
+        if not product_ids:
+            return []
         
-        return products
+        async with self._db_lock:
+            result = await self.db.execute(
+                select(Product)
+                .options(selectinload(Product.category))
+                .where(Product.id.in_(product_ids))
+            )
+        by_id = {product.id: product for product in result.scalars().all()}
+        
+        return [
+            by_id[product_id].to_dict()
+            for product_id in dict.fromkeys(product_ids)
+            if product_id in by_id
+        ]
     
     async def _get_product_details(self, product_id: int) -> Optional[Dict[str, Any]]:
         """Получить детали товара"""
-        result = await self.db.execute(
-            select(Product)
-            .options(selectinload(Product.category))
-            .where(Product.id == product_id)
-        )
+        async with self._db_lock:
+            result = await self.db.execute(
+                select(Product)
+                .options(selectinload(Product.category))
+                .where(Product.id == product_id)
+            )
         product = result.scalar_one_or_none()
         return product.to_dict() if product else None
     
-    async def _get_categories(self) -> List[str]:
-        """Получить список категорий"""
-        result = await self.db.execute(select(Category.name).distinct())
-        categories = result.scalars().all()
-        return list(categories)
+    async def _get_categories(self) -> List[Dict[str, Any]]:
+        """Получить список категорий с количеством товаров и диапазоном цен"""
+        return await self.vector_store.aget_category_facets()
     
     async def _get_recommendations(
         self, 
@@ -252,29 +318,13 @@ class SalesAgent:
         count: int = 3
     ) -> List[Dict[str, Any]]:
         """Получить рекомендации для товара"""
-        product = await self.db.get(Product, product_id)
-        if not product:
-            return []
-        
-        # Ищем похожие товары через векторный поиск
-        query = f"{product.name} {product.brand or ''} {product.category.name if product.category else ''}"
-        results = self.vector_store.search(
-            query=query,
-            n_results=count + 1,  # +1 потому что найдём сам товар
+        # Похожие товары берём из предрассчитанной таблицы соседей
+        results = await self.vector_store.aget_similar(
+            product_id,
+            count=count,
             in_stock_only=True,
         )
-        
-        recommendations = []
-        for result in results:
-            rec_id = result.get("id") or result.get("metadata", {}).get("product_id")
-            if rec_id and rec_id != product_id:
-                rec_product = await self.db.get(Product, rec_id)
-                if rec_product:
-                    recommendations.append(rec_product.to_dict())
-                    if len(recommendations) >= count:
-                        break
-        
-        return recommendations
+        return await self._load_products([result["id"] for result in results])
     
     async def _create_product_set(
         self,
@@ -321,16 +371,26 @@ class SalesAgent:
         
         max_price_per_item = budget / len(queries) if budget else None
         
-        for query in queries:
-            products = await self._search_products(
-                query=query,
-                max_price=max_price_per_item,
-                in_stock_only=True,
-                limit=1
-            )
-            
-            if products:
-                product = products[0]
+        # Все позиции ищутся одним батчем, товары читаются из БД одним запросом
+        results = await self.vector_store.asearch_many(
+            queries,
+            n_results=1,
+            max_price=max_price_per_item,
+            in_stock_only=True,
+        )
+        found = [
+            (query, hits[0].get("id") or hits[0].get("metadata", {}).get("product_id"))
+            for query, hits in zip(queries, results)
+            if hits
+        ]
+        products = {
+            product["id"]: product
+            for product in await self._load_products([product_id for _, product_id in found])
+        }
+        
+        for query, product_id in found:
+            product = products.get(product_id)
+            if product:
                 product_set["items"].append({
                     "category": query,
                     "product": product
@@ -345,20 +405,248 @@ class SalesAgent:
         function_name: str, 
         arguments: Dict[str, Any]
     ) -> Any:
-        """Выполнить функцию по имени"""
+        """
+        Выполнить функцию по имени
+        
+        Товары возвращаются в компактном виде (см. projection.py): результат
+        целиком попадает в контекст модели.
+        """
         if function_name == "search_products":
-            return await self._search_products(**arguments)
+            return compact_products(await self._search_products(**arguments))
         elif function_name == "get_product_details":
-            return await self._get_product_details(**arguments)
+            arguments = dict(arguments)
+            detail = arguments.pop("detail", None) or "standard"
+            product = await self._get_product_details(**arguments)
+            return compact_product(product, detail) if product else None
         elif function_name == "get_categories":
             return await self._get_categories()
         elif function_name == "get_product_recommendations":
-            return await self._get_recommendations(**arguments)
+            return compact_products(await self._get_recommendations(**arguments))
         elif function_name == "create_product_set":
-            return await self._create_product_set(**arguments)
+            product_set = await self._create_product_set(**arguments)
+            for item in product_set["items"]:
+                item["product"] = compact_product(item["product"])
+            return product_set
         else:
             return {"error": f"Неизвестная функция: {function_name}"}
     
+    async def _execute_tool_calls(self, tool_calls) -> List[Dict[str, str]]:
+        """
+        Выполнить вызовы функций одного ответа модели
+        
+        Вызовы независимы и выполняются одновременно (не больше
+        agent_tool_concurrency за раз). Результаты возвращаются в порядке
+        вызовов, как их перечислила модель. Результаты известных функций
+        берутся из кэша, если такой же вызов уже выполнялся для текущей
+        версии каталога или выполняется прямо сейчас.
+        """
+        semaphore = asyncio.Semaphore(max(1, settings.agent_tool_concurrency))
+        durations = [0.0] * len(tool_calls)
+        version = await self.vector_store.acatalog_version() if self.tool_cache is not None else None
+        
+        async def run(position: int, tool_call) -> str:
+            function_name = tool_call.function.name
+            arguments = json.loads(tool_call.function.arguments)
+            
+            async with semaphore:
+                logger.info(f"Вызов функции: {function_name}({arguments})")
+                started = time.perf_counter()
+                try:
+                    if self.tool_cache is None or function_name not in self.TOOL_DEFAULTS:
+                        return await self._call_function(function_name, arguments)
+                    key = self.tool_cache.key(function_name, arguments, self.TOOL_DEFAULTS[function_name])
+                    return await self.tool_cache.get_or_compute(
+                        key,
+                        version,
+                        lambda: self._call_function(function_name, arguments),
+                    )
+                finally:
+                    durations[position] = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        # Дожидаемся всех вызовов даже при ошибке одного из них: остальные
+        # ещё могут использовать сессию БД
+        results = await asyncio.gather(
+            *(run(position, tool_call) for position, tool_call in enumerate(tool_calls)),
+            return_exceptions=True,
+        )
+        elapsed = time.perf_counter() - started
+        
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        
+        if len(tool_calls) > 1:
+            logger.info(
+                f"Функций: {len(tool_calls)}, выполнено за {elapsed:.2f} с "
+                f"вместо {sum(durations):.2f} с (экономия {max(0.0, sum(durations) - elapsed):.2f} с)"
+            )
+        
+        return [
+            {
+                "role": "tool",
+                "tool_call_id": tool_call.id,
+                "content": result
+            }
+            for tool_call, result in zip(tool_calls, results)
+        ]
+    
+    async def _call_function(self, function_name: str, arguments: Dict[str, Any]) -> str:
+        """Выполнить функцию и сериализовать результат для сообщения tool"""
+        result = await self._execute_function(function_name, arguments)
+        return json.dumps(result, ensure_ascii=False, default=str, separators=(",", ":"))
+    
+    async def _complete(self, messages: List[Dict[str, Any]], stream: bool = False):
+        """Запрос к модели с описанием функций"""
+        if stream:
+            # Расход токенов приходит последним фрагментом потока
+            return await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                tools=self.TOOLS,
+                tool_choice="auto",
+                temperature=0.7,
+                max_tokens=2000,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+        
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            tools=self.TOOLS,
+            tool_choice="auto",
+            temperature=0.7,
+            max_tokens=2000,
+        )
+        self._record_usage(response.usage)
+        return response
+    
+    async def _summarize(self, summary: Optional[str], messages: List[Dict[str, Any]]) -> str:
+        """Дополнить краткое содержание разговора репликами"""
+        transcript = "\n".join(
+            f"{'Клиент' if message['role'] == 'user' else 'Консультант'}: {message['content']}"
+            for message in messages
+        )
+        if summary:
+            content = f"Текущее краткое содержание:\n{summary}\n\nНовые реплики:\n{transcript}"
+        else:
+            content = f"Реплики:\n{transcript}"
+        
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": self.SUMMARY_PROMPT},
+                {"role": "user", "content": content},
+            ],
+            temperature=0.3,
+            max_tokens=settings.history_summary_tokens,
+        )
+        return (response.choices[0].message.content or "").strip()
+    
+    def _build_messages(
+        self,
+        user_message: str,
+        conversation_history: List[Dict[str, str]]
+    ) -> List[Dict[str, Any]]:
+        """Сообщения для модели: системный промпт, история и новое сообщение"""
+        history, history_tokens = self.memory.context(conversation_history)
+        # Счётчики расхода токенов за ход
+        self.usage = {
+            "history_tokens": history_tokens,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "calls": 0,
+        }
+        
+        messages = [{"role": "system", "content": self.system_prompt}]
+        messages.extend(history)
+        messages.append({"role": "user", "content": user_message})
+        return messages
+    
+    async def _cached_answer(
+        self,
+        user_message: str,
+        conversation_history: List[Dict[str, str]]
+    ) -> Optional[str]:
+        """Ответ из семантического кэша (None — ответа нет или вопрос зависит от истории)"""
+        if self.answer_cache is None or not AnswerCache.can_answer(user_message, conversation_history):
+            return None
+        
+        started = time.perf_counter()
+        try:
+            version = await self.vector_store.acatalog_version()
+            answer = self.answer_cache.get(user_message, await self.vector_store.aembed_query(user_message), version)
+        except Exception as e:
+            logger.warning(f"Кэш ответов недоступен: {e}")
+            return None
+        
+        if answer is not None:
+            self.usage["history_tokens"] = 0
+            logger.info(f"Ответ из кэша за {(time.perf_counter() - started) * 1000:.1f} мс")
+        return answer
+    
+    async def _remember_answer(
+        self,
+        user_message: str,
+        conversation_history: List[Dict[str, str]],
+        answer: str,
+        used_tools: bool
+    ) -> None:
+        """Сохранить ответ в семантический кэш (used_tools — для ответа вызывались функции)"""
+        if self.answer_cache is None or not AnswerCache.can_store(user_message, conversation_history, used_tools):
+            return
+        if answer in (self.FALLBACK_RESPONSE, self.ERROR_RESPONSE):
+            return
+        
+        try:
+            # Эмбеддинг вопроса уже в кэше запросов: его посчитали при поиске в кэше ответов
+            embedding = await self.vector_store.aembed_query(user_message)
+            self.answer_cache.put(user_message, embedding, answer, self.vector_store.catalog_version)
+        except Exception as e:
+            logger.warning(f"Ответ не сохранён в кэш: {e}")
+    
+    def _record_usage(self, usage) -> None:
+        """Учесть расход токенов одного запроса к модели"""
+        if usage is None:
+            return
+        self.usage["prompt_tokens"] += int(usage.prompt_tokens or 0)
+        self.usage["completion_tokens"] += int(usage.completion_tokens or 0)
+        self.usage["calls"] += 1
+    
+    def _finish_turn(
+        self,
+        conversation_history: List[Dict[str, str]],
+        user_message: str,
+        response: str
+    ) -> List[Dict[str, str]]:
+        """Записать расход токенов хода и вернуть обновлённую историю"""
+        logger.info(
+            f"Токены за ход: запрос {self.usage['prompt_tokens']} "
+            f"(история {self.usage['history_tokens']}), ответ {self.usage['completion_tokens']}, "
+            f"запросов к модели {self.usage['calls']}"
+        )
+        return self.memory.append(conversation_history, user_message, response)
+    
+    @staticmethod
+    def _assistant_message(content: Optional[str], tool_calls) -> Dict[str, Any]:
+        """Ответ ассистента с вызовами функций для истории запроса"""
+        return {
+            "role": "assistant",
+            "content": content,
+            "tool_calls": [
+                {
+                    "id": tc.id,
+                    "type": tc.type,
+                    "function": {
+                        "name": tc.function.name,
+                        "arguments": tc.function.arguments
+                    }
+                }
+                for tc in tool_calls
+            ]
+        }
+    
     async def chat(
         self, 
         user_message: str,
@@ -379,93 +667,128 @@ class SalesAgent:
             conversation_history = []
         
         # Добавляем системное сообщение если его нет
-        messages = [{"role": "system", "content": self.system_prompt}]
-        messages.extend(conversation_history)
-        messages.append({"role": "user", "content": user_message})
+        messages = self._build_messages(user_message, conversation_history)
         
         try:
-            # Первый запрос к модели
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                tools=self.TOOLS,
-                tool_choice="auto",
-                temperature=0.7,
-                max_tokens=2000,
-            )
+            # Типовой вопрос: ответ из семантического кэша, без запросов к модели
+            cached = await self._cached_answer(user_message, conversation_history)
+            if cached is not None:
+                return cached, self._finish_turn(conversation_history, user_message, cached)
             
+            # Первый запрос к модели
+            response = await self._complete(messages)
             assistant_message = response.choices[0].message
             
             # Обрабатываем вызовы функций
+            used_tools = bool(assistant_message.tool_calls)
             while assistant_message.tool_calls:
                 # Добавляем ответ ассистента
-                messages.append({
-                    "role": "assistant",
-                    "content": assistant_message.content,
-                    "tool_calls": [
-                        {
-                            "id": tc.id,
-                            "type": tc.type,
-                            "function": {
-                                "name": tc.function.name,
-                                "arguments": tc.function.arguments
-                            }
-                        }
-                        for tc in assistant_message.tool_calls
-                    ]
-                })
+                messages.append(self._assistant_message(assistant_message.content, assistant_message.tool_calls))
                 
-                # Выполняем каждый вызов функции
-                for tool_call in assistant_message.tool_calls:
-                    function_name = tool_call.function.name
-                    arguments = json.loads(tool_call.function.arguments)
-                    
-                    logger.info(f"Вызов функции: {function_name}({arguments})")
-                    
-                    result = await self._execute_function(function_name, arguments)
-                    
-                    # Добавляем результат функции
-                    messages.append({
-                        "role": "tool",
-                        "tool_call_id": tool_call.id,
-                        "content": json.dumps(result, ensure_ascii=False, default=str)
-                    })
+                # Выполняем вызовы функций и добавляем результаты
+                messages.extend(await self._execute_tool_calls(assistant_message.tool_calls))
                 
                 # Получаем следующий ответ
-                response = await self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    tools=self.TOOLS,
-                    tool_choice="auto",
-                    temperature=0.7,
-                    max_tokens=2000,
-                )
-                
+                response = await self._complete(messages)
                 assistant_message = response.choices[0].message
             
             # Финальный ответ
-            final_response = assistant_message.content or "Извините, не могу ответить на этот вопрос."
+            final_response = assistant_message.content or self.FALLBACK_RESPONSE
+            await self._remember_answer(user_message, conversation_history, final_response, used_tools)
             
             # Обновляем историю (без системного промпта)
-            updated_history = conversation_history + [
-                {"role": "user", "content": user_message},
-                {"role": "assistant", "content": final_response}
-            ]
-            
-            # Ограничиваем историю последними 20 сообщениями
-            if len(updated_history) > 20:
-                updated_history = updated_history[-20:]
-            
-            return final_response, updated_history
+            return final_response, self._finish_turn(conversation_history, user_message, final_response)
             
         except Exception as e:
             logger.error(f"Ошибка при обработке сообщения: {e}")
-            error_response = "Извините, произошла техническая ошибка. Пожалуйста, попробуйте ещё раз или свяжитесь с нами по телефону."
-            
-            updated_history = conversation_history + [
-                {"role": "user", "content": user_message},
-                {"role": "assistant", "content": error_response}
-            ]
+            return self.ERROR_RESPONSE, self._finish_turn(conversation_history, user_message, self.ERROR_RESPONSE)
+    
+    async def chat_stream(
+        self,
+        user_message: str,
+        conversation_history: Optional[List[Dict[str, str]]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Обработать сообщение пользователя, отдавая ответ по мере генерации
+        
+        Args:
+            user_message: Сообщение от пользователя
+            conversation_history: История разговора
+        
+        Yields:
+            {"type": "delta", "text": ...} — очередной фрагмент ответа;
+            {"type": "done", "message": ..., "history": ..., "ttft": ...} — в конце.
+            Текст из "done" окончательный (при ошибке это сообщение об ошибке),
+            ttft — секунды до первого фрагмента (None, если текста не было)
+        """
+        if conversation_history is None:
+            conversation_history = []
+        
+        messages = self._build_messages(user_message, conversation_history)
+        started = time.perf_counter()
+        ttft = None
+        
+        try:
+            final_response = await self._cached_answer(user_message, conversation_history)
+            if final_response is not None:
+                ttft = time.perf_counter() - started
+                yield {"type": "delta", "text": final_response}
+            else:
+                used_tools = False
+                while True:
+                    content: List[str] = []
+                    # Вызовы функций приходят частями: index -> {id, name, arguments}
+                    calls: Dict[int, Dict[str, str]] = {}
+                    
+                    async for chunk in await self._complete(messages, stream=True):
+                        if chunk.usage is not None:
+                            self._record_usage(chunk.usage)
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta
+                        
+                        if delta.content:
+                            if ttft is None:
+                                ttft = time.perf_counter() - started
+                                logger.info(f"Первый фрагмент ответа через {ttft:.2f} с")
+                            content.append(delta.content)
+                            yield {"type": "delta", "text": delta.content}
+                        
+                        for call in delta.tool_calls or []:
+                            item = calls.setdefault(call.index, {"id": "", "name": "", "arguments": ""})
+                            if call.id:
+                                item["id"] = call.id
+                            if call.function is not None:
+                                item["name"] += call.function.name or ""
+                                item["arguments"] += call.function.arguments or ""
+                    
+                    if not calls:
+                        break
+                    used_tools = True
+                    
+                    tool_calls = [
+                        ChatCompletionMessageToolCall(
+                            id=item["id"],
+                            type="function",
+                            function=Function(name=item["name"], arguments=item["arguments"] or "{}"),
+                        )
+                        for _, item in sorted(calls.items())
+                    ]
+                    messages.append(self._assistant_message("".join(content) or None, tool_calls))
+                    messages.extend(await self._execute_tool_calls(tool_calls))
+                
+                final_response = "".join(content) or self.FALLBACK_RESPONSE
+                await self._remember_answer(user_message, conversation_history, final_response, used_tools)
             
-            return error_response, updated_history
+        except Exception as e:
+            logger.error(f"Ошибка при обработке сообщения: {e}")
+            final_response = self.ERROR_RESPONSE
+        
+        yield {
+            "type": "done",
+            "message": final_response,
+            "history": self._finish_turn(conversation_history, user_message, final_response),
+            "ttft": round(ttft, 3) if ttft is not None else None,
+            "usage": dict(self.usage),
+        }
 
@@ -0,0 +1,196 @@
+"""
+Семантический кэш ответов на типовые вопросы клиентов
+"""
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+
+from src.config import get_settings
+from src.ai.embeddings import QueryEmbeddingCache
+from src.ai.lexical import tokenize
+
+settings = get_settings()
+
+# Слова, отсылающие к предыдущим репликам: без истории такой вопрос не понять
+_CONTEXT_RE = re.compile(
+    r"\b(?:это|этот|эта|эту|эти|этого|этой|этим|этих|он|она|оно|они|его|её|ее|их|"
+    r"него|неё|нее|нему|ней|ним|них|такой|такая|такое|такие|такого|таких|тот|та|те|того|"
+    r"той|тех|первый|первая|первое|второй|вторая|второе|третий|третья|последний|"
+    r"последняя|предыдущий|ещё|еще|дешевле|дороже|подешевле|подороже|тоже|также)\b"
+    r"|^(?:а|и|но|ну)\b",
+    re.IGNORECASE,
+)
+
+
+class AnswerCache:
+    """
+    Ответы на вопросы, близкие по смыслу к уже заданным
+    
+    Ключ — эмбеддинг вопроса: сохранённый ответ возвращается, если
+    косинусная близость нового вопроса к сохранённому не ниже порога.
+    Кэш ограничен по размеру (LRU) и времени жизни записей и целиком
+    сбрасывается при смене версии каталога: в ответах есть цены и наличие.
+    
+    Кэшируются только ответы на первое сообщение разговора (они не зависят
+    от истории) и полученные без вызова функций: ответы с подобранными
+    товарами, ценами и наличием зависят от деталей вопроса. Из кэша отвечают на первое
+    сообщение и на вопросы без отсылок к предыдущим репликам ("доставка в
+    Подольск есть?").
+    
+    Близость эмбеддингов не различает числа и коды: "до 50000" и "до 80000",
+    "заказ 12345" и "заказ 12346" почти совпадают. Поэтому слова с цифрами
+    (суммы, номера, модели) нового вопроса должны в точности совпадать со
+    словами сохранённого.
+    """
+    
+    # Длинные сообщения редко повторяются и чаще содержат личные подробности
+    MAX_QUESTION_LENGTH = 200
+    
+    def __init__(self, max_size: int = 1000, ttl: float = 3600, threshold: float = 0.92):
+        """
+        Args:
+            max_size: Максимальное количество ответов
+            ttl: Время жизни ответа в секундах (0 — без ограничения)
+            threshold: Минимальная косинусная близость вопросов
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.version: Optional[str] = None
+        
+        # нормализованный вопрос -> (эмбеддинг, ответ, время записи, слова с цифрами)
+        self._items: "OrderedDict[str, Tuple[np.ndarray, str, float, FrozenSet[str]]]" = OrderedDict()
+        self._keys: List[str] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+    
+    @classmethod
+    def can_answer(cls, question: str, history: List[Dict[str, Any]]) -> bool:
+        """Можно ли ответить на вопрос из кэша"""
+        if len(question) > cls.MAX_QUESTION_LENGTH:
+            return False
+        return not history or not _CONTEXT_RE.search(question.strip())
+    
+    @classmethod
+    def can_store(cls, question: str, history: List[Dict[str, Any]], used_tools: bool = False) -> bool:
+        """Можно ли сохранить ответ на вопрос (ответ дан без истории разговора и вызова функций)"""
+        return not history and not used_tools and len(question) <= cls.MAX_QUESTION_LENGTH
+    
+    @staticmethod
+    def _numbers(question: str) -> FrozenSet[str]:
+        """Слова вопроса с цифрами: суммы, номера заказов, модели"""
+        return frozenset(token for token in tokenize(question) if any(c.isdigit() for c in token))
+    
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+    
+    def _check_version(self, version: str) -> None:
+        if version != self.version:
+            self._items.clear()
+            self._matrix = None
+            self.version = version
+    
+    def _expired(self, created_at: float) -> bool:
+        return bool(self.ttl) and time.time() - created_at > self.ttl
+    
+    def _drop_expired(self) -> None:
+        """Удалить устаревшие ответы (вызывать под блокировкой)"""
+        expired = [key for key, entry in self._items.items() if self._expired(entry[2])]
+        for key in expired:
+            del self._items[key]
+        if expired:
+            self._matrix = None
+    
+    def get(self, question: str, embedding, version: str) -> Optional[str]:
+        """Ответ на ближайший сохранённый вопрос с теми же числами или None"""
+        vector = self._normalize(embedding)
+        numbers = self._numbers(question)
+        with self._lock:
+            self._check_version(version)
+            # Устаревшие ответы убираются до сравнения: иначе устаревший
+            # ближайший вопрос заслонил бы подходящий действующий
+            self._drop_expired()
+            if not self._items:
+                self.misses += 1
+                return None
+            
+            if self._matrix is None:
+                self._keys = list(self._items)
+                self._matrix = np.stack([self._items[key][0] for key in self._keys])
+            
+            scores = self._matrix @ vector
+            # Близкие вопросы от ближайшего к дальнему: первый с теми же числами
+            candidates = np.flatnonzero(scores >= self.threshold)
+            for best in candidates[np.argsort(-scores[candidates])]:
+                key = self._keys[best]
+                entry = self._items.get(key)
+                if entry is not None and entry[3] == numbers:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+            
+            self.misses += 1
+            return None
+    
+    def put(self, question: str, embedding, answer: str, version: str) -> None:
+        """Сохранить ответ на вопрос"""
+        key = QueryEmbeddingCache.normalize(question)
+        with self._lock:
+            self._check_version(version)
+            self._items[key] = (self._normalize(embedding), answer, time.time(), self._numbers(question))
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+            self._matrix = None
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._matrix = None
+    
+    def stats(self) -> Dict[str, Any]:
+        """Размер кэша и доля ответов из него"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "threshold": self.threshold,
+        }
+    
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+# Общий кэш ответов на процесс
+_answer_cache: Optional[AnswerCache] = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """Общий для процесса кэш ответов (None, если отключён: ANSWER_CACHE_SIZE=0)"""
+    global _answer_cache
+    
+    if settings.answer_cache_size <= 0:
+        return None
+    
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                _answer_cache = AnswerCache(
+                    max_size=settings.answer_cache_size,
+                    ttl=settings.answer_cache_ttl,
+                    threshold=settings.answer_cache_threshold,
+                )
+    
+    return _answer_cache
@@ -0,0 +1,224 @@
+"""
+Бэкенды кодирования текстов в эмбеддинги
+
+Оба бэкенда повторяют интерфейс SentenceTransformer.encode, поэтому
+векторное хранилище работает с ними одинаково:
+
+- torch: исходная модель sentence-transformers на PyTorch
+- onnx: та же модель, экспортированная в ONNX (опционально int8),
+  выполняется через ONNX Runtime без импорта torch
+
+Экспорт и проверка эквивалентности векторов: export_onnx.py
+"""
+import json
+from pathlib import Path
+from typing import List, Union
+
+import numpy as np
+from loguru import logger
+
+# Модель по умолчанию: мультиязычная, хорошо работает с русским текстом
+EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+class TorchEmbedder:
+    """Эмбеддер на SentenceTransformer (PyTorch)"""
+    
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        
+        self.model = SentenceTransformer(model_name)
+        # Идентификатор модели для кэшей эмбеддингов
+        self.model_id = model_name
+    
+    def encode(
+        self,
+        texts: Union[str, List[str]],
+        batch_size: int = 32,
+        show_progress_bar: bool = False,
+        convert_to_numpy: bool = True,
+    ) -> np.ndarray:
+        return self.model.encode(
+            texts,
+            batch_size=batch_size,
+            show_progress_bar=show_progress_bar,
+            convert_to_numpy=convert_to_numpy,
+        )
+    
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+
+class OnnxEmbedder:
+    """
+    Эмбеддер на ONNX Runtime
+    
+    Ожидает каталог экспорта (см. export_onnx): model.onnx или model_int8.onnx,
+    tokenizer.json и embedder.json с параметрами токенизации и пулинга.
+    """
+    
+    def __init__(self, model_path: Path):
+        """
+        Args:
+            model_path: Путь к файлу .onnx внутри каталога экспорта
+        """
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+        
+        model_path = Path(model_path)
+        config = json.loads((model_path.parent / "embedder.json").read_text(encoding="utf-8"))
+        
+        self.max_length = config["max_length"]
+        self.dimension = config["dimension"]
+        self.normalize = config.get("normalize", False)
+        self.model_id = embedder_model_id("onnx", "", model_path)
+        
+        self.tokenizer = Tokenizer.from_file(str(model_path.parent / "tokenizer.json"))
+        self.tokenizer.enable_truncation(self.max_length)
+        self.tokenizer.enable_padding(pad_id=config["pad_token_id"], pad_token=config["pad_token"])
+        
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            str(model_path),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self._inputs = {item.name for item in self.session.get_inputs()}
+        
+        logger.info(f"ONNX-модель эмбеддингов загружена: {model_path}")
+    
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        
+        feed = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._inputs:
+            feed["token_type_ids"] = np.zeros_like(input_ids)
+        
+        token_embeddings = self.session.run(None, feed)[0]
+        
+        # Mean pooling по значимым токенам, как в модуле Pooling sentence-transformers
+        mask = attention_mask[:, :, None].astype(np.float32)
+        embeddings = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        
+        if self.normalize:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings.astype(np.float32)
+    
+    def encode(
+        self,
+        texts: Union[str, List[str]],
+        batch_size: int = 32,
+        show_progress_bar: bool = False,
+        convert_to_numpy: bool = True,
+    ) -> np.ndarray:
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        
+        # Сортировка по длине уменьшает паддинг внутри батча
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            rows = order[start:start + batch_size]
+            embeddings[rows] = self._encode_batch([texts[i] for i in rows])
+        
+        return embeddings[0] if single else embeddings
+    
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+
+def export_onnx(model_name: str, output_dir: Path, quantize: bool = False) -> Path:
+    """
+    Экспортировать модель sentence-transformers в ONNX
+    
+    Требует torch (только на этапе экспорта). Возвращает путь к модели,
+    которую следует указать в ONNX_MODEL_PATH.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+    
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    
+    st_model = SentenceTransformer(model_name, device="cpu")
+    pooling = next(module for module in st_model if isinstance(module, Pooling))
+    if pooling.get_pooling_mode_str() != "mean":
+        raise ValueError(f"Поддерживается только mean pooling, у модели: {pooling.get_pooling_mode_str()}")
+    
+    transformer = st_model[0].auto_model.eval()
+    tokenizer = st_model.tokenizer
+    
+    sample = tokenizer(["пример текста"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["token_embeddings"] = {0: "batch", 1: "sequence"}
+    
+    class TokenEmbeddings(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+        
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs))).last_hidden_state
+    
+    model_path = output_dir / "model.onnx"
+    with torch.no_grad():
+        torch.onnx.export(
+            TokenEmbeddings(transformer),
+            tuple(sample[name] for name in input_names),
+            str(model_path),
+            input_names=input_names,
+            output_names=["token_embeddings"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+            dynamo=False,
+        )
+    
+    tokenizer.backend_tokenizer.save(str(output_dir / "tokenizer.json"))
+    (output_dir / "embedder.json").write_text(json.dumps({
+        "model_name": model_name,
+        "max_length": st_model.max_seq_length,
+        "dimension": st_model.get_sentence_embedding_dimension(),
+        "normalize": any(isinstance(module, Normalize) for module in st_model),
+        "pad_token": tokenizer.pad_token,
+        "pad_token_id": tokenizer.pad_token_id,
+    }, ensure_ascii=False, indent=2), encoding="utf-8")
+    
+    logger.info(f"Модель экспортирована в ONNX: {model_path}")
+    
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        
+        quantized_path = output_dir / "model_int8.onnx"
+        quantize_dynamic(str(model_path), str(quantized_path), weight_type=QuantType.QInt8)
+        logger.info(f"Квантованная модель (int8): {quantized_path}")
+        return quantized_path
+    
+    return model_path
+
+
+def embedder_model_id(backend: str, model_name: str, onnx_path: Path) -> str:
+    """Идентификатор модели для кэшей эмбеддингов (без загрузки самой модели)"""
+    if backend == "onnx":
+        # Модель ONNX могла быть экспортирована не из model_name — берём её из embedder.json.
+        # Векторы int8-модели отличаются от исходной, поэтому в идентификатор входит файл
+        onnx_path = Path(onnx_path)
+        config = json.loads((onnx_path.parent / "embedder.json").read_text(encoding="utf-8"))
+        return f"{config.get('model_name', '')}:onnx:{onnx_path.name}"
+    return model_name
+
+
+def create_embedder(backend: str, model_name: str, onnx_path: Path):
+    """Создать эмбеддер по названию бэкенда из настроек"""
+    if backend == "onnx":
+        return OnnxEmbedder(onnx_path)
+    if backend == "torch":
+        return TorchEmbedder(model_name)
+    raise ValueError(f"Неизвестный бэкенд эмбеддингов: {backend}")
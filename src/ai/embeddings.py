@@ -0,0 +1,553 @@
+"""
+Вспомогательные компоненты для эмбеддингов: кэширование и батчинг запросов
+"""
+import re
+import json
+import time
+import hashlib
+import queue
+import sqlite3
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from loguru import logger
+
+
+class QueryEmbeddingCache:
+    """
+    Кэш эмбеддингов поисковых запросов
+    
+    Первый уровень — LRU в памяти с ограничением по размеру и TTL.
+    Второй (опциональный) — SQLite на диске, переживает перезапуск процесса.
+    Ключом служит нормализованный текст запроса, поэтому "Холодильник  Samsung"
+    и "холодильник samsung" используют один эмбеддинг.
+    """
+    
+    def __init__(
+        self,
+        max_size: int = 2048,
+        ttl: float = 86400,
+        path: Optional[str] = None,
+        namespace: str = "default",
+    ):
+        """
+        Args:
+            max_size: Максимальное количество запросов в памяти
+            ttl: Время жизни записи в секундах (0 — без ограничения)
+            path: Путь к файлу SQLite для дискового уровня (None — только память)
+            namespace: Пространство имён записей на диске (например, имя модели)
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.namespace = namespace
+        
+        self._items: "OrderedDict[str, Tuple[np.ndarray, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                "namespace TEXT NOT NULL, query TEXT NOT NULL, "
+                "vector BLOB NOT NULL, created_at REAL NOT NULL, "
+                "PRIMARY KEY (namespace, query))"
+            )
+            self._db.commit()
+            logger.info(f"Дисковый кэш эмбеддингов запросов: {path}")
+    
+    @property
+    def persistent(self) -> bool:
+        """Есть ли дисковый уровень (обращения к нему блокируют поток)"""
+        return self._db is not None
+    
+    @staticmethod
+    def normalize(query: str) -> str:
+        """Нормализовать запрос: регистр, ё/е, лишние пробелы и знаки по краям"""
+        normalized = query.lower().replace("ё", "е")
+        normalized = re.sub(r"\s+", " ", normalized)
+        return normalized.strip(" .,!?;:\"'")
+    
+    def _expired(self, created_at: float) -> bool:
+        return bool(self.ttl) and time.time() - created_at > self.ttl
+    
+    def get(self, query: str, disk: bool = True) -> Optional[np.ndarray]:
+        """
+        Получить эмбеддинг из кэша или None
+        
+        disk=False — только из памяти: без обращения к SQLite, поэтому
+        вызов можно делать из event loop.
+        """
+        key = self.normalize(query)
+        
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                embedding, created_at = item
+                if not self._expired(created_at):
+                    self._items.move_to_end(key)
+                    self.memory_hits += 1
+                    return embedding
+                del self._items[key]
+        
+        if disk and self._db is not None:
+            # Диск читается под отдельной блокировкой: обращения к памяти его не ждут
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT vector, created_at FROM query_embeddings WHERE namespace = ? AND query = ?",
+                    (self.namespace, key)
+                ).fetchone()
+            if row and not self._expired(row[1]):
+                embedding = np.frombuffer(row[0], dtype=np.float32)
+                with self._lock:
+                    self._remember(key, embedding, row[1])
+                    self.disk_hits += 1
+                return embedding
+        
+        with self._lock:
+            self.misses += 1
+        return None
+    
+    def put(self, query: str, embedding: np.ndarray, disk: bool = True) -> None:
+        """Сохранить эмбеддинг запроса (disk=False — только в памяти)"""
+        key = self.normalize(query)
+        embedding = np.asarray(embedding, dtype=np.float32)
+        created_at = time.time()
+        
+        with self._lock:
+            self._remember(key, embedding, created_at)
+        
+        if disk and self._db is not None:
+            with self._db_lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?, ?)",
+                    (self.namespace, key, embedding.tobytes(), created_at)
+                )
+                self._db.commit()
+    
+    def _remember(self, key: str, embedding: np.ndarray, created_at: float) -> None:
+        """Положить запись в память с вытеснением самых старых (вызывать под блокировкой)"""
+        self._items[key] = (embedding, created_at)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+    
+    def get_or_compute(
+        self,
+        query: str,
+        compute: Callable[[str], np.ndarray]
+    ) -> np.ndarray:
+        """Получить эмбеддинг из кэша или вычислить и сохранить"""
+        embedding = self.get(query)
+        if embedding is None:
+            embedding = np.asarray(compute(query), dtype=np.float32)
+            self.put(query, embedding)
+        return embedding
+    
+    def clear(self) -> None:
+        """Очистить кэш (в памяти и на диске)"""
+        with self._lock:
+            self._items.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute(
+                    "DELETE FROM query_embeddings WHERE namespace = ?",
+                    (self.namespace,)
+                )
+                self._db.commit()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Счётчики попаданий и промахов"""
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {
+            "size": len(self._items),
+            "max_size": self.max_size,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+        }
+
+
+class DocumentEmbeddingCache:
+    """
+    Дисковый кэш эмбеддингов документов (текстов товаров)
+    
+    Ключ записи — хэш пары (модель, текст), поэтому полная переиндексация,
+    очистка коллекции или пересборка контейнера (при сохранённом каталоге
+    data) не требуют повторного кодирования неизменившихся товаров.
+    
+    Записи лежат в одном файле, отображённом в память (numpy.memmap):
+    ключ, время последнего обращения и вектор. Отдельного индекса нет —
+    словарь ключей строится по самому файлу при открытии. Файл открывается
+    при первом обращении к записям, а не при создании кэша: процессы,
+    которые товары не кодируют (бот, API), его не читают. Размер ограничен
+    max_items записей, при переполнении вытесняются давно не использованные.
+    Перед выдачей ключ записи сверяется с запрошенным, поэтому запись
+    из другого процесса в худшем случае даёт промах, а не чужой вектор.
+    """
+    
+    FILE = "embeddings.bin"
+    META_FILE = "embeddings.json"
+    VERSION = 1
+    KEY_SIZE = 16
+    INITIAL_CAPACITY = 1024
+    # Доля записей, вытесняемых за раз при переполнении
+    EVICT_FRACTION = 0.05
+    
+    def __init__(self, path: str, model_id: str, max_items: int = 100000):
+        """
+        Args:
+            path: Каталог кэша
+            model_id: Идентификатор модели (входит в ключ записи)
+            max_items: Максимальное количество записей
+        """
+        self.path = Path(path)
+        self.model_id = model_id
+        self.max_items = max_items
+        
+        self._lock = threading.Lock()
+        self._opened = False
+        self._records: Optional[np.memmap] = None
+        self._dim: Optional[int] = None
+        self._rows: Dict[bytes, int] = {}
+        self._free: List[int] = []
+        self._tick = 0
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+        self.path.mkdir(parents=True, exist_ok=True)
+    
+    def _dtype(self, dim: int) -> np.dtype:
+        return np.dtype([
+            ("key", np.uint8, (self.KEY_SIZE,)),
+            ("used", np.uint64),
+            ("vector", np.float32, (dim,)),
+        ])
+    
+    def _key(self, text: str) -> bytes:
+        return hashlib.blake2b(
+            f"{self.model_id}\n{text}".encode("utf-8"),
+            digest_size=self.KEY_SIZE,
+        ).digest()
+    
+    def _ensure_open(self) -> None:
+        """Открыть файл кэша при первом обращении (вызывать под блокировкой)"""
+        if self._opened:
+            return
+        self._opened = True
+        self._open()
+        logger.info(f"Дисковый кэш эмбеддингов товаров: {self.path} ({len(self._rows)} записей)")
+    
+    def _open(self) -> None:
+        """Открыть файл кэша и восстановить словарь ключей"""
+        meta_path = self.path / self.META_FILE
+        data_path = self.path / self.FILE
+        if not meta_path.exists() or not data_path.exists():
+            return
+        
+        meta = json.loads(meta_path.read_text())
+        if meta.get("version") != self.VERSION:
+            return
+        
+        self._dim = meta["dim"]
+        dtype = self._dtype(self._dim)
+        capacity = data_path.stat().st_size // dtype.itemsize
+        if not capacity:
+            return
+        
+        self._records = np.memmap(data_path, dtype=dtype, mode="r+", shape=(capacity,))
+        used = np.asarray(self._records["used"])
+        keys = np.asarray(self._records["key"])
+        
+        occupied = np.flatnonzero(used > 0)
+        self._rows = {keys[row].tobytes(): int(row) for row in occupied}
+        self._free = np.flatnonzero(used == 0)[::-1].tolist()
+        self._tick = int(used.max())
+    
+    def _reset(self, dim: int) -> None:
+        """Создать пустой файл кэша под векторы размерности dim"""
+        self._records = None
+        self._dim = dim
+        self._rows = {}
+        self._free = []
+        self._tick = 0
+        
+        (self.path / self.FILE).unlink(missing_ok=True)
+        (self.path / self.META_FILE).write_text(json.dumps({"version": self.VERSION, "dim": dim}))
+    
+    def _resize(self, capacity: int) -> None:
+        dtype = self._dtype(self._dim)
+        data_path = self.path / self.FILE
+        old_capacity = 0
+        if self._records is not None:
+            old_capacity = len(self._records)
+            self._records.flush()
+            self._records = None
+        
+        # Расширение файла заполняет новые записи нулями (used = 0 — свободна)
+        with open(data_path, "ab") as f:
+            f.truncate(capacity * dtype.itemsize)
+        self._records = np.memmap(data_path, dtype=dtype, mode="r+", shape=(capacity,))
+        self._free.extend(range(capacity - 1, old_capacity - 1, -1))
+    
+    def _evict(self) -> None:
+        """Освободить EVICT_FRACTION записей с самым давним обращением"""
+        count = max(1, int(len(self._records) * self.EVICT_FRACTION))
+        used = self._records["used"]
+        rows = np.argpartition(used, count - 1)[:count]
+        
+        for row in rows:
+            self._rows.pop(self._records["key"][row].tobytes(), None)
+        used[rows] = 0
+        self._records["key"][rows] = 0
+        self._free.extend(int(row) for row in rows)
+        self.evictions += count
+    
+    def _allocate(self) -> int:
+        if not self._free:
+            capacity = 0 if self._records is None else len(self._records)
+            if capacity < self.max_items:
+                self._resize(min(max(capacity * 2, self.INITIAL_CAPACITY), self.max_items))
+            else:
+                self._evict()
+        return self._free.pop()
+    
+    def get_many(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Эмбеддинги текстов из кэша (None для отсутствующих)"""
+        results: List[Optional[np.ndarray]] = []
+        with self._lock:
+            self._ensure_open()
+            for text in texts:
+                key = self._key(text)
+                row = self._rows.get(key)
+                if row is None or self._records["key"][row].tobytes() != key:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                
+                self._tick += 1
+                self._records["used"][row] = self._tick
+                results.append(np.array(self._records["vector"][row]))
+                self.hits += 1
+        return results
+    
+    def put_many(self, texts: Sequence[str], embeddings: np.ndarray) -> None:
+        """Сохранить эмбеддинги текстов"""
+        if self.max_items <= 0 or not len(texts):
+            return
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(texts), -1)
+        
+        with self._lock:
+            self._ensure_open()
+            # Модель сменилась на модель другой размерности — старые записи бесполезны
+            if self._dim != embeddings.shape[1]:
+                self._reset(embeddings.shape[1])
+            
+            for text, embedding in zip(texts, embeddings):
+                key = self._key(text)
+                row = self._rows.get(key)
+                if row is None:
+                    row = self._rows[key] = self._allocate()
+                
+                # Ключ записывается последним: недописанная запись не совпадёт с ключом
+                self._records["key"][row] = 0
+                self._records["vector"][row] = embedding
+                self._records["key"][row] = np.frombuffer(key, dtype=np.uint8)
+                self._tick += 1
+                self._records["used"][row] = self._tick
+    
+    def flush(self) -> None:
+        """Сбросить изменения на диск"""
+        with self._lock:
+            if self._records is not None:
+                self._records.flush()
+    
+    def clear(self) -> None:
+        """Удалить все записи"""
+        with self._lock:
+            self._ensure_open()
+            if self._dim is not None:
+                self._reset(self._dim)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Размер кэша и счётчики попаданий (размер None, пока файл не открыт)"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._rows) if self._opened else None,
+            "max_size": self.max_items,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class Histogram:
+    """Простая гистограмма с фиксированными границами корзин"""
+    
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+    
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += 1
+        self.sum += value
+    
+    def to_dict(self) -> Dict[str, Any]:
+        buckets = {f"<={bound:g}": count for bound, count in zip(self.bounds, self.counts)}
+        buckets["+Inf"] = self.counts[-1]
+        return {
+            "count": self.total,
+            "avg": round(self.sum / self.total, 3) if self.total else 0.0,
+            "buckets": buckets,
+        }
+
+
+class EmbeddingBatcher:
+    """
+    Микробатчинг кодирования запросов
+    
+    Одиночные запросы, пришедшие в течение окна window_ms (но не больше
+    max_batch_size штук), кодируются одним вызовом модели в фоновом потоке.
+    Каждый вызывающий получает свой вектор через Future, поэтому батчер
+    одинаково подходит и для потоков (encode), и для корутин
+    (asyncio.wrap_future(submit(...))).
+    """
+    
+    def __init__(
+        self,
+        encode_batch: Callable[[List[str]], np.ndarray],
+        window_ms: float = 5.0,
+        max_batch_size: int = 32,
+    ):
+        """
+        Args:
+            encode_batch: Функция кодирования списка текстов в матрицу эмбеддингов
+            window_ms: Сколько ждать дополнительных запросов после первого
+            max_batch_size: Максимальный размер батча
+        """
+        self.encode_batch = encode_batch
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        
+        self._queue: "queue.Queue[Optional[Tuple[str, Future, float]]]" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self.batch_sizes = Histogram([1, 2, 4, 8, 16, 32, 64])
+        self.queue_wait_ms = Histogram([1, 2, 5, 10, 20, 50, 100, 500])
+        
+        self._thread = threading.Thread(
+            target=self._worker,
+            name="embedding-batcher",
+            daemon=True,
+        )
+        self._thread.start()
+    
+    def submit(self, text: str) -> Future:
+        """Поставить текст в очередь на кодирование"""
+        future: Future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+    
+    def encode(self, text: str) -> np.ndarray:
+        """Закодировать текст (блокирует вызывающий поток до готовности батча)"""
+        return self.submit(text).result()
+    
+    def _worker(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            
+            batch = [item]
+            deadline = time.perf_counter() + self.window
+            stop = False
+            
+            # Добираем запросы, пришедшие в пределах окна
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            
+            try:
+                self._run(batch)
+            except Exception as e:
+                # Ошибка одного батча не должна останавливать поток: иначе
+                # все следующие запросы будут ждать ответа вечно
+                logger.exception(f"Ошибка обработки батча запросов: {e}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            if stop:
+                return
+    
+    def _run(self, batch: List[Tuple[str, Future, float]]) -> None:
+        # Запросы, которые вызывающий уже отменил (например, отключился
+        # клиент), не кодируются; остальные больше отменить нельзя
+        batch = [item for item in batch if self._start(item[1])]
+        if not batch:
+            return
+        
+        started = time.perf_counter()
+        with self._stats_lock:
+            self.batch_sizes.observe(len(batch))
+            for _, _, enqueued in batch:
+                self.queue_wait_ms.observe((started - enqueued) * 1000)
+        
+        # Одинаковые запросы в батче кодируются один раз
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        try:
+            embeddings = dict(zip(texts, self.encode_batch(texts)))
+        except Exception as e:
+            logger.error(f"Ошибка кодирования батча запросов: {e}")
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        
+        for text, future, _ in batch:
+            future.set_result(embeddings[text])
+    
+    @staticmethod
+    def _start(future: Future) -> bool:
+        """Перевести Future в состояние выполнения (False — он уже отменён или завершён)"""
+        try:
+            return future.set_running_or_notify_cancel()
+        except RuntimeError:
+            return False
+    
+    def close(self) -> None:
+        """Остановить фоновый поток (уже поставленные запросы будут обработаны)"""
+        self._queue.put(None)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Гистограммы размеров батчей и времени ожидания в очереди (мс)"""
+        with self._stats_lock:
+            return {
+                "window_ms": self.window * 1000,
+                "max_batch_size": self.max_batch_size,
+                "batch_size": self.batch_sizes.to_dict(),
+                "queue_wait_ms": self.queue_wait_ms.to_dict(),
+            }
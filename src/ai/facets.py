@@ -0,0 +1,143 @@
+"""
+Фасетный индекс каталога: категории и бренды с количеством товаров и ценами
+"""
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+class Facet:
+    """Статистика одного значения фасета (категории или бренда)"""
+    
+    __slots__ = ("name", "count", "in_stock", "min_price", "max_price", "_prices_dirty")
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.in_stock = 0
+        self.min_price: Optional[float] = None
+        self.max_price: Optional[float] = None
+        self._prices_dirty = False
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "count": self.count,
+            "in_stock": self.in_stock,
+            "min_price": self.min_price,
+            "max_price": self.max_price,
+        }
+
+
+class FacetIndex:
+    """
+    Категории и бренды проиндексированных товаров в памяти
+    
+    Обновляется вместе с векторным индексом (add/remove), поэтому списки
+    категорий и брендов отдаются без обхода всего каталога. Минимальная и
+    максимальная цена пересчитываются лениво и только для того значения,
+    у которого удалили товар с крайней ценой.
+    """
+    
+    FIELDS = ("category", "brand")
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+    
+    def clear(self) -> None:
+        with self._lock:
+            # product_id -> (категория, бренд, цена, в наличии)
+            self._items: Dict[str, Tuple[str, str, float, bool]] = {}
+            self._facets: Dict[str, Dict[str, Facet]] = {field: {} for field in self.FIELDS}
+            self._names: Dict[str, Optional[List[str]]] = {field: [] for field in self.FIELDS}
+    
+    def build(self, metadatas: Dict[str, Dict[str, Any]]) -> None:
+        """Построить индекс заново по метаданным {id: metadata}"""
+        with self._lock:
+            self.clear()
+            self.update(list(metadatas), list(metadatas.values()))
+    
+    def update(self, ids: Iterable[str], metadatas: Iterable[Dict[str, Any]]) -> None:
+        """Добавить или обновить товары"""
+        with self._lock:
+            for id_, metadata in zip(ids, metadatas):
+                self._remove(str(id_))
+                item = (
+                    (metadata or {}).get("category") or "",
+                    (metadata or {}).get("brand") or "",
+                    float((metadata or {}).get("price") or 0),
+                    bool((metadata or {}).get("in_stock")),
+                )
+                self._items[str(id_)] = item
+                
+                for field, name in zip(self.FIELDS, item):
+                    if not name:
+                        continue
+                    facet = self._facets[field].get(name)
+                    if facet is None:
+                        facet = self._facets[field][name] = Facet(name)
+                        self._names[field] = None
+                    self._add_to_facet(facet, item[2], item[3])
+    
+    def remove(self, ids: Iterable[str]) -> None:
+        """Удалить товары"""
+        with self._lock:
+            for id_ in ids:
+                self._remove(str(id_))
+    
+    def _add_to_facet(self, facet: Facet, price: float, in_stock: bool) -> None:
+        facet.count += 1
+        facet.in_stock += in_stock
+        if price > 0 and not facet._prices_dirty:
+            facet.min_price = price if facet.min_price is None else min(facet.min_price, price)
+            facet.max_price = price if facet.max_price is None else max(facet.max_price, price)
+    
+    def _remove(self, id_: str) -> None:
+        item = self._items.pop(id_, None)
+        if item is None:
+            return
+        
+        price, in_stock = item[2], item[3]
+        for field, name in zip(self.FIELDS, item):
+            facet = self._facets[field].get(name)
+            if facet is None:
+                continue
+            
+            facet.count -= 1
+            facet.in_stock -= in_stock
+            if facet.count == 0:
+                del self._facets[field][name]
+                self._names[field] = None
+            elif price in (facet.min_price, facet.max_price):
+                facet._prices_dirty = True
+    
+    def _recompute_prices(self, field: str, facet: Facet) -> None:
+        position = self.FIELDS.index(field)
+        prices = [
+            item[2] for item in self._items.values()
+            if item[position] == facet.name and item[2] > 0
+        ]
+        facet.min_price = min(prices) if prices else None
+        facet.max_price = max(prices) if prices else None
+        facet._prices_dirty = False
+    
+    def names(self, field: str) -> List[str]:
+        """Отсортированные значения фасета"""
+        with self._lock:
+            if self._names[field] is None:
+                self._names[field] = sorted(self._facets[field])
+            return list(self._names[field])
+    
+    def facets(self, field: str) -> List[Dict[str, Any]]:
+        """Значения фасета с количеством товаров и диапазоном цен"""
+        with self._lock:
+            result = []
+            for name in self.names(field):
+                facet = self._facets[field][name]
+                if facet._prices_dirty:
+                    self._recompute_prices(field, facet)
+                result.append(facet.to_dict())
+            return result
+    
+    def __len__(self) -> int:
+        return len(self._items)
@@ -0,0 +1,940 @@
+"""
+Индексы векторного хранилища
+
+Все индексы реализуют один интерфейс (upsert / update_metadata / delete /
+query / get_metadata / get_documents / get_embeddings / count / clear /
+flush / reload), поэтому ProductVectorStore может работать с любым из них —
+см. create_index(). PartitionedIndex разбивает ChromaDB или NumPy-индекс
+на шарды по категориям с тем же интерфейсом.
+
+Фильтры поиска передаются словарём с ключами min_price, max_price,
+category, brand и in_stock_only (отсутствующие или None значения не применяются).
+"""
+import os
+import json
+import hashlib
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import chromadb
+from chromadb.config import Settings as ChromaSettings
+from loguru import logger
+
+from src.ai.snapshot import read_snapshot, write_snapshot
+
+
+class ChromaIndex:
+    """Индекс в ChromaDB (приближённый поиск HNSW с фильтрами where)"""
+    
+    def __init__(self, path: Path, name: str = "products"):
+        path.mkdir(parents=True, exist_ok=True)
+        self.name = name
+        
+        self.client = chromadb.PersistentClient(
+            path=str(path),
+            settings=ChromaSettings(
+                anonymized_telemetry=False,
+                allow_reset=True,
+            )
+        )
+        self.collection = self.client.get_or_create_collection(
+            name=name,
+            metadata={"hnsw:space": "cosine"}
+        )
+    
+    @property
+    def max_batch_size(self) -> int:
+        """Максимальный размер одной операции записи"""
+        return self.client.get_max_batch_size()
+    
+    @staticmethod
+    def _where(filters: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Преобразовать фильтры в условие where для ChromaDB"""
+        where_filters = []
+        
+        if filters.get("in_stock_only"):
+            where_filters.append({"in_stock": True})
+        if filters.get("category"):
+            where_filters.append({"category": {"$eq": filters["category"]}})
+        if filters.get("brand"):
+            where_filters.append({"brand": {"$eq": filters["brand"]}})
+        if filters.get("min_price") is not None:
+            where_filters.append({"price": {"$gte": filters["min_price"]}})
+        if filters.get("max_price") is not None:
+            where_filters.append({"price": {"$lte": filters["max_price"]}})
+        
+        if len(where_filters) == 1:
+            return where_filters[0]
+        if len(where_filters) > 1:
+            return {"$and": where_filters}
+        return None
+    
+    def upsert(
+        self,
+        ids: List[str],
+        embeddings: np.ndarray,
+        documents: List[str],
+        metadatas: List[Dict[str, Any]],
+    ) -> None:
+        self.collection.upsert(
+            ids=ids,
+            embeddings=np.asarray(embeddings).tolist(),
+            documents=documents,
+            metadatas=metadatas
+        )
+    
+    def update_metadata(self, ids: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        self.collection.update(ids=ids, metadatas=metadatas)
+    
+    def delete(self, ids: List[str]) -> None:
+        self.collection.delete(ids=ids)
+    
+    def get_metadata(self, page_size: int = 5000) -> Dict[str, Dict[str, Any]]:
+        """Метаданные всех товаров по их ID (читаются постранично)"""
+        indexed = {}
+        offset = 0
+        
+        while True:
+            page = self.collection.get(
+                include=["metadatas"],
+                limit=page_size,
+                offset=offset,
+            )
+            for id_, metadata in zip(page["ids"], page["metadatas"]):
+                indexed[id_] = metadata or {}
+            
+            if len(page["ids"]) < page_size:
+                return indexed
+            offset += page_size
+    
+    def get_documents(self, page_size: int = 5000) -> Dict[str, str]:
+        """Тексты всех товаров по их ID (читаются постранично)"""
+        documents = {}
+        offset = 0
+        
+        while True:
+            page = self.collection.get(
+                include=["documents"],
+                limit=page_size,
+                offset=offset,
+            )
+            for id_, document in zip(page["ids"], page["documents"]):
+                documents[id_] = document or ""
+            
+            if len(page["ids"]) < page_size:
+                return documents
+            offset += page_size
+    
+    def get_embeddings(self, page_size: int = 5000):
+        """ID и векторы всех товаров (читаются постранично)"""
+        ids, embeddings = [], []
+        offset = 0
+        
+        while True:
+            page = self.collection.get(
+                include=["embeddings"],
+                limit=page_size,
+                offset=offset,
+            )
+            ids.extend(page["ids"])
+            if len(page["ids"]):
+                embeddings.append(np.asarray(page["embeddings"], dtype=np.float32))
+            
+            if len(page["ids"]) < page_size:
+                break
+            offset += page_size
+        
+        return ids, np.concatenate(embeddings) if embeddings else np.empty((0, 0), dtype=np.float32)
+    
+    def get_embedding(self, id_: str) -> Optional[np.ndarray]:
+        """Вектор одного товара (None — товара нет в индексе)"""
+        page = self.collection.get(ids=[str(id_)], include=["embeddings"])
+        if not len(page["ids"]):
+            return None
+        return np.asarray(page["embeddings"][0], dtype=np.float32)
+    
+    def query(
+        self,
+        embeddings: np.ndarray,
+        n_results: int,
+        filters: Dict[str, Any],
+    ) -> List[List[Dict[str, Any]]]:
+        """Найти ближайшие товары для каждого эмбеддинга запроса"""
+        where = self._where(filters)
+        try:
+            results = self.collection.query(
+                query_embeddings=np.asarray(embeddings).tolist(),
+                n_results=n_results,
+                where=where,
+                include=["documents", "metadatas", "distances"]
+            )
+        except RuntimeError as e:
+            # HNSW с узким фильтром может не набрать n_results соседей
+            # ("Cannot return the results in a contiguous 2D array")
+            logger.debug(f"HNSW не справился с фильтром {where}, точный поиск: {e}")
+            return self._exact_query(embeddings, n_results, where)
+        
+        found = []
+        for q, ids in enumerate(results["ids"]):
+            found.append([
+                {
+                    "id": int(id_),
+                    "document": results["documents"][q][i] if results["documents"] else None,
+                    "metadata": results["metadatas"][q][i] if results["metadatas"] else None,
+                    "distance": results["distances"][q][i] if results["distances"] else None,
+                }
+                for i, id_ in enumerate(ids)
+            ])
+        return found
+    
+    def _exact_query(
+        self,
+        embeddings: np.ndarray,
+        n_results: int,
+        where: Optional[Dict[str, Any]],
+    ) -> List[List[Dict[str, Any]]]:
+        """Точный поиск среди товаров, подходящих под фильтр"""
+        queries = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        page = self.collection.get(where=where, include=["embeddings", "documents", "metadatas"])
+        if not len(page["ids"]):
+            return [[] for _ in queries]
+        
+        matrix = np.asarray(page["embeddings"], dtype=np.float32)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        scores = queries @ matrix.T
+        
+        found = []
+        for q in range(len(queries)):
+            top = np.argsort(-scores[q])[:n_results]
+            found.append([
+                {
+                    "id": int(page["ids"][i]),
+                    "document": page["documents"][i],
+                    "metadata": page["metadatas"][i],
+                    "distance": float(1.0 - scores[q, i]),
+                }
+                for i in top
+            ])
+        return found
+    
+    def count(self) -> int:
+        return self.collection.count()
+    
+    def clear(self) -> None:
+        self.client.delete_collection(self.name)
+        self.collection = self.client.create_collection(
+            name=self.name,
+            metadata={"hnsw:space": "cosine"}
+        )
+    
+    def flush(self) -> None:
+        """ChromaDB сохраняет изменения сразу"""
+    
+    def reload(self) -> None:
+        """ChromaDB читает данные с диска сама"""
+
+
+class NumpyIndex:
+    """
+    Точный поиск по матрице эмбеддингов в памяти
+    
+    Эмбеддинги хранятся одной непрерывной нормированной матрицей float32,
+    а цена, бренд, категория и наличие — отдельными колонками NumPy. Фильтры
+    применяются векторизованной маской, top-k выбирается через argpartition.
+    В отличие от HNSW с пост-фильтрацией, при селективных фильтрах поиск
+    всегда возвращает все подходящие товары (до n_results).
+    
+    Векторы можно хранить в сжатом виде (dtype): float16 — вдвое меньше
+    памяти, int8 с масштабом на каждый вектор — вчетверо. Скоринг выполняется
+    прямо по сжатой матрице блоками, без распаковки её целиком.
+    
+    Изменения накапливаются в памяти и сохраняются в один файл .npz
+    методом flush().
+    
+    Индекс можно открыть из снимка (save_snapshot): колонки и матрица не
+    копируются в память, а отображаются из файла, поэтому реплика бота или
+    API стартует почти мгновенно и делит страницы с другими процессами.
+    Такой индекс рассчитан на чтение — изменения остаются в памяти процесса.
+    """
+    
+    max_batch_size = 50_000
+    
+    # Префикс дополнительных массивов в снимке (см. save_snapshot)
+    ATTACHMENT_PREFIX = "attachment:"
+    
+    DTYPES = ("float32", "float16", "int8")
+    # Сколько строк сжатой матрицы распаковывать за раз при скоринге
+    SCORE_BLOCK = 8192
+    
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        dtype: str = "float32",
+        snapshot: Optional[Path] = None,
+    ):
+        """
+        Args:
+            path: Файл .npz для сохранения индекса (None — только в памяти)
+            dtype: Тип хранения векторов
+            snapshot: Файл снимка, из которого открывается индекс (вместо path)
+        """
+        if dtype not in self.DTYPES:
+            raise ValueError(f"Неподдерживаемый тип хранения векторов: {dtype}")
+        
+        self.path = path
+        self.dtype = dtype
+        self.snapshot = snapshot
+        self._lock = threading.RLock()
+        self._reset()
+        
+        if self.snapshot is not None or (self.path is not None and self.path.exists()):
+            self.reload()
+    
+    def _reset(self) -> None:
+        self._size = 0
+        self._ids = np.empty(0, dtype=np.int64)
+        self._matrix = np.empty((0, 0), dtype=self.dtype)
+        # Масштаб каждого вектора (используется только для int8)
+        self._scales = np.empty(0, dtype=np.float32)
+        self._price = np.empty(0, dtype=np.float64)
+        self._in_stock = np.empty(0, dtype=bool)
+        self._brand = np.empty(0, dtype=np.int32)
+        self._category = np.empty(0, dtype=np.int32)
+        self._documents: List[str] = []
+        self._metadatas: List[Dict[str, Any]] = []
+        self._rows: Dict[int, int] = {}
+        # Дополнительные массивы открытого снимка
+        self.attachments: Dict[str, np.ndarray] = {}
+        # Строковые значения колонок кодируются целыми числами
+        self._codes: Dict[str, Dict[str, int]] = {"brand": {}, "category": {}}
+        self._dirty = False
+    
+    def _code(self, column: str, value: str) -> int:
+        codes = self._codes[column]
+        if value not in codes:
+            codes[value] = len(codes)
+        return codes[value]
+    
+    def _ensure_capacity(self, size: int, dim: int) -> None:
+        """Увеличить массивы с запасом, чтобы не копировать их на каждую порцию"""
+        if self._matrix.shape[1] != dim and self._size == 0:
+            self._matrix = np.empty((0, dim), dtype=self.dtype)
+        
+        capacity = len(self._ids)
+        if size <= capacity:
+            return
+        
+        capacity = max(size, capacity * 2, 1024)
+        
+        def grow(array: np.ndarray) -> np.ndarray:
+            grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:self._size] = array[:self._size]
+            return grown
+        
+        self._ids = grow(self._ids)
+        self._matrix = grow(self._matrix)
+        self._scales = grow(self._scales)
+        self._price = grow(self._price)
+        self._in_stock = grow(self._in_stock)
+        self._brand = grow(self._brand)
+        self._category = grow(self._category)
+    
+    def _set_metadata(self, row: int, metadata: Dict[str, Any]) -> None:
+        self._price[row] = metadata.get("price") or 0
+        self._in_stock[row] = bool(metadata.get("in_stock"))
+        self._brand[row] = self._code("brand", metadata.get("brand") or "")
+        self._category[row] = self._code("category", metadata.get("category") or "")
+        self._metadatas[row] = metadata
+    
+    @staticmethod
+    def _normalize(embeddings: np.ndarray) -> np.ndarray:
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
+    
+    def _quantize(self, embeddings: np.ndarray):
+        """Привести нормированные векторы к типу хранения, вернуть (векторы, масштабы)"""
+        scales = np.ones(len(embeddings), dtype=np.float32)
+        if self.dtype == "int8":
+            scales = np.maximum(np.abs(embeddings).max(axis=1), 1e-12) / 127
+            stored = np.round(embeddings / scales[:, None]).astype(np.int8)
+            return stored, scales.astype(np.float32)
+        return embeddings.astype(self.dtype), scales
+    
+    @staticmethod
+    def _dequantize(stored: np.ndarray, scales: np.ndarray) -> np.ndarray:
+        embeddings = stored.astype(np.float32)
+        if stored.dtype == np.int8:
+            embeddings *= scales[:, None]
+        return embeddings
+    
+    def _score(self, rows: Optional[np.ndarray], size: int, queries: np.ndarray) -> np.ndarray:
+        """Косинусная близость строк (все при rows=None) к запросам"""
+        matrix = self._matrix[:size] if rows is None else self._matrix[rows]
+        if self.dtype == "float32":
+            return matrix @ queries.T
+        
+        scores = np.empty((len(matrix), len(queries)), dtype=np.float32)
+        for start in range(0, len(matrix), self.SCORE_BLOCK):
+            end = start + self.SCORE_BLOCK
+            scores[start:end] = matrix[start:end].astype(np.float32) @ queries.T
+        
+        if self.dtype == "int8":
+            scales = self._scales[:size] if rows is None else self._scales[rows]
+            scores *= scales[:, None]
+        return scores
+    
+    def upsert(
+        self,
+        ids: List[str],
+        embeddings: np.ndarray,
+        documents: List[str],
+        metadatas: List[Dict[str, Any]],
+    ) -> None:
+        embeddings, scales = self._quantize(self._normalize(embeddings))
+        
+        with self._lock:
+            self._ensure_capacity(self._size + len(ids), embeddings.shape[1])
+            
+            for id_, embedding, scale, document, metadata in zip(
+                ids, embeddings, scales, documents, metadatas
+            ):
+                product_id = int(id_)
+                row = self._rows.get(product_id)
+                if row is None:
+                    row = self._size
+                    self._size += 1
+                    self._rows[product_id] = row
+                    self._ids[row] = product_id
+                    self._documents.append(document)
+                    self._metadatas.append(metadata)
+                
+                self._matrix[row] = embedding
+                self._scales[row] = scale
+                self._documents[row] = document
+                self._set_metadata(row, metadata)
+            
+            self._dirty = True
+    
+    def update_metadata(self, ids: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            for id_, metadata in zip(ids, metadatas):
+                row = self._rows.get(int(id_))
+                if row is not None:
+                    self._set_metadata(row, metadata)
+            self._dirty = True
+    
+    def delete(self, ids: List[str]) -> None:
+        with self._lock:
+            for id_ in ids:
+                row = self._rows.pop(int(id_), None)
+                if row is None:
+                    continue
+                
+                # Переносим последнюю строку на место удалённой
+                last = self._size - 1
+                if row != last:
+                    moved_id = int(self._ids[last])
+                    for array in (self._ids, self._matrix, self._scales, self._price,
+                                  self._in_stock, self._brand, self._category):
+                        array[row] = array[last]
+                    self._documents[row] = self._documents[last]
+                    self._metadatas[row] = self._metadatas[last]
+                    self._rows[moved_id] = row
+                
+                self._documents.pop()
+                self._metadatas.pop()
+                self._size -= 1
+            
+            self._dirty = True
+    
+    def get_metadata(self, page_size: int = 5000) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                str(self._ids[row]): dict(self._metadatas[row])
+                for row in range(self._size)
+            }
+    
+    def get_documents(self, page_size: int = 5000) -> Dict[str, str]:
+        with self._lock:
+            return {
+                str(self._ids[row]): self._documents[row]
+                for row in range(self._size)
+            }
+    
+    def get_embeddings(self, page_size: int = 5000):
+        with self._lock:
+            size = self._size
+            ids = [str(id_) for id_ in self._ids[:size]]
+            return ids, self._dequantize(self._matrix[:size], self._scales[:size])
+    
+    def get_embedding(self, id_: str) -> Optional[np.ndarray]:
+        """Вектор одного товара (None — товара нет в индексе)"""
+        with self._lock:
+            row = self._rows.get(int(id_))
+            if row is None:
+                return None
+            return self._dequantize(self._matrix[row:row + 1], self._scales[row:row + 1])[0]
+    
+    def _mask(self, filters: Dict[str, Any], size: int) -> Optional[np.ndarray]:
+        """Булева маска строк, подходящих под фильтры (None — фильтров нет)"""
+        mask = None
+        
+        def combine(condition: np.ndarray) -> None:
+            nonlocal mask
+            mask = condition if mask is None else mask & condition
+        
+        if filters.get("in_stock_only"):
+            combine(self._in_stock[:size])
+        for column, values in (("category", self._category), ("brand", self._brand)):
+            if filters.get(column):
+                code = self._codes[column].get(filters[column])
+                if code is None:
+                    return np.zeros(size, dtype=bool)
+                combine(values[:size] == code)
+        if filters.get("min_price") is not None:
+            combine(self._price[:size] >= filters["min_price"])
+        if filters.get("max_price") is not None:
+            combine(self._price[:size] <= filters["max_price"])
+        
+        return mask
+    
+    def query(
+        self,
+        embeddings: np.ndarray,
+        n_results: int,
+        filters: Dict[str, Any],
+    ) -> List[List[Dict[str, Any]]]:
+        """Найти ближайшие товары для каждого эмбеддинга запроса"""
+        queries = self._normalize(np.atleast_2d(embeddings))
+        
+        with self._lock:
+            size = self._size
+            if size == 0:
+                return [[] for _ in queries]
+            
+            mask = self._mask(filters, size)
+            if mask is None:
+                rows = np.arange(size)
+                scores = self._score(None, size, queries)
+            else:
+                rows = np.flatnonzero(mask)
+                if len(rows) > size // 2:
+                    # Фильтр почти ничего не отсекает — дешевле посчитать всю матрицу
+                    scores = self._score(None, size, queries)[rows]
+                else:
+                    scores = self._score(rows, size, queries)
+            
+            found = []
+            k = min(n_results, len(rows))
+            for q in range(len(queries)):
+                column = scores[:, q]
+                if k == 0:
+                    found.append([])
+                    continue
+                
+                top = np.argpartition(-column, k - 1)[:k] if k < len(rows) else np.arange(len(rows))
+                top = top[np.argsort(-column[top])]
+                
+                found.append([
+                    {
+                        "id": int(self._ids[rows[i]]),
+                        "document": self._documents[rows[i]],
+                        "metadata": self._metadatas[rows[i]],
+                        "distance": float(1.0 - column[i]),
+                    }
+                    for i in top
+                ])
+            return found
+    
+    def count(self) -> int:
+        return self._size
+    
+    def memory_bytes(self) -> int:
+        """Объём памяти, занимаемый векторами"""
+        return int(self._matrix[:self._size].nbytes + self._scales[:self._size].nbytes)
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._reset()
+            self._dirty = True
+    
+    def flush(self) -> None:
+        """Сохранить индекс на диск (атомарно, через временный файл)"""
+        if self.path is None or not self._dirty:
+            return
+        
+        with self._lock:
+            size = self._size
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            payload = json.dumps(
+                {"documents": self._documents, "metadatas": self._metadatas},
+                ensure_ascii=False,
+            ).encode("utf-8")
+            
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            with open(tmp_path, "wb") as f:
+                np.savez(
+                    f,
+                    ids=self._ids[:size],
+                    matrix=self._matrix[:size],
+                    scales=self._scales[:size],
+                    payload=np.frombuffer(payload, dtype=np.uint8),
+                )
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        
+        logger.info(f"NumPy-индекс сохранён: {self.path} ({size} товаров)")
+    
+    def save_snapshot(self, path: Path, attachments: Optional[Dict[str, np.ndarray]] = None) -> int:
+        """
+        Сохранить индекс в файл снимка
+        
+        Args:
+            path: Файл снимка
+            attachments: Дополнительные массивы (например, индексы каталога),
+                доступные после открытия снимка в self.attachments
+        
+        Returns:
+            Размер файла в байтах
+        """
+        with self._lock:
+            size = self._size
+            payload = json.dumps(
+                {"documents": self._documents, "metadatas": self._metadatas},
+                ensure_ascii=False,
+            ).encode("utf-8")
+            arrays = {
+                "ids": self._ids[:size],
+                "matrix": self._matrix[:size],
+                "scales": self._scales[:size],
+                "price": self._price[:size],
+                "in_stock": self._in_stock[:size],
+                "brand": self._brand[:size],
+                "category": self._category[:size],
+                "payload": np.frombuffer(payload, dtype=np.uint8),
+            }
+            for name, array in (attachments or {}).items():
+                arrays[self.ATTACHMENT_PREFIX + name] = array
+            return write_snapshot(path, arrays, {"dtype": self.dtype, "codes": self._codes})
+    
+    def _open_snapshot(self) -> None:
+        """Открыть индекс из снимка без копирования колонок в память"""
+        arrays, meta = read_snapshot(self.snapshot)
+        payload = json.loads(arrays["payload"].tobytes().decode("utf-8"))
+        
+        self.dtype = meta["dtype"]
+        self._ids = arrays["ids"]
+        self._matrix = arrays["matrix"]
+        self._scales = arrays["scales"]
+        self._price = arrays["price"]
+        self._in_stock = arrays["in_stock"]
+        self._brand = arrays["brand"]
+        self._category = arrays["category"]
+        self._codes = meta["codes"]
+        self._documents = payload["documents"]
+        self._metadatas = payload["metadatas"]
+        self._size = len(self._ids)
+        self._rows = {int(id_): row for row, id_ in enumerate(self._ids.tolist())}
+        self.attachments = {
+            name[len(self.ATTACHMENT_PREFIX):]: array
+            for name, array in arrays.items()
+            if name.startswith(self.ATTACHMENT_PREFIX)
+        }
+    
+    def reload(self) -> None:
+        """Перечитать индекс с диска"""
+        with self._lock:
+            self._reset()
+            if self.snapshot is not None:
+                if self.snapshot.exists():
+                    self._open_snapshot()
+                else:
+                    logger.warning(f"Снимок индекса не найден: {self.snapshot}")
+                return
+            
+            if self.path is None or not self.path.exists():
+                return
+            
+            with np.load(self.path) as data:
+                ids = data["ids"]
+                matrix = data["matrix"]
+                scales = data["scales"] if "scales" in data else np.ones(len(ids), dtype=np.float32)
+                payload = json.loads(data["payload"].tobytes().decode("utf-8"))
+            
+            # Индекс сохранён с другим типом хранения — перекодируем
+            if matrix.dtype != np.dtype(self.dtype):
+                matrix, scales = self._quantize(self._dequantize(matrix, scales))
+            
+            if len(ids):
+                self._ensure_capacity(len(ids), matrix.shape[1])
+                self._ids[:len(ids)] = ids
+                self._matrix[:len(ids)] = matrix
+                self._scales[:len(ids)] = scales
+                self._size = len(ids)
+                self._documents = payload["documents"]
+                self._metadatas = payload["metadatas"]
+                self._rows = {int(id_): row for row, id_ in enumerate(ids)}
+                for row, metadata in enumerate(self._metadatas):
+                    self._set_metadata(row, metadata)
+            
+            self._dirty = False
+
+
+class PartitionedIndex:
+    """
+    Индекс, разбитый на шарды по категории товара
+    
+    Каждая категория хранится в отдельном индексе (коллекции ChromaDB или
+    файле NumPy-индекса). Поиск с фильтром category обращается только к
+    шарду этой категории: HNSW не обходит граф всего каталога, отбрасывая
+    чужие категории пост-фильтром. Поиск без категории выполняется во всех
+    непустых шардах, результаты сливаются по расстоянию.
+    
+    Категория входит в текст товара, поэтому её смена всегда приходит
+    через upsert (с вектором) — товар переносится в новый шард.
+    """
+    
+    def __init__(
+        self,
+        open_shard: Callable[[str], Any],
+        list_shards: Callable[[], List[str]],
+        max_batch_size: int,
+    ):
+        """
+        Args:
+            open_shard: Открыть (или создать) шард по ключу
+            list_shards: Ключи существующих шардов
+            max_batch_size: Максимальный размер одной операции записи
+        """
+        self.open_shard = open_shard
+        self.list_shards = list_shards
+        self.max_batch_size = max_batch_size
+        self._lock = threading.RLock()
+        self.reload()
+    
+    @staticmethod
+    def shard_key(category: Optional[str]) -> str:
+        """Ключ шарда категории (имена коллекций ChromaDB допускают только латиницу)"""
+        return hashlib.sha1((category or "").encode("utf-8")).hexdigest()[:12]
+    
+    def _shard(self, key: str):
+        shard = self._shards.get(key)
+        if shard is None:
+            shard = self._shards[key] = self.open_shard(key)
+        return shard
+    
+    def _group(self, ids: List[str], keys: List[Optional[str]]) -> Dict[str, List[int]]:
+        """Позиции ID, сгруппированные по ключу шарда (None — пропустить)"""
+        groups: Dict[str, List[int]] = {}
+        for position, key in enumerate(keys):
+            if key is not None:
+                groups.setdefault(key, []).append(position)
+        return groups
+    
+    def _set_owner(self, id_: str, key: Optional[str]) -> None:
+        previous = self._owner.pop(id_, None)
+        if previous is not None:
+            self._counts[previous] -= 1
+        if key is not None:
+            self._owner[id_] = key
+            self._counts[key] += 1
+    
+    def upsert(
+        self,
+        ids: List[str],
+        embeddings: np.ndarray,
+        documents: List[str],
+        metadatas: List[Dict[str, Any]],
+    ) -> None:
+        embeddings = np.asarray(embeddings)
+        keys = [self.shard_key((metadata or {}).get("category")) for metadata in metadatas]
+        
+        with self._lock:
+            # Товар сменил категорию — удаляем его из старого шарда
+            moved = [
+                (id_, self._owner[id_]) for id_, key in zip(ids, keys)
+                if self._owner.get(id_, key) != key
+            ]
+            for key, positions in self._group([id_ for id_, _ in moved], [k for _, k in moved]).items():
+                self._shard(key).delete([moved[i][0] for i in positions])
+            
+            for key, positions in self._group(ids, keys).items():
+                self._shard(key).upsert(
+                    ids=[ids[i] for i in positions],
+                    embeddings=embeddings[positions],
+                    documents=[documents[i] for i in positions],
+                    metadatas=[metadatas[i] for i in positions],
+                )
+            for id_, key in zip(ids, keys):
+                self._set_owner(id_, key)
+    
+    def update_metadata(self, ids: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            owners = [self._owner.get(id_) for id_ in ids]
+            for key, positions in self._group(ids, owners).items():
+                self._shard(key).update_metadata(
+                    ids=[ids[i] for i in positions],
+                    metadatas=[metadatas[i] for i in positions],
+                )
+    
+    def delete(self, ids: List[str]) -> None:
+        with self._lock:
+            owners = [self._owner.get(id_) for id_ in ids]
+            for key, positions in self._group(ids, owners).items():
+                self._shard(key).delete([ids[i] for i in positions])
+            for id_ in ids:
+                self._set_owner(id_, None)
+    
+    def query(
+        self,
+        embeddings: np.ndarray,
+        n_results: int,
+        filters: Dict[str, Any],
+    ) -> List[List[Dict[str, Any]]]:
+        """Найти ближайшие товары: в шарде категории или во всех шардах"""
+        embeddings = np.atleast_2d(embeddings)
+        
+        with self._lock:
+            if filters.get("category"):
+                keys = [self.shard_key(filters["category"])]
+            else:
+                keys = list(self._shards)
+            shards = [self._shards[key] for key in keys if self._counts.get(key)]
+        
+        if not shards:
+            return [[] for _ in embeddings]
+        if len(shards) == 1:
+            return shards[0].query(embeddings, n_results, filters)
+        
+        found: List[List[Dict[str, Any]]] = [[] for _ in embeddings]
+        for shard in shards:
+            for q, hits in enumerate(shard.query(embeddings, n_results, filters)):
+                found[q].extend(hits)
+        return [sorted(hits, key=lambda hit: hit["distance"])[:n_results] for hits in found]
+    
+    def get_metadata(self, page_size: int = 5000) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            metadatas = {}
+            for shard in self._shards.values():
+                metadatas.update(shard.get_metadata(page_size))
+            return metadatas
+    
+    def get_documents(self, page_size: int = 5000) -> Dict[str, str]:
+        with self._lock:
+            documents = {}
+            for shard in self._shards.values():
+                documents.update(shard.get_documents(page_size))
+            return documents
+    
+    def get_embeddings(self, page_size: int = 5000):
+        with self._lock:
+            ids, embeddings = [], []
+            for shard in self._shards.values():
+                shard_ids, shard_embeddings = shard.get_embeddings(page_size)
+                if shard_ids:
+                    ids.extend(shard_ids)
+                    embeddings.append(shard_embeddings)
+            return ids, np.concatenate(embeddings) if embeddings else np.empty((0, 0), dtype=np.float32)
+    
+    def get_embedding(self, id_: str) -> Optional[np.ndarray]:
+        with self._lock:
+            key = self._owner.get(str(id_))
+            return self._shards[key].get_embedding(id_) if key is not None else None
+    
+    def count(self) -> int:
+        return len(self._owner)
+    
+    def shard_sizes(self) -> Dict[str, int]:
+        """Количество товаров в каждом непустом шарде"""
+        with self._lock:
+            return {key: count for key, count in self._counts.items() if count}
+    
+    def clear(self) -> None:
+        with self._lock:
+            for shard in self._shards.values():
+                shard.clear()
+            self._owner = {}
+            self._counts = Counter()
+    
+    def flush(self) -> None:
+        with self._lock:
+            for shard in self._shards.values():
+                shard.flush()
+    
+    def reload(self) -> None:
+        """Найти существующие шарды и перечитать их"""
+        with self._lock:
+            self._shards: Dict[str, Any] = {key: self.open_shard(key) for key in self.list_shards()}
+            self._owner: Dict[str, str] = {}
+            self._counts: Counter = Counter()
+            for key, shard in self._shards.items():
+                for id_ in shard.get_metadata():
+                    self._set_owner(id_, key)
+
+
+def create_index(
+    backend: str,
+    chroma_path: Path,
+    numpy_path: Path,
+    vector_dtype: str = "float32",
+    snapshot_path: Optional[Path] = None,
+    partition_by: str = "",
+):
+    """Создать индекс по названию бэкенда из настроек"""
+    if partition_by and backend != "snapshot":
+        if partition_by != "category":
+            raise ValueError(f"Неподдерживаемое разбиение индекса: {partition_by}")
+        return _create_partitioned_index(backend, chroma_path, numpy_path, vector_dtype)
+    
+    if backend == "numpy":
+        return NumpyIndex(numpy_path, dtype=vector_dtype)
+    if backend == "snapshot":
+        return NumpyIndex(dtype=vector_dtype, snapshot=snapshot_path)
+    if backend == "chroma":
+        return ChromaIndex(chroma_path)
+    raise ValueError(f"Неизвестный бэкенд векторного индекса: {backend}")
+
+
+def _create_partitioned_index(
+    backend: str,
+    chroma_path: Path,
+    numpy_path: Path,
+    vector_dtype: str,
+) -> PartitionedIndex:
+    """Индекс с шардами по категориям: коллекции products-<ключ> или файлы <имя>.<ключ>.npz"""
+    if backend == "chroma":
+        prefix = "products-"
+        chroma_path.mkdir(parents=True, exist_ok=True)
+        client = chromadb.PersistentClient(
+            path=str(chroma_path),
+            settings=ChromaSettings(anonymized_telemetry=False, allow_reset=True),
+        )
+        return PartitionedIndex(
+            open_shard=lambda key: ChromaIndex(chroma_path, name=prefix + key),
+            list_shards=lambda: [
+                collection.name[len(prefix):]
+                for collection in client.list_collections()
+                if collection.name.startswith(prefix)
+            ],
+            max_batch_size=client.get_max_batch_size(),
+        )
+    
+    if backend == "numpy":
+        return PartitionedIndex(
+            open_shard=lambda key: NumpyIndex(
+                numpy_path.with_name(f"{numpy_path.stem}.{key}{numpy_path.suffix}"),
+                dtype=vector_dtype,
+            ),
+            list_shards=lambda: [
+                path.name[len(numpy_path.stem) + 1:-len(numpy_path.suffix)]
+                for path in numpy_path.parent.glob(f"{numpy_path.stem}.*{numpy_path.suffix}")
+            ],
+            max_batch_size=NumpyIndex.max_batch_size,
+        )
+    
+    raise ValueError(f"Неизвестный бэкенд векторного индекса: {backend}")
@@ -0,0 +1,108 @@
+"""
+Индекс точных ключей товара: артикул, модель и внешний ID
+"""
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from src.ai.lexical import is_code_token
+
+KEY_FIELDS = ("article", "model", "external_id")
+
+# Пробелы, дефисы, тире, подчёркивания, точки и слэши при сравнении ключей не учитываются
+_SEPARATORS_RE = re.compile(r"[\s\-‐-―_./\\]+")
+_TOKEN_SPLIT_RE = re.compile(r"[\s,;]+")
+
+
+def normalize_key(value: Any) -> str:
+    """Привести артикул или модель к каноническому виду"""
+    return _SEPARATORS_RE.sub("", str(value or "").lower().replace("ё", "е"))
+
+
+class ProductKeyIndex:
+    """
+    Точный поиск товара по артикулу, модели или внешнему ID
+    
+    Ключи нормализуются (регистр, пробелы, дефисы), поэтому "RB37A5470SA",
+    "rb37a5470sa" и "RB-37A 5470SA" находят один товар. Запрос проверяется
+    целиком и по отдельным словам: "холодильник RB37A5470SA" тоже находится.
+    """
+    
+    # Слова короче не считаются ключом, чтобы "60" или "LG" не совпадали с кодами
+    MIN_TOKEN_LENGTH = 4
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.lookups = 0
+        self.hits = 0
+        self.clear()
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._ids: Dict[str, Set[str]] = {}
+            self._keys: Dict[str, List[str]] = {}
+    
+    def build(self, metadatas: Dict[str, Dict[str, Any]]) -> None:
+        """Построить индекс заново по метаданным {id: metadata}"""
+        with self._lock:
+            self.clear()
+            self.update(list(metadatas), list(metadatas.values()))
+    
+    def update(self, ids: Iterable[str], metadatas: Iterable[Dict[str, Any]]) -> None:
+        """Добавить или обновить товары"""
+        with self._lock:
+            for id_, metadata in zip(ids, metadatas):
+                id_ = str(id_)
+                self._remove(id_)
+                
+                keys = {normalize_key((metadata or {}).get(field)) for field in KEY_FIELDS}
+                keys.discard("")
+                for key in keys:
+                    self._ids.setdefault(key, set()).add(id_)
+                if keys:
+                    self._keys[id_] = list(keys)
+    
+    def remove(self, ids: Iterable[str]) -> None:
+        """Удалить товары"""
+        with self._lock:
+            for id_ in ids:
+                self._remove(str(id_))
+    
+    def _remove(self, id_: str) -> None:
+        for key in self._keys.pop(id_, []):
+            ids = self._ids[key]
+            ids.discard(id_)
+            if not ids:
+                del self._ids[key]
+    
+    def lookup(self, query: str) -> Optional[List[str]]:
+        """ID товаров, ключ которых совпал с запросом или его словом (None — совпадений нет)"""
+        # Отдельное слово должно быть похоже на код (буквы и цифры): числа
+        # в запросе ("до 50000 рублей", "2024 года") — это цены и годы, а не
+        # внешний ID. Числовой ключ совпадает, только если он и есть весь запрос
+        candidates = [normalize_key(query)]
+        candidates += [
+            normalize_key(token) for token in _TOKEN_SPLIT_RE.split(query)
+            if len(token) >= self.MIN_TOKEN_LENGTH and is_code_token(token.lower())
+        ]
+        
+        with self._lock:
+            self.lookups += 1
+            found: Dict[str, None] = {}
+            for key in candidates:
+                for id_ in sorted(self._ids.get(key, ())):
+                    found[id_] = None
+            
+            if not found:
+                return None
+            self.hits += 1
+            return list(found)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Размер индекса и доля запросов, найденных по ключу"""
+        return {
+            "keys": len(self._ids),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+        }
@@ -0,0 +1,306 @@
+"""
+Лексический поиск по каталогу: инвертированный индекс с ранжированием BM25
+"""
+import re
+import math
+import heapq
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Разбить текст на токены: регистр и ё/е не различаются"""
+    return TOKEN_RE.findall(text.lower().replace("ё", "е"))
+
+
+# Число с единицей измерения ("90см", "800м3", "2000вт") — размер или параметр, а не модель
+UNIT_RE = re.compile(
+    r"\d+(?:см|мм|м|м2|м3|л|кг|г|вт|квт|в|гц|дб|об|шт|cm|mm|m|m3|l|kg|w|kw|v|hz|db|rpm)",
+    re.UNICODE,
+)
+
+
+def is_code_token(token: str) -> bool:
+    """Похож ли токен на артикул или модель (буквы вперемешку с цифрами, не число с единицей)"""
+    return (
+        len(token) >= 4
+        and any(c.isdigit() for c in token)
+        and any(c.isalpha() for c in token)
+        and not UNIT_RE.fullmatch(token)
+    )
+
+
+def matches_filters(metadata: Dict[str, Any], filters: Dict[str, Any]) -> bool:
+    """Проверить метаданные товара на соответствие фильтрам поиска"""
+    if filters.get("in_stock_only") and not metadata.get("in_stock"):
+        return False
+    for field in ("category", "brand"):
+        if filters.get(field) and metadata.get(field) != filters[field]:
+            return False
+    price = metadata.get("price") or 0
+    if filters.get("min_price") is not None and price < filters["min_price"]:
+        return False
+    if filters.get("max_price") is not None and price > filters["max_price"]:
+        return False
+    return True
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Объединить несколько ранжированных списков ID методом RRF"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, id_ in enumerate(ranking):
+            scores[id_] = scores.get(id_, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class LexicalIndex:
+    """
+    Инвертированный индекс BM25 по тексту товаров
+    
+    Строится по тому же тексту, что и эмбеддинги (_create_product_text),
+    и обновляется вместе с векторным индексом. Хорошо находит то, что
+    плохо ранжирует модель эмбеддингов: модели, артикулы, редкие слова.
+    """
+    
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self.clear()
+    
+    def clear(self) -> None:
+        with self._lock:
+            # термин -> {id товара: частота термина}
+            self._postings: Dict[str, Dict[str, int]] = {}
+            # id товара -> его термины (нужны, чтобы убрать товар из индекса;
+            # None — ещё не восстановлены после load)
+            self._terms: Optional[Dict[str, List[str]]] = {}
+            self._lengths: Dict[str, int] = {}
+            self._total_length = 0
+            self._documents: Dict[str, str] = {}
+            self._metadatas: Dict[str, Dict[str, Any]] = {}
+    
+    def build(self, documents: Dict[str, str], metadatas: Dict[str, Dict[str, Any]]) -> None:
+        """Построить индекс заново по документам и метаданным {id: ...}"""
+        with self._lock:
+            self.clear()
+            ids = list(documents)
+            self.update(ids, [documents[id_] for id_ in ids], [metadatas.get(id_) or {} for id_ in ids])
+    
+    def update(
+        self,
+        ids: Iterable[str],
+        documents: Iterable[str],
+        metadatas: Iterable[Dict[str, Any]],
+    ) -> None:
+        """Добавить или заменить товары"""
+        with self._lock:
+            for id_, document, metadata in zip(ids, documents, metadatas):
+                id_ = str(id_)
+                self._remove(id_)
+                
+                terms = Counter(tokenize(document))
+                for term, frequency in terms.items():
+                    self._postings.setdefault(term, {})[id_] = frequency
+                
+                self._terms[id_] = list(terms)
+                self._lengths[id_] = sum(terms.values())
+                self._total_length += self._lengths[id_]
+                self._documents[id_] = document
+                self._metadatas[id_] = metadata
+    
+    def export(self) -> Dict[str, np.ndarray]:
+        """
+        Постинги в виде массивов для снимка индекса (см. load)
+        
+        Термины и ID товаров хранятся текстом через перевод строки (токены
+        не содержат пробельных символов), постинги — сгруппированными по
+        терминам номерами товаров и частотами.
+        """
+        with self._lock:
+            ids = list(self._lengths)
+            rows = {id_: row for row, id_ in enumerate(ids)}
+            vocabulary = list(self._postings)
+            
+            offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(self._postings[term]) for term in vocabulary])
+            posting_rows = np.empty(offsets[-1], dtype=np.int32)
+            posting_freqs = np.empty(offsets[-1], dtype=np.int32)
+            for term, start in zip(vocabulary, offsets.tolist()):
+                postings = self._postings[term]
+                posting_rows[start:start + len(postings)] = [rows[id_] for id_ in postings]
+                posting_freqs[start:start + len(postings)] = list(postings.values())
+            
+            return {
+                "ids": np.frombuffer("\n".join(ids).encode("utf-8"), dtype=np.uint8),
+                "vocabulary": np.frombuffer("\n".join(vocabulary).encode("utf-8"), dtype=np.uint8),
+                "lengths": np.array([self._lengths[id_] for id_ in ids], dtype=np.int32),
+                "offsets": offsets,
+                "rows": posting_rows,
+                "freqs": posting_freqs,
+            }
+    
+    def load(
+        self,
+        arrays: Dict[str, np.ndarray],
+        documents: Dict[str, str],
+        metadatas: Dict[str, Dict[str, Any]],
+    ) -> bool:
+        """
+        Загрузить индекс из массивов export() без токенизации текстов
+        
+        Returns:
+            False, если товары в массивах не совпадают с documents
+            (индекс не изменён, его нужно построить через build)
+        """
+        decoded = arrays["ids"].tobytes().decode("utf-8")
+        ids = decoded.split("\n") if decoded else []
+        if len(ids) != len(documents) or set(ids) != set(documents):
+            return False
+        
+        decoded = arrays["vocabulary"].tobytes().decode("utf-8")
+        vocabulary = decoded.split("\n") if decoded else []
+        offsets = arrays["offsets"].tolist()
+        posting_rows = arrays["rows"].tolist()
+        posting_freqs = arrays["freqs"].tolist()
+        
+        with self._lock:
+            self.clear()
+            for term, start, end in zip(vocabulary, offsets, offsets[1:]):
+                self._postings[term] = dict(zip(
+                    [ids[row] for row in posting_rows[start:end]],
+                    posting_freqs[start:end],
+                ))
+            
+            # Термины товаров восстанавливаются из постингов при первом удалении
+            self._terms = None
+            self._lengths = dict(zip(ids, arrays["lengths"].tolist()))
+            self._total_length = sum(self._lengths.values())
+            self._documents = {id_: documents[id_] for id_ in ids}
+            self._metadatas = {id_: metadatas.get(id_) or {} for id_ in ids}
+        return True
+    
+    def update_metadata(self, ids: Iterable[str], metadatas: Iterable[Dict[str, Any]]) -> None:
+        """Обновить метаданные без переиндексации текста"""
+        with self._lock:
+            for id_, metadata in zip(ids, metadatas):
+                if str(id_) in self._metadatas:
+                    self._metadatas[str(id_)] = metadata
+    
+    def remove(self, ids: Iterable[str]) -> None:
+        """Удалить товары"""
+        with self._lock:
+            for id_ in ids:
+                self._remove(str(id_))
+    
+    def _remove(self, id_: str) -> None:
+        if self._terms is None:
+            self._terms = {id_: [] for id_ in self._lengths}
+            for term, postings in self._postings.items():
+                for posting_id in postings:
+                    self._terms[posting_id].append(term)
+        
+        terms = self._terms.pop(id_, None)
+        if terms is None:
+            return
+        
+        for term in terms:
+            postings = self._postings[term]
+            del postings[id_]
+            if not postings:
+                del self._postings[term]
+        
+        self._total_length -= self._lengths.pop(id_)
+        del self._documents[id_]
+        del self._metadatas[id_]
+    
+    def search(
+        self,
+        query: str,
+        n_results: int,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> List[Tuple[str, float]]:
+        """Найти товары по запросу, вернуть [(id, оценка BM25)] по убыванию"""
+        filters = filters or {}
+        with self._lock:
+            documents = len(self._lengths)
+            if not documents:
+                return []
+            average_length = self._total_length / documents
+            
+            scores: Dict[str, float] = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                
+                idf = math.log(1 + (documents - len(postings) + 0.5) / (len(postings) + 0.5))
+                for id_, frequency in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[id_] / average_length)
+                    scores[id_] = scores.get(id_, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+            
+            if filters:
+                scores = {
+                    id_: score for id_, score in scores.items()
+                    if matches_filters(self._metadatas[id_], filters)
+                }
+            
+            return heapq.nlargest(n_results, scores.items(), key=lambda item: item[1])
+    
+    def exact_match(
+        self,
+        query: str,
+        n_results: int,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> Optional[List[Tuple[str, float]]]:
+        """
+        Точное совпадение по артикулам и моделям из запроса
+        
+        Если в запросе есть токены, похожие на код модели, и все они
+        встречаются в модели или артикуле одних и тех же товаров, возвращает
+        эти товары (ранжированные BM25). Иначе None — нужен обычный поиск:
+        совпадение только в описании ("90см" в тексте) ничего не решает.
+        None возвращается и тогда, когда ни один найденный товар не прошёл
+        фильтры.
+        """
+        codes = [token for token in tokenize(query) if is_code_token(token)]
+        if not codes:
+            return None
+        
+        with self._lock:
+            candidates = None
+            for code in codes:
+                postings = self._postings.get(code)
+                if not postings:
+                    return None
+                candidates = set(postings) if candidates is None else candidates & set(postings)
+            candidates = {
+                id_ for id_ in candidates
+                if set(codes) <= set(tokenize(
+                    f"{self._metadatas[id_].get('model') or ''} {self._metadatas[id_].get('article') or ''}"
+                ))
+            }
+            if not candidates:
+                return None
+            
+            ranked = dict(self.search(query, len(self._lengths), filters))
+            found = [(id_, ranked[id_]) for id_ in candidates if id_ in ranked]
+            if not found:
+                return None
+            return sorted(found, key=lambda item: item[1], reverse=True)[:n_results]
+    
+    def get(self, id_: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Документ и метаданные товара (None, если товара нет)"""
+        with self._lock:
+            if id_ not in self._documents:
+                return None
+            return self._documents[id_], self._metadatas[id_]
+    
+    def __len__(self) -> int:
+        return len(self._lengths)
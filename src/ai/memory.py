@@ -0,0 +1,201 @@
+"""
+Память разговора: история в пределах бюджета токенов и краткое содержание ранних реплик
+"""
+import asyncio
+import threading
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+SUMMARY_PREFIX = "Краткое содержание предыдущей части разговора:\n"
+
+# Служебные токены формата чата на каждое сообщение
+MESSAGE_OVERHEAD = 4
+
+
+class TokenCounter:
+    """
+    Подсчёт токенов словарём токенизатора модели (tiktoken)
+    
+    Если словарь недоступен (нет пакета или сети для загрузки словаря),
+    токены оцениваются по длине текста: около трёх символов на токен
+    для русского текста.
+    """
+    
+    def __init__(self, model: str):
+        self.model = model
+        self._encoding = None
+        self._loaded = False
+        self._lock = threading.Lock()
+    
+    def _get_encoding(self):
+        with self._lock:
+            if not self._loaded:
+                self._loaded = True
+                try:
+                    import tiktoken
+                    
+                    try:
+                        self._encoding = tiktoken.encoding_for_model(self.model)
+                    except KeyError:
+                        self._encoding = tiktoken.get_encoding("o200k_base")
+                except Exception as e:
+                    logger.warning(f"Словарь токенизатора недоступен, токены оцениваются по длине текста: {e}")
+            return self._encoding
+    
+    def count(self, text: str) -> int:
+        encoding = self._get_encoding()
+        if encoding is None:
+            return len(text) // 3 + 1
+        return len(encoding.encode(text, disallowed_special=()))
+    
+    def count_message(self, message: Dict[str, Any]) -> int:
+        return MESSAGE_OVERHEAD + self.count(message.get("content") or "")
+
+
+@lru_cache(maxsize=None)
+def get_token_counter(model: str) -> TokenCounter:
+    """Счётчик токенов, общий для процесса (словарь загружается один раз)"""
+    return TokenCounter(model)
+
+
+class ConversationMemory:
+    """
+    История разговора в пределах бюджета токенов
+    
+    История по-прежнему хранится списком сообщений. Когда реплики перестают
+    помещаться в бюджет, первым элементом списка становится системное
+    сообщение с кратким содержанием, а ранние реплики сворачиваются в него
+    в фоне: ответ пользователю свёртки не ждёт, а до её окончания в запрос
+    просто попадают только последние реплики, которые помещаются в бюджет.
+    
+    Свёртка меняет словари сообщений на месте (краткое содержание и отметка
+    "folded" у свёрнутых реплик), поэтому её результат виден и в копиях
+    списка, созданных следующими ходами разговора.
+    """
+    
+    # Задачи свёртки: ссылки нужны, чтобы задачи не собрал сборщик мусора
+    _tasks: Set[asyncio.Task] = set()
+    
+    def __init__(
+        self,
+        counter: TokenCounter,
+        budget: int,
+        summarize: Callable[[Optional[str], List[Dict[str, Any]]], Awaitable[str]],
+    ):
+        """
+        Args:
+            counter: Счётчик токенов
+            budget: Сколько токенов истории отправлять модели
+            summarize: Корутина (краткое содержание, реплики) -> новое краткое содержание
+        """
+        self.counter = counter
+        self.budget = budget
+        self.summarize = summarize
+    
+    @staticmethod
+    def _summary(history: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if history and history[0].get("summary"):
+            return history[0]
+        return None
+    
+    @staticmethod
+    def _turns(history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Реплики, ещё не свёрнутые в краткое содержание"""
+        return [
+            message for message in history
+            if not message.get("summary") and not message.get("folded")
+        ]
+    
+    def context(self, history: List[Dict[str, Any]]) -> Tuple[List[Dict[str, str]], int]:
+        """
+        Сообщения истории для запроса к модели
+        
+        Returns:
+            Tuple[сообщения, их размер в токенах]: краткое содержание и
+            последние реплики, которые помещаются в бюджет
+        """
+        turns = self._turns(history)
+        
+        selected: List[Dict[str, Any]] = []
+        tokens = 0
+        for message in reversed(turns):
+            size = self.counter.count_message(message)
+            if selected and tokens + size > self.budget:
+                break
+            selected.append(message)
+            tokens += size
+        selected.reverse()
+        
+        # Контекст начинается с реплики клиента, а не с середины обмена
+        while len(selected) > 1 and selected[0]["role"] != "user":
+            tokens -= self.counter.count_message(selected.pop(0))
+        
+        messages = [{"role": message["role"], "content": message["content"]} for message in selected]
+        
+        summary = self._summary(history)
+        if summary is not None and summary["content"]:
+            messages.insert(0, {"role": "system", "content": SUMMARY_PREFIX + summary["content"]})
+            tokens += self.counter.count_message(messages[0])
+        
+        return messages, tokens
+    
+    def append(self, history: List[Dict[str, Any]], user_message: str, response: str) -> List[Dict[str, Any]]:
+        """
+        Новая история с обменом сообщениями
+        
+        Свёрнутые реплики из неё убираются. Если оставшиеся не помещаются
+        в бюджет, запускается фоновая свёртка ранних реплик.
+        """
+        updated = [message for message in history if not message.get("folded")]
+        updated += [
+            {"role": "user", "content": user_message},
+            {"role": "assistant", "content": response},
+        ]
+        
+        turns = self._turns(updated)
+        if sum(self.counter.count_message(message) for message in turns) > self.budget:
+            self._schedule_fold(updated, turns)
+        
+        return updated
+    
+    def _schedule_fold(self, history: List[Dict[str, Any]], turns: List[Dict[str, Any]]) -> None:
+        summary = self._summary(history)
+        if summary is None:
+            summary = {"role": "system", "content": "", "summary": True}
+            history.insert(0, summary)
+        if summary.get("pending"):
+            return
+        
+        # Сворачиваем с запасом (останется половина бюджета), чтобы свёртка
+        # не запускалась на каждом ходу; последний обмен остаётся как есть
+        keep = 0
+        tokens = 0
+        for message in reversed(turns):
+            tokens += self.counter.count_message(message)
+            if keep >= 2 and tokens > self.budget // 2:
+                break
+            keep += 1
+        folded = turns[:len(turns) - keep]
+        while folded and folded[-1]["role"] == "user":
+            folded.pop()
+        if not folded:
+            return
+        
+        summary["pending"] = True
+        task = asyncio.create_task(self._fold(summary, folded))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def _fold(self, summary: Dict[str, Any], folded: List[Dict[str, Any]]) -> None:
+        try:
+            summary["content"] = await self.summarize(summary["content"] or None, folded)
+            for message in folded:
+                message["folded"] = True
+            logger.info(f"История разговора: свёрнуто в краткое содержание сообщений — {len(folded)}")
+        except Exception as e:
+            # Реплики остаются как есть, свёртка повторится на следующем ходу
+            logger.error(f"Ошибка свёртки истории разговора: {e}")
+        finally:
+            summary.pop("pending", None)
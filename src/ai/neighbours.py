@@ -0,0 +1,326 @@
+"""
+Таблица ближайших соседей товаров для рекомендаций
+"""
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+
+class NeighbourTable:
+    """
+    Предрассчитанные top-K похожих товаров по косинусной близости
+    
+    Рекомендации читаются из таблицы без кодирования текста моделью.
+    При изменении векторов пересчитываются только затронутые строки:
+    строки изменённых товаров целиком, остальные — слиянием текущего
+    списка с новыми кандидатами. Пересчёт откладывается до первого
+    обращения или flush(), поэтому серия изменений обрабатывается разом.
+    
+    Векторы нужны только для пересчёта: процесс, который лишь читает
+    таблицу (бот, API), загружает из файла одни списки соседей, а векторы
+    при необходимости запрашивает у индекса через load_vectors.
+    """
+    
+    # Сколько строк или столбцов матрицы близости считать за раз
+    BLOCK = 512
+    
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        k: int = 24,
+        load_vectors: Optional[Callable[[], Tuple[List[str], np.ndarray]]] = None,
+    ):
+        """
+        Args:
+            path: Файл .npz для сохранения таблицы (None — только в памяти)
+            k: Сколько соседей хранить для каждого товара
+            load_vectors: Функция, возвращающая (ids, векторы) всех товаров индекса
+        """
+        self.path = path
+        self.k = k
+        self.load_vectors = load_vectors
+        self._lock = threading.RLock()
+        self._reset()
+    
+    def _reset(self) -> None:
+        self._size = 0
+        self._ids = np.empty(0, dtype=np.int64)
+        self._rows: dict = {}
+        self._matrix: Optional[np.ndarray] = None
+        self._neighbours = np.empty((0, self.k), dtype=np.int64)
+        self._scores = np.empty((0, self.k), dtype=np.float32)
+        self._pending: set = set()
+        self._removed: set = set()
+        self._dirty = False
+    
+    def _ensure_vectors(self) -> None:
+        """Загрузить векторы из индекса, если таблица была прочитана из файла без них"""
+        if self._matrix is not None:
+            return
+        if self._size == 0 or self.load_vectors is None:
+            self._matrix = np.empty((self._size, 0), dtype=np.float32)
+            return
+        
+        ids, vectors = self.load_vectors()
+        ids = [int(id_) for id_ in ids]
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        
+        # Списки соседей из файла сохраняются, векторы раскладываются по их строкам
+        self._matrix = np.zeros((len(self._ids), vectors.shape[1]), dtype=np.float32)
+        new_ids, new_vectors = [], []
+        for id_, vector in zip(ids, vectors):
+            row = self._rows.get(id_)
+            if row is None:
+                new_ids.append(id_)
+                new_vectors.append(vector)
+            else:
+                self._matrix[row] = vector
+        
+        # Таблица могла отстать от индекса: недостающие товары добавляем, лишние удаляем
+        if new_ids:
+            self._append(new_ids, np.array(new_vectors))
+            self._pending.update(new_ids)
+        self.remove(set(self._rows) - set(ids))
+    
+    def _grow(self, size: int, dim: int) -> None:
+        capacity = len(self._ids)
+        if self._matrix is None or self._matrix.shape[1] != dim:
+            self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+        if size <= capacity:
+            return
+        
+        capacity = max(size, capacity * 2, 64)
+        
+        def grow(array: np.ndarray, fill) -> np.ndarray:
+            grown = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+            grown[:self._size] = array[:self._size]
+            return grown
+        
+        self._ids = grow(self._ids, -1)
+        self._matrix = grow(self._matrix, 0)
+        self._neighbours = grow(self._neighbours, -1)
+        self._scores = grow(self._scores, -np.inf)
+    
+    def _append(self, ids: List[int], vectors: np.ndarray) -> None:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(ids):
+            return
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        self._grow(self._size + len(ids), vectors.shape[1])
+        
+        for id_, vector in zip(ids, vectors):
+            row = self._rows.get(id_)
+            if row is None:
+                row = self._size
+                self._rows[id_] = row
+                self._ids[row] = id_
+                self._neighbours[row] = -1
+                self._scores[row] = -np.inf
+                self._size += 1
+            self._matrix[row] = vector
+    
+    def update(self, ids: Iterable[str], embeddings) -> None:
+        """Добавить или обновить векторы товаров"""
+        ids = [int(id_) for id_ in ids]
+        with self._lock:
+            self._ensure_vectors()
+            self._append(ids, np.atleast_2d(np.asarray(embeddings, dtype=np.float32)))
+            self._pending.update(ids)
+            self._removed.difference_update(ids)
+    
+    def remove(self, ids: Iterable[str]) -> None:
+        """Удалить товары"""
+        with self._lock:
+            self._ensure_vectors()
+            for id_ in (int(id_) for id_ in ids):
+                row = self._rows.pop(id_, None)
+                if row is None:
+                    continue
+                
+                last = self._size - 1
+                if row != last:
+                    for array in (self._ids, self._matrix, self._neighbours, self._scores):
+                        array[row] = array[last]
+                    self._rows[int(self._ids[row])] = row
+                self._size -= 1
+                self._pending.discard(id_)
+                self._removed.add(id_)
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._reset()
+            self._matrix = np.empty((0, 0), dtype=np.float32)
+            self._dirty = True
+    
+    def _top_k(self, scores: np.ndarray, candidates: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Лучшие k кандидатов каждой строки по убыванию близости"""
+        k = min(self.k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        
+        ids = np.broadcast_to(candidates, scores.shape) if candidates.ndim == 1 else candidates
+        top_ids = np.take_along_axis(ids, top, axis=1)
+        top_ids = np.where(np.isfinite(top_scores), top_ids, -1)
+        
+        result_ids = np.full((len(scores), self.k), -1, dtype=np.int64)
+        result_scores = np.full((len(scores), self.k), -np.inf, dtype=np.float32)
+        result_ids[:, :k] = top_ids
+        result_scores[:, :k] = top_scores
+        return result_ids, result_scores
+    
+    def _recompute_rows(self, rows: np.ndarray) -> None:
+        """Полностью пересчитать соседей для строк"""
+        size = self._size
+        matrix = self._matrix[:size]
+        for start in range(0, len(rows), self.BLOCK):
+            block = rows[start:start + self.BLOCK]
+            scores = matrix[block] @ matrix.T
+            scores[np.arange(len(block)), block] = -np.inf
+            self._neighbours[block], self._scores[block] = self._top_k(scores, self._ids[:size])
+    
+    def _recompute(self) -> None:
+        """Применить накопленные изменения"""
+        if not self._pending and not self._removed:
+            return
+        self._ensure_vectors()
+        
+        size = self._size
+        pending_rows = np.array(sorted(self._rows[id_] for id_ in self._pending), dtype=np.int64)
+        
+        if size < 2:
+            self._neighbours[:size] = -1
+            self._scores[:size] = -np.inf
+        elif len(pending_rows) * 2 > size:
+            self._recompute_rows(np.arange(size))
+        else:
+            matrix = self._matrix[:size]
+            neighbours = self._neighbours[:size]
+            scores = self._scores[:size]
+            
+            # Записи об изменённых и удалённых товарах больше не актуальны
+            changed = np.fromiter(self._pending | self._removed, dtype=np.int64)
+            stale = np.isin(neighbours, changed)
+            neighbours[stale] = -1
+            scores[stale] = -np.inf
+            lost = np.flatnonzero(stale.any(axis=1))
+            
+            # Изменённые товары становятся кандидатами для всех остальных строк
+            for start in range(0, len(pending_rows), self.BLOCK):
+                block = pending_rows[start:start + self.BLOCK]
+                candidate_scores = matrix @ matrix[block].T
+                candidate_scores[block, np.arange(len(block))] = -np.inf
+                merged_ids, merged_scores = self._top_k(
+                    np.concatenate([scores, candidate_scores], axis=1),
+                    np.concatenate([neighbours, np.broadcast_to(self._ids[block], (size, len(block)))], axis=1),
+                )
+                neighbours[:], scores[:] = merged_ids, merged_scores
+            
+            # Строки изменённых товаров и строки, потерявшие соседей или
+            # ещё не заполненные до k, — целиком
+            short = np.flatnonzero((neighbours >= 0).sum(axis=1) < min(self.k, size - 1))
+            self._recompute_rows(np.union1d(np.union1d(pending_rows, lost), short))
+        
+        self._pending.clear()
+        self._removed.clear()
+        self._dirty = True
+    
+    def build(self, ids: List[str], vectors: np.ndarray) -> None:
+        """Построить таблицу заново по всем векторам"""
+        with self._lock:
+            self._reset()
+            self._matrix = np.empty((0, 0), dtype=np.float32)
+            self._append([int(id_) for id_ in ids], vectors)
+            self._pending = set(self._rows)
+            self._recompute()
+    
+    def neighbours(self, product_id: int) -> Optional[List[Tuple[int, float]]]:
+        """Похожие товары [(id, близость)] по убыванию (None — товара нет в таблице)"""
+        with self._lock:
+            self._recompute()
+            row = self._rows.get(int(product_id))
+            if row is None:
+                return None
+            return [
+                (int(id_), float(score))
+                for id_, score in zip(self._neighbours[row], self._scores[row])
+                if id_ >= 0
+            ]
+    
+    def ids(self) -> set:
+        with self._lock:
+            return set(self._rows)
+    
+    def flush(self) -> None:
+        """Применить изменения и сохранить таблицу в файл"""
+        with self._lock:
+            self._recompute()
+            if self.path is None or not self._dirty:
+                return
+            
+            size = self._size
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            with open(tmp_path, "wb") as f:
+                np.savez(
+                    f,
+                    ids=self._ids[:size],
+                    neighbours=self._neighbours[:size],
+                    scores=self._scores[:size],
+                )
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        
+        logger.info(f"Таблица соседей сохранена: {self.path} ({size} товаров, k={self.k})")
+    
+    def export(self) -> Dict[str, np.ndarray]:
+        """Таблица с применёнными изменениями в виде массивов (для снимка индекса)"""
+        with self._lock:
+            self._recompute()
+            size = self._size
+            return {
+                "ids": self._ids[:size],
+                "neighbours": self._neighbours[:size],
+                "scores": self._scores[:size],
+            }
+    
+    def load(self) -> bool:
+        """Прочитать таблицу из файла (векторы не загружаются)"""
+        with self._lock:
+            self._reset()
+            if self.path is None or not self.path.exists():
+                return False
+            
+            with np.load(self.path) as data:
+                arrays = {name: data[name] for name in ("ids", "neighbours", "scores")}
+            return self.load_arrays(arrays)
+    
+    def load_arrays(self, arrays: Dict[str, np.ndarray]) -> bool:
+        """
+        Загрузить таблицу из массивов export() (например, из снимка индекса)
+        
+        Массивы не копируются: таблица изменяет их только при обновлении
+        товаров, а массивы снимка отображены в режиме копирования при записи.
+        """
+        with self._lock:
+            self._reset()
+            if arrays["neighbours"].shape[1] != self.k:
+                logger.info("Размер таблицы соседей изменился, она будет перестроена")
+                return False
+            
+            self._ids = arrays["ids"]
+            self._neighbours = arrays["neighbours"]
+            self._scores = arrays["scores"]
+            self._size = len(self._ids)
+            self._rows = {int(id_): row for row, id_ in enumerate(self._ids.tolist())}
+            return True
+    
+    def __len__(self) -> int:
+        return self._size
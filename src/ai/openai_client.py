@@ -0,0 +1,69 @@
+"""
+Общий для процесса клиент OpenAI с пулом соединений
+"""
+import threading
+import importlib.util
+from typing import Optional
+
+import httpx
+from loguru import logger
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+from src.config import get_settings
+
+settings = get_settings()
+
+_client: Optional[AsyncOpenAI] = None
+_client_lock = threading.Lock()
+
+
+def _http2_available() -> bool:
+    """HTTP/2 в httpx работает только с установленным пакетом h2"""
+    return importlib.util.find_spec("h2") is not None
+
+
+def get_openai_client() -> AsyncOpenAI:
+    """
+    Общий клиент OpenAI
+    
+    Соединения с API остаются открытыми между сообщениями (keep-alive),
+    поэтому запросы не тратят время на новые TCP- и TLS-рукопожатия.
+    По HTTP/2 запросы к модели идут по одному соединению параллельно.
+    """
+    global _client
+    
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                http2 = settings.openai_http2 and _http2_available()
+                http_client = DefaultAsyncHttpxClient(
+                    http2=http2,
+                    timeout=httpx.Timeout(settings.openai_timeout, connect=settings.openai_connect_timeout),
+                    limits=httpx.Limits(
+                        max_connections=settings.openai_max_connections,
+                        max_keepalive_connections=settings.openai_max_keepalive,
+                        keepalive_expiry=settings.openai_keepalive_expiry,
+                    ),
+                )
+                _client = AsyncOpenAI(
+                    api_key=settings.openai_api_key,
+                    base_url=settings.openai_base_url or None,
+                    max_retries=settings.openai_max_retries,
+                    http_client=http_client,
+                )
+                logger.info(
+                    f"Клиент OpenAI: {_client.base_url}, HTTP/{'2' if http2 else '1.1'}, "
+                    f"соединений до {settings.openai_max_connections}"
+                )
+    
+    return _client
+
+
+async def close_openai_client() -> None:
+    """Закрыть соединения общего клиента при остановке приложения"""
+    global _client
+    
+    with _client_lock:
+        client, _client = _client, None
+    if client is not None:
+        await client.close()
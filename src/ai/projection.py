@@ -0,0 +1,91 @@
+"""
+Компактное представление товаров в результатах функций для модели
+"""
+from typing import Any, Dict, List, Optional
+
+from src.utils.helpers import truncate_text
+
+# Уровни детализации: длина описания, число характеристик и особенностей (None — без ограничения)
+DETAIL_LIMITS = {
+    # Списки товаров: поиск, рекомендации, комплекты
+    "brief": {"description": 160, "specs": 6, "features": 0},
+    # get_product_details по умолчанию
+    "standard": {"description": 800, "specs": 20, "features": 8},
+    # get_product_details с detail="full"
+    "full": {"description": None, "specs": None, "features": None},
+}
+
+# Длина значения характеристики и текста особенности
+VALUE_LIMIT = 80
+
+# Характеристики, которые показываются первыми (по вхождению в название)
+KEY_SPECS = (
+    "тип", "объем", "объём", "ширина", "высота", "глубина", "мощность",
+    "класс", "конфор", "загрузк", "отжим", "инвертор", "no frost",
+    "шум", "установк", "управлени", "цвет",
+)
+
+
+def _key_specs(specifications: Dict[str, Any], limit: Optional[int]) -> Dict[str, str]:
+    """Главные характеристики: сначала из KEY_SPECS, затем остальные по порядку"""
+    items = list(specifications.items())
+    if limit is not None:
+        items.sort(key=lambda item: not any(word in str(item[0]).lower() for word in KEY_SPECS))
+        items = items[:limit]
+    return {
+        str(name): truncate_text(str(value), VALUE_LIMIT, "…")
+        for name, value in items
+        if value not in (None, "")
+    }
+
+
+def _features(features: Any, limit: Optional[int]) -> List[str]:
+    if isinstance(features, dict):
+        features = [f"{name}: {value}" for name, value in features.items()]
+    features = [str(feature) for feature in features or [] if feature]
+    if limit is not None:
+        features = features[:limit]
+    return [truncate_text(feature, VALUE_LIMIT, "…") for feature in features]
+
+
+def compact_product(product: Dict[str, Any], detail: str = "brief") -> Dict[str, Any]:
+    """
+    Товар из Product.to_dict() в компактном виде
+    
+    Короткие ключи, обрезанное описание и главные характеристики; пустые
+    поля не выводятся. detail — уровень детализации из DETAIL_LIMITS.
+    """
+    limits = DETAIL_LIMITS.get(detail, DETAIL_LIMITS["brief"])
+    
+    if detail == "brief":
+        description = product.get("short_description") or product.get("description")
+    else:
+        description = product.get("description") or product.get("short_description")
+    if description and limits["description"] is not None:
+        description = truncate_text(description, limits["description"], "…")
+    
+    price = product.get("price")
+    old_price = product.get("old_price")
+    
+    compact = {
+        "id": product.get("id"),
+        "name": product.get("name"),
+        "brand": product.get("brand"),
+        "model": product.get("model"),
+        "art": product.get("article") if detail != "brief" else None,
+        "price": price,
+        # Старая цена нужна только при скидке
+        "old": old_price if old_price and price and old_price > price else None,
+        "stock": bool(product.get("in_stock")),
+        "cat": product.get("category"),
+        "url": product.get("url"),
+        "desc": description,
+        "specs": _key_specs(product.get("specifications") or {}, limits["specs"]),
+        "feat": _features(product.get("features"), limits["features"]) if limits["features"] != 0 else None,
+    }
+    return {key: value for key, value in compact.items() if value not in (None, "", [], {})}
+
+
+def compact_products(products: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Список товаров в кратком виде"""
+    return [compact_product(product) for product in products]
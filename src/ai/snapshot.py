@@ -0,0 +1,86 @@
+"""
+Снимок векторного индекса: один файл, открываемый через отображение в память
+
+Формат: сигнатура, длина заголовка (8 байт, little-endian), заголовок JSON
+с описанием массивов (тип, форма, смещение) и произвольными метаданными,
+затем сами массивы, выровненные по 64 байта. Массивы открываются без
+чтения файла целиком: страницы подгружаются операционной системой по мере
+обращения и разделяются между процессами через page cache.
+"""
+import os
+import json
+import struct
+from pathlib import Path
+from typing import Any, Dict, Tuple
+
+import numpy as np
+
+MAGIC = b"TPSNAP1\n"
+ALIGNMENT = 64
+
+
+def _aligned(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_snapshot(path: Path, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]) -> int:
+    """
+    Записать массивы и метаданные в файл снимка (атомарно, через временный файл)
+    
+    Returns:
+        Размер файла в байтах
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    
+    # Смещения считаются от начала области данных, чтобы не зависеть от длины заголовка
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = _aligned(offset)
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += array.nbytes
+    
+    header = json.dumps({"arrays": layout, "meta": meta}, ensure_ascii=False).encode("utf-8")
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+    
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+        size = f.tell()
+    os.replace(tmp_path, path)
+    return size
+
+
+def read_snapshot(path: Path) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """
+    Открыть файл снимка
+    
+    Массивы отображаются в память в режиме копирования при записи: их можно
+    изменять, но изменения остаются в памяти процесса и не попадают в файл.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Файл не является снимком индекса: {path}")
+        header_length = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_length).decode("utf-8"))
+    
+    data_start = _aligned(len(MAGIC) + 8 + header_length)
+    mapped = np.memmap(path, dtype=np.uint8, mode="c")
+    
+    arrays = {}
+    for name, item in header["arrays"].items():
+        dtype = np.dtype(item["dtype"])
+        shape = tuple(item["shape"])
+        if not np.prod(shape, dtype=np.int64):
+            arrays[name] = np.empty(shape, dtype=dtype)
+            continue
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=mapped, offset=data_start + item["offset"])
+    
+    return arrays, header["meta"]
@@ -0,0 +1,186 @@
+"""
+Кэш результатов функций агента (поиск, категории, карточки товаров)
+"""
+import re
+import json
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from loguru import logger
+
+from src.config import get_settings
+
+settings = get_settings()
+
+# Аргументы со свободным текстом: регистр и лишние пробелы на результат не влияют
+TEXT_ARGUMENTS = ("query", "purpose", "preferences")
+
+
+class ToolResultCache:
+    """
+    Результаты функций по ключу (имя функции, аргументы)
+    
+    Аргументы приводятся к каноническому виду: значения по умолчанию
+    подставлены, пустые отброшены, текст нормализован, поэтому
+    {"query": "Холодильник  Samsung"} и {"query": "холодильник samsung",
+    "in_stock_only": true} дают один ключ. Кэш ограничен по размеру (LRU)
+    и времени жизни записей и сбрасывается при смене версии каталога.
+    
+    Одинаковые вызовы, пришедшие одновременно, выполняются один раз:
+    остальные ждут результат первого (single-flight). Если первый вызов
+    завершился ошибкой, остальные выполняют функцию сами.
+    """
+    
+    def __init__(self, max_size: int = 2048, ttl: float = 600):
+        """
+        Args:
+            max_size: Максимальное количество результатов
+            ttl: Время жизни результата в секундах (0 — без ограничения)
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version: Optional[str] = None
+        
+        # ключ -> (результат, время записи)
+        self._items: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+    
+    @staticmethod
+    def key(name: str, arguments: Dict[str, Any], defaults: Optional[Dict[str, Any]] = None) -> str:
+        """Ключ вызова функции с аргументами в каноническом виде"""
+        canonical = dict(defaults or {})
+        for argument, value in arguments.items():
+            if value is None or value == "":
+                continue
+            if isinstance(value, str):
+                value = re.sub(r"\s+", " ", value).strip()
+                if argument in TEXT_ARGUMENTS:
+                    value = value.lower().replace("ё", "е")
+            elif isinstance(value, float) and value.is_integer():
+                value = int(value)
+            canonical[argument] = value
+        return f"{name}:{json.dumps(canonical, ensure_ascii=False, sort_keys=True, separators=(',', ':'))}"
+    
+    def _get(self, key: str, version: str) -> Optional[str]:
+        with self._lock:
+            if version != self.version:
+                self._items.clear()
+                self.version = version
+            
+            entry = self._items.get(key)
+            if entry is None:
+                return None
+            if self.ttl and time.time() - entry[1] > self.ttl:
+                del self._items[key]
+                return None
+            
+            self._items.move_to_end(key)
+            return entry[0]
+    
+    def _put(self, key: str, version: str, result: str) -> None:
+        with self._lock:
+            if version != self.version:
+                return
+            self._items[key] = (result, time.time())
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+    
+    async def get_or_compute(
+        self,
+        key: str,
+        version: str,
+        compute: Callable[[], Awaitable[str]],
+    ) -> str:
+        """
+        Результат из кэша или вычисленный compute()
+        
+        Args:
+            key: Ключ вызова (см. key())
+            version: Текущая версия каталога
+            compute: Корутина, выполняющая функцию
+        """
+        result = self._get(key, version)
+        if result is not None:
+            self.hits += 1
+            return result
+        
+        future = self._inflight.get(key)
+        if future is not None:
+            self.shared += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Отменили сам ожидающий вызов, а не первый
+                if not future.cancelled():
+                    raise
+            except Exception:
+                pass
+            return await compute()
+        
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await compute()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # Ошибку получат ожидающие вызовы; если их нет, она не должна попасть в лог asyncio
+                future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        
+        future.set_result(result)
+        self._put(key, version, result)
+        return result
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Размер кэша, попадания и объединённые одновременные вызовы"""
+        lookups = self.hits + self.misses + self.shared
+        return {
+            "size": len(self._items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared": self.shared,
+            "hit_rate": round((self.hits + self.shared) / lookups, 4) if lookups else 0.0,
+        }
+
+
+# Общий кэш результатов функций на процесс
+_tool_cache: Optional[ToolResultCache] = None
+_tool_cache_lock = threading.Lock()
+
+
+def get_tool_cache() -> Optional[ToolResultCache]:
+    """Общий для процесса кэш результатов функций (None, если отключён: TOOL_CACHE_SIZE=0)"""
+    global _tool_cache
+    
+    if settings.tool_cache_size <= 0:
+        return None
+    
+    if _tool_cache is None:
+        with _tool_cache_lock:
+            if _tool_cache is None:
+                _tool_cache = ToolResultCache(
+                    max_size=settings.tool_cache_size,
+                    ttl=settings.tool_cache_ttl,
+                )
+                logger.info(f"Кэш результатов функций: {settings.tool_cache_size} записей, TTL {settings.tool_cache_ttl} с")
+    
+    return _tool_cache
@@ -2,48 +2,228 @@
 Векторное хранилище для поиска товаров
 """
 import os
-from typing import List, Optional, Dict, Any
+import sys
+import time
+import hashlib
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import List, Optional, Dict, Any, Iterable, Iterator
 from pathlib import Path
+import numpy as np
 from loguru import logger
 
-import chromadb
-from chromadb.config import Settings as ChromaSettings
-from sentence_transformers import SentenceTransformer
-
 from src.config import get_settings
 from src.database.models import Product
+from src.ai.embeddings import QueryEmbeddingCache, DocumentEmbeddingCache, EmbeddingBatcher
+from src.ai.indexes import NumpyIndex, create_index
+from src.ai.embedders import EMBEDDING_MODEL, create_embedder, embedder_model_id
+from src.ai.facets import FacetIndex
+from src.ai.lexical import LexicalIndex, matches_filters, reciprocal_rank_fusion
+from src.ai.keys import ProductKeyIndex
+from src.ai.neighbours import NeighbourTable
 
 settings = get_settings()
 
 
+def _attachment_group(attachments: Dict[str, np.ndarray], group: str) -> Dict[str, np.ndarray]:
+    """Массивы одной группы из снимка индекса ("lexical.ids" -> "ids")"""
+    prefix = group + "."
+    return {
+        name[len(prefix):]: array
+        for name, array in attachments.items()
+        if name.startswith(prefix)
+    }
+
+
+def _chunked(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """Разбить последовательность на порции не больше size элементов"""
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def peak_memory_mb() -> Optional[float]:
+    """Пиковое потребление памяти процессом в МБ (None, если недоступно)"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # На macOS значение в байтах, на Linux — в килобайтах
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
 class ProductVectorStore:
-    """Векторное хранилище товаров для семантического поиска"""
+    """
+    Векторное хранилище товаров для семантического поиска
+    
+    Создание экземпляра дорогое (загрузка модели и открытие индекса),
+    поэтому в приложении используется общий экземпляр — см. get_vector_store().
+    
+    Сами векторы хранятся в индексе, выбранном настройкой VECTOR_BACKEND:
+    ChromaDB (по умолчанию) или точный NumPy-индекс в памяти.
+    """
+    
+    # Файл с версией каталога: меняется при каждом flush(), по нему другие
+    # процессы (бот, API) узнают, что индекс нужно перечитать
+    CATALOG_VERSION_FILE = "catalog_version"
     
     def __init__(self):
+        started = time.perf_counter()
+        
+        # Защищает запись в индекс и его пересоздание при параллельном доступе
+        self._lock = threading.RLock()
+        
+        # Пул для асинхронного API: кодирование и поиск по индексу
+        # выполняются вне event loop, очередь ожидающих задач ограничена
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.vector_workers,
+            thread_name_prefix="vector-store",
+        )
+        self._slots = asyncio.Semaphore(settings.vector_workers + settings.vector_queue_size)
+        
         self.chroma_path = Path(settings.chroma_db_path)
         self.chroma_path.mkdir(parents=True, exist_ok=True)
         
-        # Инициализация ChromaDB
-        self.client = chromadb.PersistentClient(
-            path=str(self.chroma_path),
-            settings=ChromaSettings(
-                anonymized_telemetry=False,
-                allow_reset=True,
-            )
+        self.index = create_index(
+            settings.vector_backend,
+            chroma_path=self.chroma_path,
+            numpy_path=Path(settings.numpy_index_path),
+            vector_dtype=settings.vector_dtype,
+            snapshot_path=Path(settings.snapshot_path),
+            partition_by=settings.vector_partition_by,
+        )
+        
+        self._version_path = self.chroma_path / self.CATALOG_VERSION_FILE
+        self.catalog_version = self._read_catalog_version()
+        self._version_checked_at = time.monotonic()
+        
+        # Индексы в памяти, обновляются вместе с векторным индексом:
+        # категории и бренды, лексический поиск BM25, точные артикулы и модели,
+        # похожие товары для рекомендаций
+        self.facets = FacetIndex()
+        self.lexical = LexicalIndex()
+        self.keys = ProductKeyIndex()
+        self.neighbours = NeighbourTable(
+            Path(settings.neighbours_path),
+            k=settings.neighbours_k,
+            load_vectors=self.index.get_embeddings,
         )
+        self.neighbours.load()
+        self._rebuild_catalog_indexes()
+        
+        self.exact_hits = 0
+        self.hybrid_queries = 0
         
-        # Коллекция для товаров
-        self.collection = self.client.get_or_create_collection(
-            name="products",
-            metadata={"hnsw:space": "cosine"}
+        # Модель загружается при первом кодировании или в warm_up(): процессам,
+        # которым хватает кэша эмбеддингов, она может не понадобиться вовсе
+        self._embedder = None
+        self._embedder_lock = threading.Lock()
+        self._warmup_lock = threading.Lock()
+        self.ready = False
+        
+        # Векторы разных бэкендов (torch, onnx, onnx-int8) несовместимы:
+        # дисковые кэши эмбеддингов разделены по идентификатору модели
+        model_id = embedder_model_id(
+            settings.embedding_backend,
+            model_name=EMBEDDING_MODEL,
+            onnx_path=Path(settings.onnx_model_path),
         )
         
-        # Модель для эмбеддингов (многоязычная, хорошо работает с русским)
-        self.embedder = SentenceTransformer(
-            "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+        # Повторяющиеся запросы не прогоняются через модель повторно
+        self.query_cache = QueryEmbeddingCache(
+            max_size=settings.query_cache_size,
+            ttl=settings.query_cache_ttl,
+            path=settings.query_cache_path or None,
+            namespace=model_id,
         )
         
-        logger.info(f"Векторное хранилище инициализировано: {self.chroma_path}")
+        # Эмбеддинги текстов товаров переживают переиндексацию и очистку индекса.
+        # Файл кэша читается при первом кодировании товаров, а не здесь
+        self.document_cache: Optional[DocumentEmbeddingCache] = None
+        if settings.embedding_cache_path and settings.embedding_cache_size > 0:
+            self.document_cache = DocumentEmbeddingCache(
+                settings.embedding_cache_path,
+                model_id=model_id,
+                max_items=settings.embedding_cache_size,
+            )
+        
+        # Одновременные запросы разных пользователей кодируются одним батчем
+        self.batcher = EmbeddingBatcher(
+            self._encode_batch,
+            window_ms=settings.embedding_batch_window_ms,
+            max_batch_size=settings.embedding_max_batch,
+        )
+        
+        # Длительность фаз запуска (с): открытие индекса здесь, остальные в warm_up()
+        self.warmup_timings: Dict[str, float] = {"open": round(time.perf_counter() - started, 3)}
+        
+        logger.info(
+            f"Векторное хранилище инициализировано: {self.chroma_path} "
+            f"(бэкенд: {settings.vector_backend}, {self.warmup_timings['open']:.2f} с)"
+        )
+    
+    @property
+    def embedder(self):
+        """Модель эмбеддингов (загружается при первом обращении)"""
+        if self._embedder is None:
+            with self._embedder_lock:
+                if self._embedder is None:
+                    self._embedder = create_embedder(
+                        settings.embedding_backend,
+                        model_name=EMBEDDING_MODEL,
+                        onnx_path=Path(settings.onnx_model_path),
+                    )
+        return self._embedder
+    
+    @embedder.setter
+    def embedder(self, embedder) -> None:
+        self._embedder = embedder
+    
+    def warm_up(self) -> Dict[str, float]:
+        """
+        Подготовить хранилище к первому запросу пользователя
+        
+        Загружает модель, выполняет пробное кодирование (первый вызов модели
+        заметно медленнее следующих) и пробный поиск по индексу. Повторные
+        вызовы ничего не делают.
+        
+        Returns:
+            Длительность фаз запуска в секундах
+        """
+        with self._warmup_lock:
+            if self.ready:
+                return self.warmup_timings
+            
+            started = time.perf_counter()
+            self.embedder
+            self._log_phase("model", started)
+            
+            started = time.perf_counter()
+            embedding = self._encode_batch(["прогрев"])
+            self._log_phase("encode", started)
+            
+            # Первый поиск поднимает в память векторный индекс коллекции
+            started = time.perf_counter()
+            if self.index.count():
+                self.index.query(embedding, 1, {})
+            self._log_phase("index", started)
+            
+            self.ready = True
+            return self.warmup_timings
+    
+    def _log_phase(self, phase: str, started: float) -> None:
+        self.warmup_timings[phase] = round(time.perf_counter() - started, 3)
+        logger.info(f"Прогрев хранилища, {phase}: {self.warmup_timings[phase]:.2f} с")
     
     def _create_product_text(self, product: Product) -> str:
         """Создать текстовое представление товара для индексации"""
@@ -67,61 +247,307 @@ class ProductVectorStore:
         
         return " | ".join(parts)
     
-    def add_product(self, product: Product) -> None:
-        """Добавить товар в векторное хранилище"""
-        text = self._create_product_text(product)
-        embedding = self.embedder.encode(text).tolist()
-        
-        metadata = {
+    @staticmethod
+    def _text_hash(text: str) -> str:
+        """Хэш текста товара: по нему определяется, нужно ли пересчитывать эмбеддинг"""
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+    
+    def _product_metadata(self, product: Product, text: str) -> Dict[str, Any]:
+        """Метаданные товара для фильтрации при поиске"""
+        return {
             "product_id": product.id,
             "name": product.name,
             "brand": product.brand or "",
             "price": product.price or 0,
             "in_stock": product.in_stock,
             "category": product.category.name if product.category else "",
+            "model": product.model or "",
+            "article": product.article or "",
+            "external_id": product.external_id or "",
+            "text_hash": self._text_hash(text),
+        }
+    
+    def add_product(self, product: Product) -> None:
+        """Добавить товар в векторное хранилище"""
+        text = self._create_product_text(product)
+        embedding = self._encode_documents([text], batch_size=1)[0].tolist()
+        
+        metadata = self._product_metadata(product, text)
+        
+        with self._lock:
+            self.neighbours.update([str(product.id)], [embedding])
+            self.index.upsert(
+                ids=[str(product.id)],
+                embeddings=[embedding],
+                documents=[text],
+                metadatas=[metadata]
+            )
+            self.facets.update([str(product.id)], [metadata])
+            self.keys.update([str(product.id)], [metadata])
+            self.lexical.update([str(product.id)], [text], [metadata])
+    
+    def _upsert_chunk(
+        self,
+        products: List[Product],
+        documents: List[str],
+        batch_size: int,
+    ) -> None:
+        """Закодировать и записать одну порцию товаров"""
+        embeddings = self._encode_documents(documents, batch_size)
+        
+        ids = [str(product.id) for product in products]
+        metadatas = [
+            self._product_metadata(product, text)
+            for product, text in zip(products, documents)
+        ]
+        
+        with self._lock:
+            self.index.upsert(
+                ids=ids,
+                embeddings=embeddings,
+                documents=documents,
+                metadatas=metadatas
+            )
+            self.facets.update(ids, metadatas)
+            self.neighbours.update(ids, embeddings)
+            self.keys.update(ids, metadatas)
+            self.lexical.update(ids, documents, metadatas)
+    
+    def add_products(
+        self,
+        products: Iterable[Product],
+        batch_size: Optional[int] = None,
+        chunk_size: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Добавить несколько товаров
+        
+        Товары обрабатываются потоково: тексты кодируются батчами по batch_size,
+        а в коллекцию записываются порциями по chunk_size. Так потребление
+        памяти не зависит от размера каталога.
+        
+        Args:
+            products: Товары (список или любой итерируемый объект)
+            batch_size: Размер батча для модели эмбеддингов
+            chunk_size: Размер порции для записи в индекс
+        
+        Returns:
+            Статистика загрузки: количество товаров, время, скорость и пиковая память
+        """
+        batch_size = batch_size or settings.embedding_batch_size
+        chunk_size = chunk_size or settings.vector_upsert_chunk_size
+        # Индекс может ограничивать размер одной операции записи
+        chunk_size = min(chunk_size, self.index.max_batch_size)
+        
+        started = time.perf_counter()
+        total = 0
+        
+        for chunk in _chunked(products, chunk_size):
+            documents = [self._create_product_text(product) for product in chunk]
+            self._upsert_chunk(chunk, documents, batch_size)
+            
+            total += len(chunk)
+            logger.debug(f"Проиндексировано товаров: {total}")
+        
+        elapsed = time.perf_counter() - started
+        stats = {
+            "products": total,
+            "seconds": round(elapsed, 3),
+            "products_per_second": round(total / elapsed, 1) if elapsed > 0 else 0.0,
+            "peak_memory_mb": peak_memory_mb(),
         }
         
-        self.collection.upsert(
-            ids=[str(product.id)],
-            embeddings=[embedding],
-            documents=[text],
-            metadatas=[metadata]
+        if total:
+            logger.info(
+                f"Добавлено товаров в векторное хранилище: {total} "
+                f"({stats['products_per_second']} товаров/с)"
+            )
+        
+        return stats
+    
+    def export_snapshot(self, path: Optional[Path] = None) -> Dict[str, Any]:
+        """
+        Сохранить векторы, тексты и метаданные товаров в файл снимка
+        
+        Снимок открывается бэкендом VECTOR_BACKEND=snapshot через отображение
+        в память. Векторы хранятся в типе VECTOR_DTYPE. В снимок также входят
+        таблица соседей и лексический индекс: реплике не нужно ни токенизировать
+        каталог, ни пересчитывать соседей.
+        
+        Returns:
+            Путь, количество товаров, размер файла и время экспорта
+        """
+        path = Path(path or settings.snapshot_path)
+        started = time.perf_counter()
+        
+        with self._lock:
+            ids, embeddings = self.index.get_embeddings()
+            documents = self.index.get_documents()
+            metadatas = self.index.get_metadata()
+            # Реплика берёт готовые таблицу соседей и лексический индекс из снимка
+            attachments = {f"neighbours.{name}": array for name, array in self.neighbours.export().items()}
+            attachments.update({f"lexical.{name}": array for name, array in self.lexical.export().items()})
+        
+        snapshot = NumpyIndex(dtype=settings.vector_dtype)
+        for start in range(0, len(ids), snapshot.max_batch_size):
+            chunk = ids[start:start + snapshot.max_batch_size]
+            snapshot.upsert(
+                ids=chunk,
+                embeddings=embeddings[start:start + len(chunk)],
+                documents=[documents[id_] for id_ in chunk],
+                metadatas=[metadatas[id_] for id_ in chunk],
+            )
+        size = snapshot.save_snapshot(path, attachments)
+        
+        stats = {
+            "path": str(path),
+            "products": len(ids),
+            "size_mb": round(size / 1024 / 1024, 2),
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+        logger.info(
+            f"Снимок индекса сохранён: {path} ({stats['products']} товаров, "
+            f"{stats['size_mb']} МБ, {stats['seconds']} с)"
         )
+        return stats
     
-    def add_products(self, products: List[Product]) -> None:
-        """Добавить несколько товаров"""
-        if not products:
-            return
+    def get_indexed_metadata(self) -> Dict[str, Dict[str, Any]]:
+        """Метаданные всех проиндексированных товаров по их ID"""
+        return self.index.get_metadata()
+    
+    def sync_products(
+        self,
+        products: Iterable[Product],
+        indexed: Dict[str, Dict[str, Any]],
+        batch_size: Optional[int] = None,
+    ) -> Dict[str, int]:
+        """
+        Инкрементально синхронизировать товары с хранилищем
+        
+        Эмбеддинг пересчитывается только для новых товаров и товаров с
+        изменившимся текстом. Если изменились только метаданные (цена,
+        наличие и т.д.), они обновляются без кодирования.
+        
+        Args:
+            products: Порция товаров из БД
+            indexed: Результат get_indexed_metadata(). Обработанные ID из него
+                удаляются, поэтому после всех порций в нём остаются товары,
+                которых больше нет в БД (см. delete_products)
+            batch_size: Размер батча для модели эмбеддингов
         
-        ids = []
-        embeddings = []
-        documents = []
-        metadatas = []
+        Returns:
+            Количество добавленных, перекодированных, обновлённых и неизменных товаров
+        """
+        batch_size = batch_size or settings.embedding_batch_size
+        stats = {"added": 0, "reembedded": 0, "updated": 0, "unchanged": 0}
+        
+        changed_products, changed_documents = [], []
+        updated_ids, updated_metadatas = [], []
         
         for product in products:
             text = self._create_product_text(product)
-            embedding = self.embedder.encode(text).tolist()
+            metadata = self._product_metadata(product, text)
+            previous = indexed.pop(str(product.id), None)
             
-            ids.append(str(product.id))
-            embeddings.append(embedding)
-            documents.append(text)
-            metadatas.append({
-                "product_id": product.id,
-                "name": product.name,
-                "brand": product.brand or "",
-                "price": product.price or 0,
-                "in_stock": product.in_stock,
-                "category": product.category.name if product.category else "",
-            })
-        
-        self.collection.upsert(
-            ids=ids,
-            embeddings=embeddings,
-            documents=documents,
-            metadatas=metadatas
+            if previous is None or previous.get("text_hash") != metadata["text_hash"]:
+                stats["reembedded" if previous is not None else "added"] += 1
+                changed_products.append(product)
+                changed_documents.append(text)
+            elif previous != metadata:
+                stats["updated"] += 1
+                updated_ids.append(str(product.id))
+                updated_metadatas.append(metadata)
+            else:
+                stats["unchanged"] += 1
+        
+        if changed_products:
+            self._upsert_chunk(changed_products, changed_documents, batch_size)
+        
+        if updated_ids:
+            with self._lock:
+                self.index.update_metadata(ids=updated_ids, metadatas=updated_metadatas)
+                self.facets.update(updated_ids, updated_metadatas)
+                self.keys.update(updated_ids, updated_metadatas)
+                self.lexical.update_metadata(updated_ids, updated_metadatas)
+        
+        return stats
+    
+    def delete_products(self, product_ids: Iterable[Any]) -> int:
+        """Удалить товары из хранилища по ID"""
+        ids = [str(product_id) for product_id in product_ids]
+        
+        for chunk in _chunked(ids, self.index.max_batch_size):
+            with self._lock:
+                self.index.delete(ids=chunk)
+                self.facets.remove(chunk)
+                self.neighbours.remove(chunk)
+                self.keys.remove(chunk)
+                self.lexical.remove(chunk)
+        
+        if ids:
+            logger.info(f"Удалено товаров из векторного хранилища: {len(ids)}")
+        return len(ids)
+    
+    def _encode_documents(self, documents: List[str], batch_size: int) -> np.ndarray:
+        """Эмбеддинги текстов товаров: из дискового кэша, остальные — моделью"""
+        if self.document_cache is None:
+            return self.embedder.encode(
+                documents,
+                batch_size=batch_size,
+                show_progress_bar=False,
+                convert_to_numpy=True,
+            )
+        
+        embeddings = self.document_cache.get_many(documents)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            texts = [documents[i] for i in missing]
+            encoded = self.embedder.encode(
+                texts,
+                batch_size=batch_size,
+                show_progress_bar=False,
+                convert_to_numpy=True,
+            )
+            self.document_cache.put_many(texts, encoded)
+            for i, embedding in zip(missing, encoded):
+                embeddings[i] = embedding
+        
+        return np.stack(embeddings)
+    
+    def _encode_batch(self, texts: List[str]):
+        """Закодировать список текстов одним вызовом модели"""
+        return self.embedder.encode(
+            texts,
+            batch_size=len(texts),
+            show_progress_bar=False,
+            convert_to_numpy=True,
         )
+    
+    def _encode_query(self, query: str) -> List[float]:
+        """Эмбеддинг поискового запроса (через кэш и микробатчинг)"""
+        return self.query_cache.get_or_compute(query, self.batcher.encode).tolist()
+    
+    async def _aencode_query(self, query: str, persist: bool = True) -> List[float]:
+        """
+        Асинхронный эмбеддинг запроса: ожидание батча не занимает поток пула
+        
+        С дисковым уровнем кэша запросы к SQLite идут в пуле хранилища,
+        а не в event loop. persist=False — эмбеддинг кэшируется только
+        в памяти, диск не читается и не пишется.
+        """
+        disk = persist and self.query_cache.persistent
+        if disk:
+            embedding = await self._run_in_executor(self.query_cache.get, query)
+        else:
+            embedding = self.query_cache.get(query, disk=False)
         
-        logger.info(f"Добавлено товаров в векторное хранилище: {len(products)}")
+        if embedding is None:
+            embedding = await asyncio.wrap_future(self.batcher.submit(query))
+            if disk:
+                await self._run_in_executor(self.query_cache.put, query, embedding)
+            else:
+                self.query_cache.put(query, embedding, disk=False)
+        return embedding.tolist()
     
     def search(
         self, 
@@ -134,7 +560,12 @@ class ProductVectorStore:
         in_stock_only: bool = False,
     ) -> List[Dict[str, Any]]:
         """
-        Семантический поиск товаров
+        Поиск товаров
+        
+        Запрос с артикулом или моделью, которые точно встречаются в каталоге,
+        обслуживается лексическим индексом без кодирования моделью. Остальные
+        запросы ищутся гибридно: результаты векторного и BM25-поиска
+        объединяются методом reciprocal rank fusion.
         
         Args:
             query: Поисковый запрос
@@ -148,83 +579,522 @@ class ProductVectorStore:
         Returns:
             Список найденных товаров с метаданными
         """
+        filters = {
+            "min_price": min_price,
+            "max_price": max_price,
+            "category": category,
+            "brand": brand,
+            "in_stock_only": in_stock_only,
+        }
+        
+        exact = self._search_exact(query, n_results, **filters)
+        if exact is not None:
+            return exact
+        
         # Создаём эмбеддинг запроса
-        query_embedding = self.embedder.encode(query).tolist()
-        
-        # Формируем фильтры
-        where_filters = []
-        
-        if in_stock_only:
-            where_filters.append({"in_stock": True})
-        if category:
-            where_filters.append({"category": {"$eq": category}})
-        if brand:
-            where_filters.append({"brand": {"$eq": brand}})
-        if min_price is not None:
-            where_filters.append({"price": {"$gte": min_price}})
-        if max_price is not None:
-            where_filters.append({"price": {"$lte": max_price}})
-        
-        where = None
-        if len(where_filters) == 1:
-            where = where_filters[0]
-        elif len(where_filters) > 1:
-            where = {"$and": where_filters}
-        
-        # Выполняем поиск
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
+        query_embedding = self._encode_query(query)
+        
+        return self._search_by_embedding(
+            query_embedding,
             n_results=n_results,
-            where=where,
-            include=["documents", "metadatas", "distances"]
+            query=query,
+            **filters
         )
+    
+    def _lexical_hit(self, id_: str, score: float) -> Optional[Dict[str, Any]]:
+        """Результат поиска в формате индекса по данным лексического индекса"""
+        item = self.lexical.get(id_)
+        if item is None:
+            return None
+        document, metadata = item
+        return {"id": int(id_), "document": document, "metadata": metadata, "distance": None, "score": score}
+    
+    def _search_exact(
+        self,
+        query: str,
+        n_results: int = 5,
+        **filters: Any,
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Поиск по точному совпадению (None — совпадения нет)
         
-        # Форматируем результаты
-        found_products = []
-        if results["ids"] and results["ids"][0]:
-            for i, id_ in enumerate(results["ids"][0]):
-                found_products.append({
-                    "id": int(id_),
-                    "document": results["documents"][0][i] if results["documents"] else None,
-                    "metadata": results["metadatas"][0][i] if results["metadatas"] else None,
-                    "distance": results["distances"][0][i] if results["distances"] else None,
-                })
+        Сначала запрос сверяется с артикулами, моделями и внешними ID
+        товаров, затем (если включён лексический поиск) с кодами моделей
+        в тексте товаров. Если найденные товары не проходят фильтры
+        (например, нет в наличии), возвращается None: обычный поиск
+        предложит похожие товары вместо пустого ответа.
+        """
+        self.refresh()
         
-        return found_products
+        ids = self.keys.lookup(query)
+        if ids is not None:
+            hits = [self._lexical_hit(id_, 1.0) for id_ in ids]
+            hits = [
+                hit for hit in hits
+                if hit is not None and matches_filters(hit["metadata"], filters)
+            ]
+            if hits:
+                return hits[:n_results]
+        
+        if not settings.lexical_search:
+            return None
+        
+        found = self.lexical.exact_match(query, n_results, filters)
+        if found is None:
+            return None
+        
+        hits = [self._lexical_hit(id_, score) for id_, score in found]
+        hits = [hit for hit in hits if hit is not None]
+        if not hits:
+            return None
+        
+        self.exact_hits += 1
+        return hits
     
-    def get_categories(self) -> List[str]:
-        """Получить список всех категорий"""
-        results = self.collection.get(include=["metadatas"])
-        categories = set()
+    def _search_by_embedding(
+        self,
+        query_embedding: List[float],
+        n_results: int = 5,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        category: Optional[str] = None,
+        brand: Optional[str] = None,
+        in_stock_only: bool = False,
+        query: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Поиск по готовому эмбеддингу запроса (фильтры как у search)
+        
+        Если передан текст запроса, результаты объединяются с BM25-поиском.
+        """
+        filters = {
+            "min_price": min_price,
+            "max_price": max_price,
+            "category": category,
+            "brand": brand,
+            "in_stock_only": in_stock_only,
+        }
+        return self._search_by_embeddings([query_embedding], [query], n_results, filters)[0]
+    
+    def _search_by_embeddings(
+        self,
+        query_embeddings: List[List[float]],
+        queries: List[Optional[str]],
+        n_results: int,
+        filters: Dict[str, Any],
+    ) -> List[List[Dict[str, Any]]]:
+        """Поиск сразу по нескольким эмбеддингам одним запросом к индексу"""
+        self.refresh()
         
-        for metadata in results.get("metadatas", []):
-            if metadata and metadata.get("category"):
-                categories.add(metadata["category"])
+        hybrid = settings.lexical_search and any(queries)
+        # Для слияния берём кандидатов с запасом из обоих списков
+        depth = max(n_results * 4, 20) if hybrid else n_results
+        found = self.index.query(query_embeddings, depth, filters)
         
-        return sorted(list(categories))
+        return [
+            self._fuse(query, semantic, n_results, filters) if hybrid and query else semantic[:n_results]
+            for query, semantic in zip(queries, found)
+        ]
     
-    def get_brands(self) -> List[str]:
-        """Получить список всех брендов"""
-        results = self.collection.get(include=["metadatas"])
-        brands = set()
+    def _fuse(
+        self,
+        query: str,
+        semantic: List[Dict[str, Any]],
+        n_results: int,
+        filters: Dict[str, Any],
+    ) -> List[Dict[str, Any]]:
+        """Объединить векторные и BM25-результаты методом RRF"""
+        lexical = self.lexical.search(query, max(n_results * 4, 20), filters)
+        self.hybrid_queries += 1
+        
+        hits = {str(hit["id"]): hit for hit in semantic}
+        fused = reciprocal_rank_fusion(
+            [list(hits), [id_ for id_, _ in lexical]],
+            k=settings.rrf_k,
+        )
+        
+        results = []
+        for id_, score in fused:
+            hit = {**hits[id_], "score": score} if id_ in hits else self._lexical_hit(id_, score)
+            if hit is not None:
+                results.append(hit)
+            if len(results) >= n_results:
+                break
+        return results
+    
+    def search_many(
+        self,
+        queries: List[str],
+        n_results: int = 5,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        category: Optional[str] = None,
+        brand: Optional[str] = None,
+        in_stock_only: bool = False,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Поиск по нескольким запросам с общими фильтрами
+        
+        Запросы без точного совпадения кодируются одним батчем и ищутся
+        одним обращением к индексу.
+        
+        Returns:
+            Результаты для каждого запроса в том же порядке
+        """
+        filters = {
+            "min_price": min_price,
+            "max_price": max_price,
+            "category": category,
+            "brand": brand,
+            "in_stock_only": in_stock_only,
+        }
+        
+        results = [self._search_exact(query, n_results, **filters) for query in queries]
+        pending = [i for i, found in enumerate(results) if found is None]
+        
+        if pending:
+            pending_queries = [queries[i] for i in pending]
+            found = self._search_by_embeddings(
+                self._encode_queries(pending_queries),
+                pending_queries,
+                n_results,
+                filters,
+            )
+            for i, hits in zip(pending, found):
+                results[i] = hits
+        
+        return results
+    
+    def _encode_queries(self, queries: List[str]) -> List[List[float]]:
+        """Эмбеддинги нескольких запросов: промахи кэша кодируются одним батчем"""
+        embeddings = {}
+        missing = []
+        for query in dict.fromkeys(queries):
+            cached = self.query_cache.get(query)
+            if cached is None:
+                missing.append(query)
+            else:
+                embeddings[query] = cached
+        
+        if missing:
+            for query, embedding in zip(missing, self._encode_batch(missing)):
+                self.query_cache.put(query, embedding)
+                embeddings[query] = embedding
+        
+        return [list(map(float, embeddings[query])) for query in queries]
+    
+    def get_similar(
+        self,
+        product_id: int,
+        count: int = 3,
+        in_stock_only: bool = True,
+    ) -> List[Dict[str, Any]]:
+        """
+        Похожие товары из предрассчитанной таблицы соседей
+        
+        Модель не вызывается: соседи товара рассчитаны заранее по его
+        сохранённому вектору. Если среди них мало подходящих (например,
+        большинство соседей не в наличии), недостающие товары ищутся в
+        индексе по тому же вектору с фильтром.
+        """
+        self.refresh()
         
-        for metadata in results.get("metadatas", []):
-            if metadata and metadata.get("brand"):
-                brands.add(metadata["brand"])
+        results = []
+        for id_, score in self.neighbours.neighbours(product_id) or []:
+            hit = self._lexical_hit(str(id_), score)
+            if hit is None or (in_stock_only and not hit["metadata"].get("in_stock")):
+                continue
+            hit["distance"] = 1.0 - score
+            results.append(hit)
+            if len(results) >= count:
+                return results
         
-        return sorted(list(brands))
+        embedding = self.index.get_embedding(str(product_id))
+        if embedding is None:
+            return results
+        
+        # Все товары за пределами таблицы дальше найденных в ней, поэтому
+        # результаты индекса просто дополняют список
+        seen = {int(product_id)} | {hit["id"] for hit in results}
+        filters = {"in_stock_only": in_stock_only}
+        for hit in self.index.query(embedding, count + len(seen), filters)[0]:
+            if hit["id"] in seen:
+                continue
+            hit["score"] = 1.0 - hit["distance"] if hit["distance"] is not None else None
+            results.append(hit)
+            if len(results) >= count:
+                break
+        
+        return results
+    
+    async def _run_in_executor(self, func, *args, **kwargs) -> Any:
+        """Выполнить блокирующую операцию в пуле хранилища"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            functools.partial(func, *args, **kwargs)
+        )
+    
+    # Асинхронные методы занимают место в ограниченной очереди: если она
+    # заполнена, корутина ждёт, а не ставит в пул неограниченно много задач
+    
+    async def asearch(self, query: str, n_results: int = 5, **filters: Any) -> List[Dict[str, Any]]:
+        """Асинхронный семантический поиск (параметры как у search)"""
+        async with self._slots:
+            exact = await self._run_in_executor(self._search_exact, query, n_results, **filters)
+            if exact is not None:
+                return exact
+            
+            query_embedding = await self._aencode_query(query)
+            return await self._run_in_executor(
+                self._search_by_embedding,
+                query_embedding,
+                n_results=n_results,
+                query=query,
+                **filters
+            )
+    
+    async def aembed_query(self, query: str) -> List[float]:
+        """
+        Эмбеддинг произвольного текста (через кэш и микробатчинг, как при поиске)
+        
+        Текст может быть сообщением клиента, поэтому он кэшируется только
+        в памяти и не попадает в дисковый кэш запросов.
+        """
+        return await self._aencode_query(query, persist=False)
+    
+    async def aget_categories(self) -> List[str]:
+        """Асинхронно получить список категорий (проверка обновления — в пуле хранилища)"""
+        return await self._run_in_executor(self.get_categories)
+    
+    async def aget_category_facets(self) -> List[Dict[str, Any]]:
+        """Асинхронно получить категории с количеством товаров и диапазоном цен"""
+        return await self._run_in_executor(self.get_category_facets)
+    
+    async def acatalog_version(self) -> str:
+        """Текущая версия каталога (проверка обновления — в пуле хранилища)"""
+        await self._run_in_executor(self.refresh)
+        return self.catalog_version
+    
+    async def asearch_many(
+        self,
+        queries: List[str],
+        n_results: int = 5,
+        **filters: Any,
+    ) -> List[List[Dict[str, Any]]]:
+        """Асинхронный поиск по нескольким запросам (параметры как у search_many)"""
+        async with self._slots:
+            return await self._run_in_executor(self.search_many, queries, n_results, **filters)
+    
+    async def aget_similar(self, product_id: int, count: int = 3, in_stock_only: bool = True) -> List[Dict[str, Any]]:
+        """Асинхронно получить похожие товары (параметры как у get_similar)"""
+        async with self._slots:
+            return await self._run_in_executor(self.get_similar, product_id, count, in_stock_only)
+    
+    async def aadd_product(self, product: Product) -> None:
+        """Асинхронно добавить товар в векторное хранилище"""
+        async with self._slots:
+            await self._run_in_executor(self.add_product, product)
+    
+    async def aadd_products(self, products: Iterable[Product], **kwargs: Any) -> Dict[str, Any]:
+        """Асинхронно добавить несколько товаров (параметры как у add_products)"""
+        async with self._slots:
+            return await self._run_in_executor(self.add_products, products, **kwargs)
+    
+    def close(self) -> None:
+        """Остановить пул фоновых задач и батчер хранилища"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.batcher.close()
+        if self.document_cache is not None:
+            self.document_cache.flush()
+    
+    def get_categories(self) -> List[str]:
+        """Получить список всех категорий"""
+        self.refresh()
+        return self.facets.names("category")
+    
+    def get_brands(self) -> List[str]:
+        """Получить список всех брендов"""
+        self.refresh()
+        return self.facets.names("brand")
+    
+    def get_category_facets(self) -> List[Dict[str, Any]]:
+        """Категории с количеством товаров (всего и в наличии) и диапазоном цен"""
+        self.refresh()
+        return self.facets.facets("category")
+    
+    def get_brand_facets(self) -> List[Dict[str, Any]]:
+        """Бренды с количеством товаров (всего и в наличии) и диапазоном цен"""
+        self.refresh()
+        return self.facets.facets("brand")
     
     def clear(self) -> None:
         """Очистить хранилище"""
-        self.client.delete_collection("products")
-        self.collection = self.client.create_collection(
-            name="products",
-            metadata={"hnsw:space": "cosine"}
-        )
+        with self._lock:
+            self.index.clear()
+            self.facets.clear()
+            self.neighbours.clear()
+            self.keys.clear()
+            self.lexical.clear()
         logger.info("Векторное хранилище очищено")
     
+    def _rebuild_catalog_indexes(self) -> None:
+        """
+        Перестроить индексы в памяти по содержимому векторного индекса
+        
+        Если индекс открыт из снимка, лексический индекс и таблица соседей
+        загружаются из него (после проверки, что они построены по тем же
+        товарам); категории и ключи быстро строятся по метаданным.
+        """
+        metadatas = self.index.get_metadata()
+        documents = self.index.get_documents()
+        attachments = getattr(self.index, "attachments", {})
+        self.facets.build(metadatas)
+        self.keys.build(metadatas)
+        
+        lexical = _attachment_group(attachments, "lexical")
+        if not lexical or not self.lexical.load(lexical, documents, metadatas):
+            self.lexical.build(documents, metadatas)
+        
+        # Таблица из снимка построена по тем же векторам, что и индекс в нём
+        neighbours = _attachment_group(attachments, "neighbours")
+        if neighbours:
+            self.neighbours.load_arrays(neighbours)
+        
+        # Таблицы соседей нет или она не соответствует индексу — строим в памяти
+        if self.neighbours.ids() != {int(id_) for id_ in metadatas}:
+            logger.info("Таблица соседей устарела, перестраиваем по векторам индекса")
+            self.neighbours.build(*self.index.get_embeddings())
+    
+    def _read_catalog_version(self) -> str:
+        try:
+            return self._version_path.read_text().strip()
+        except FileNotFoundError:
+            return "0"
+    
+    def flush(self) -> None:
+        """
+        Сохранить изменения индекса и обновить версию каталога
+        
+        Вызывается один раз после серии изменений (add_products, sync_products,
+        delete_products, clear). Работающие бот и API перечитают индекс при
+        следующем обращении.
+        """
+        with self._lock:
+            self.index.flush()
+            self.neighbours.flush()
+            if self.document_cache is not None:
+                self.document_cache.flush()
+            self.catalog_version = str(time.time_ns())
+            self._version_path.write_text(self.catalog_version)
+    
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Перечитать индекс, если каталог был обновлён другим процессом
+        
+        Версия проверяется не чаще раза в CATALOG_CHECK_INTERVAL секунд.
+        
+        Returns:
+            True, если индекс был перечитан
+        """
+        now = time.monotonic()
+        if not force and now - self._version_checked_at < settings.catalog_check_interval:
+            return False
+        self._version_checked_at = now
+        
+        version = self._read_catalog_version()
+        if version == self.catalog_version:
+            return False
+        
+        with self._lock:
+            self.index.reload()
+            self.neighbours.load()
+            self._rebuild_catalog_indexes()
+            self.catalog_version = version
+        
+        logger.info(f"Каталог обновлён, индекс перечитан (версия {version})")
+        return True
+    
+    def stats(self) -> Dict[str, Any]:
+        """Счётчики для мониторинга производительности"""
+        return {
+            "warmup": self.warmup_timings,
+            "query_cache": self.query_cache.stats(),
+            "document_cache": self.document_cache.stats() if self.document_cache else None,
+            "embedding_batcher": self.batcher.stats(),
+            "keys": self.keys.stats(),
+            "neighbours": {"products": len(self.neighbours), "k": self.neighbours.k},
+            "lexical": {
+                "documents": len(self.lexical),
+                "exact_hits": self.exact_hits,
+                "hybrid_queries": self.hybrid_queries,
+            },
+        }
+    
     @property
     def count(self) -> int:
         """Количество товаров в хранилище"""
-        return self.collection.count()
+        return self.index.count()
+
+
+
+# Общий экземпляр хранилища на процесс
+_vector_store: Optional[ProductVectorStore] = None
+_vector_store_lock = threading.Lock()
+
+
+def get_vector_store() -> ProductVectorStore:
+    """
+    Получить общий для процесса экземпляр векторного хранилища
+    
+    Модель эмбеддингов и клиент ChromaDB создаются один раз при первом
+    обращении, все последующие вызовы возвращают тот же объект.
+    """
+    global _vector_store
+    
+    if _vector_store is None:
+        with _vector_store_lock:
+            if _vector_store is None:
+                _vector_store = ProductVectorStore()
+    
+    return _vector_store
+
+
+async def init_vector_store() -> ProductVectorStore:
+    """
+    Инициализировать и прогреть общее хранилище при старте приложения
+    
+    Открытие индекса, загрузка модели и пробные кодирование и поиск
+    выполняются в отдельном потоке, чтобы не блокировать event loop.
+    Бот и API в одном процессе прогревают хранилище один раз.
+    """
+    started = time.perf_counter()
+    store = await asyncio.to_thread(get_vector_store)
+    timings = await asyncio.to_thread(store.warm_up)
+    logger.info(
+        f"Векторное хранилище готово за {time.perf_counter() - started:.2f} с "
+        f"(фазы: {', '.join(f'{phase} {seconds:.2f} с' for phase, seconds in timings.items())})"
+    )
+    return store
+
+
+async def aget_vector_store() -> ProductVectorStore:
+    """Общее хранилище без блокировки event loop, пока оно создаётся при старте"""
+    if _vector_store is not None:
+        return _vector_store
+    return await asyncio.to_thread(get_vector_store)
+
+
+def close_vector_store() -> None:
+    """Освободить общее хранилище при остановке приложения"""
+    global _vector_store
+    
+    with _vector_store_lock:
+        if _vector_store is not None:
+            _vector_store.close()
+            _vector_store = None
+
 
+def is_vector_store_ready() -> bool:
+    """Прогрето ли общее хранилище (готово к обработке запросов)"""
+    return _vector_store is not None and _vector_store.ready
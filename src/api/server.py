@@ -1,13 +1,15 @@
 """
 FastAPI сервер для веб-виджета
 """
+import json
 import uuid
-from typing import Dict, List, Optional
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from loguru import logger
 from pathlib import Path
@@ -15,6 +17,16 @@ from pathlib import Path
 from src.config import get_settings
 from src.database.session import init_db, AsyncSessionLocal
 from src.ai.agent import SalesAgent
+from src.ai.answer_cache import get_answer_cache
+from src.ai.tool_cache import get_tool_cache
+from src.ai.openai_client import close_openai_client
+from src.ai.vector_store import (
+    init_vector_store,
+    aget_vector_store,
+    close_vector_store,
+    get_vector_store,
+    is_vector_store_ready,
+)
 
 settings = get_settings()
 
@@ -33,6 +45,8 @@ class ChatResponse(BaseModel):
     session_id: str
     message: str
     products: Optional[List[dict]] = None
+    # Расход токенов за ход: история, запрос и ответ модели
+    usage: Optional[dict] = None
 
 
 class ProductSearchRequest(BaseModel):
@@ -50,8 +64,20 @@ async def lifespan(app: FastAPI):
     """Жизненный цикл приложения"""
     logger.info("Инициализация API сервера...")
     await init_db()
+    
+    # Прогрев идёт в фоне: /health отвечает сразу, /ready — после прогрева
+    warmup = asyncio.create_task(init_vector_store())
+    warmup.add_done_callback(_log_warmup_error)
     yield
     logger.info("Остановка API сервера...")
+    warmup.cancel()
+    close_vector_store()
+    await close_openai_client()
+
+
+def _log_warmup_error(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Ошибка прогрева векторного хранилища: {task.exception()}")
 
 
 app = FastAPI(
@@ -83,10 +109,37 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """Проверка состояния сервиса"""
+    """Проверка состояния сервиса (процесс жив)"""
     return {"status": "healthy"}
 
 
+@app.get("/ready")
+async def readiness_check():
+    """
+    Готовность к обработке запросов: модель загружена, индекс открыт
+    
+    До окончания прогрева возвращает 503.
+    """
+    if not is_vector_store_ready():
+        return JSONResponse(status_code=503, content={"status": "warming_up"})
+    return {"status": "ready", "warmup": get_vector_store().warmup_timings}
+
+
+@app.get("/api/stats")
+async def get_stats():
+    """
+    Счётчики производительности поиска (кэши, очереди), кэша ответов и кэша результатов функций
+    """
+    store = await aget_vector_store()
+    answer_cache = get_answer_cache()
+    tool_cache = get_tool_cache()
+    return {
+        **store.stats(),
+        "answer_cache": answer_cache.stats() if answer_cache else None,
+        "tool_cache": tool_cache.stats() if tool_cache else None,
+    }
+
+
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """
@@ -98,7 +151,7 @@ async def chat(request: ChatRequest):
     
     try:
         async with AsyncSessionLocal() as db_session:
-            agent = SalesAgent(db_session)
+            agent = SalesAgent(db_session, vector_store=await aget_vector_store())
             response, updated_history = await agent.chat(request.message, history)
         
         # Сохраняем историю
@@ -106,7 +159,8 @@ async def chat(request: ChatRequest):
         
         return ChatResponse(
             session_id=session_id,
-            message=response
+            message=response,
+            usage=agent.usage,
         )
         
     except Exception as e:
@@ -114,6 +168,51 @@ async def chat(request: ChatRequest):
         raise HTTPException(status_code=500, detail="Внутренняя ошибка сервера")
 
 
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Отправить сообщение AI-ассистенту, получая ответ по мере генерации
+    
+    Ответ — поток Server-Sent Events: события "delta" с фрагментами текста
+    ({"text": ...}) и завершающее "done" ({"session_id", "message", "ttft", "usage"}).
+    Текст из "done" окончательный и заменяет собранные фрагменты.
+    """
+    session_id = request.session_id or str(uuid.uuid4())
+    history = chat_sessions.get(session_id, [])
+    
+    async def events() -> AsyncIterator[str]:
+        try:
+            async with AsyncSessionLocal() as db_session:
+                agent = SalesAgent(db_session, vector_store=await aget_vector_store())
+                async for event in agent.chat_stream(request.message, history):
+                    if event["type"] == "delta":
+                        yield _sse("delta", {"text": event["text"]})
+                        continue
+                    
+                    # Сохраняем историю
+                    chat_sessions[session_id] = event["history"]
+                    yield _sse("done", {
+                        "session_id": session_id,
+                        "message": event["message"],
+                        "ttft": event["ttft"],
+                        "usage": event["usage"],
+                    })
+        except Exception as e:
+            logger.error(f"Ошибка в chat stream API: {e}")
+            yield _sse("error", {"detail": "Внутренняя ошибка сервера"})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # X-Accel-Buffering отключает буферизацию ответа в nginx
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 @app.post("/api/search")
 async def search_products(request: ProductSearchRequest):
     """
@@ -121,7 +220,7 @@ async def search_products(request: ProductSearchRequest):
     """
     try:
         async with AsyncSessionLocal() as db_session:
-            agent = SalesAgent(db_session)
+            agent = SalesAgent(db_session, vector_store=await aget_vector_store())
             products = await agent._search_products(
                 query=request.query,
                 category=request.category,
@@ -145,7 +244,7 @@ async def get_product(product_id: int):
     """
     try:
         async with AsyncSessionLocal() as db_session:
-            agent = SalesAgent(db_session)
+            agent = SalesAgent(db_session, vector_store=await aget_vector_store())
             product = await agent._get_product_details(product_id)
         
         if not product:
@@ -166,11 +265,13 @@ async def get_categories():
     Получить список категорий
     """
     try:
-        async with AsyncSessionLocal() as db_session:
-            agent = SalesAgent(db_session)
-            categories = await agent._get_categories()
+        store = await aget_vector_store()
+        facets = await store.aget_category_facets()
         
-        return {"categories": categories}
+        return {
+            "categories": [facet["name"] for facet in facets],
+            "facets": facets,
+        }
         
     except Exception as e:
         logger.error(f"Ошибка получения категорий: {e}")
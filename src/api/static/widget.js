@@ -492,6 +492,59 @@
             this.elements.messages.scrollTop = this.elements.messages.scrollHeight;
         },
 
+        // Ответ приходит потоком Server-Sent Events: фрагменты текста
+        // показываются сразу, событие "done" содержит окончательный текст
+        async readStream(body) {
+            const reader = body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let text = '';
+            let messageEl = null;
+
+            const render = (value) => {
+                if (!messageEl) {
+                    this.hideTyping();
+                    messageEl = document.createElement('div');
+                    messageEl.className = 'tp-message bot';
+                    this.elements.messages.appendChild(messageEl);
+                }
+                messageEl.innerHTML = `<div class="tp-message-content">${this.formatMessage(value)}</div>`;
+                this.scrollToBottom();
+            };
+
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    const raw = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+
+                    let event = 'message';
+                    let data = '';
+                    raw.split('\n').forEach((line) => {
+                        if (line.startsWith('event: ')) event = line.slice(7);
+                        else if (line.startsWith('data: ')) data += line.slice(6);
+                    });
+                    const payload = JSON.parse(data || '{}');
+
+                    if (event === 'delta') {
+                        text += payload.text;
+                        render(text);
+                    } else if (event === 'done') {
+                        render(payload.message);
+                        this.messages.push({ text: payload.message, type: 'bot' });
+                        this.sessionId = payload.session_id;
+                        localStorage.setItem('tp_chat_session', this.sessionId);
+                    } else if (event === 'error') {
+                        throw new Error(payload.detail);
+                    }
+                }
+            }
+        },
+
         async sendMessage() {
             const text = this.elements.input.value.trim();
             if (!text) return;
@@ -503,7 +556,7 @@
             this.showTyping();
 
             try {
-                const response = await fetch(`${this.config.apiUrl}/api/chat`, {
+                const response = await fetch(`${this.config.apiUrl}/api/chat/stream`, {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
                     body: JSON.stringify({
@@ -512,14 +565,10 @@
                     })
                 });
 
-                const data = await response.json();
-                this.hideTyping();
-                
-                if (data.message) {
-                    this.addMessage(data.message, 'bot');
-                    this.sessionId = data.session_id;
-                    localStorage.setItem('tp_chat_session', this.sessionId);
+                if (!response.ok || !response.body) {
+                    throw new Error(`HTTP ${response.status}`);
                 }
+                await this.readStream(response.body);
             } catch (error) {
                 this.hideTyping();
                 this.addMessage('Извините, произошла ошибка. Попробуйте позже.', 'bot');
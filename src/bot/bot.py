@@ -10,6 +10,8 @@ from loguru import logger
 from src.config import get_settings
 from src.bot.handlers import router
 from src.database.session import init_db
+from src.ai.vector_store import init_vector_store, close_vector_store
+from src.ai.openai_client import close_openai_client
 
 settings = get_settings()
 
@@ -30,6 +32,10 @@ class TelegramBot:
         logger.info("Инициализация базы данных...")
         await init_db()
         
+        # Polling начинается только после прогрева, чтобы первый клиент не ждал загрузку модели
+        logger.info("Инициализация и прогрев векторного хранилища...")
+        await init_vector_store()
+        
         logger.info("Запуск Telegram бота...")
         
         try:
@@ -43,6 +49,8 @@ class TelegramBot:
             )
         finally:
             await self.bot.session.close()
+            close_vector_store()
+            await close_openai_client()
     
     async def stop(self):
         """Остановка бота"""
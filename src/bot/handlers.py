@@ -1,8 +1,11 @@
 """
 Обработчики сообщений Telegram бота
 """
+import time
+import asyncio
 from typing import Dict, List
 from aiogram import Router, F
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
@@ -11,6 +14,7 @@ from loguru import logger
 
 from src.database.session import AsyncSessionLocal
 from src.ai.agent import SalesAgent
+from src.ai.vector_store import aget_vector_store
 from src.config import get_settings
 
 settings = get_settings()
@@ -104,9 +108,8 @@ async def cmd_clear(message: Message):
 @router.message(Command("catalog"))
 async def cmd_catalog(message: Message):
     """Показать категории каталога"""
-    async with AsyncSessionLocal() as session:
-        agent = SalesAgent(session)
-        categories = agent.vector_store.get_categories()
+    store = await aget_vector_store()
+    categories = await store.aget_categories()
     
     if categories:
         categories_text = "\n".join([f"• {cat}" for cat in categories])
@@ -134,6 +137,100 @@ async def cmd_contacts(message: Message):
     await message.answer(contacts_text)
 
 
+def split_message(text: str, limit: int = 4000) -> List[str]:
+    """Разбить текст на части не длиннее limit по границам строк"""
+    parts = []
+    current_part = ""
+    
+    for line in text.split("\n"):
+        # Строка длиннее лимита режется как есть
+        while len(line) > limit:
+            if current_part:
+                parts.append(current_part)
+                current_part = ""
+            parts.append(line[:limit])
+            line = line[limit:]
+        
+        if len(current_part) + len(line) + 1 > limit:
+            parts.append(current_part)
+            current_part = line
+        else:
+            current_part += "\n" + line if current_part else line
+    
+    if current_part:
+        parts.append(current_part)
+    
+    return parts
+
+
+class StreamingReply:
+    """
+    Ответ бота, который дописывается по мере генерации
+    
+    Первый фрагмент отправляется сразу, дальше сообщение редактируется
+    не чаще раза в telegram_edit_interval секунд (лимиты Telegram на
+    редактирование). Промежуточный текст показывается без разметки:
+    незакрытые ** ломают разбор Markdown. Текст длиннее лимита Telegram
+    продолжается в следующих сообщениях.
+    """
+    
+    def __init__(self, message: Message):
+        self.message = message
+        self.text = ""
+        self.sent: List[Message] = []
+        self.shown: List[str] = []
+        self.next_edit = 0.0
+    
+    async def append(self, delta: str) -> None:
+        """Дописать фрагмент ответа"""
+        self.text += delta
+        if time.monotonic() < self.next_edit or not self.text.strip():
+            return
+        
+        try:
+            await self._render(self.text, parse_mode=None)
+        except TelegramRetryAfter as e:
+            # Промежуточное обновление можно пропустить
+            self.next_edit = time.monotonic() + e.retry_after
+            return
+        self.next_edit = time.monotonic() + settings.telegram_edit_interval
+    
+    async def finish(self, text: str) -> None:
+        """Показать окончательный текст ответа с разметкой"""
+        try:
+            await self._render(text, final=True)
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            await self.finish(text)
+        except TelegramBadRequest as e:
+            # Модель могла выдать некорректный Markdown
+            logger.warning(f"Ответ отправлен без разметки: {e}")
+            await self._render(text, final=True, parse_mode=None)
+    
+    async def _render(self, text: str, final: bool = False, **kwargs) -> None:
+        parts = split_message(text)
+        for position, part in enumerate(parts):
+            if position == len(self.sent):
+                self.sent.append(await self.message.answer(part, **kwargs))
+                self.shown.append(part)
+            elif final or part != self.shown[position]:
+                await self._edit(position, part, **kwargs)
+        
+        # Окончательный текст может оказаться короче показанного
+        if final:
+            for extra in self.sent[len(parts):]:
+                await extra.delete()
+            del self.sent[len(parts):], self.shown[len(parts):]
+    
+    async def _edit(self, position: int, part: str, **kwargs) -> None:
+        try:
+            await self.sent[position].edit_text(part, **kwargs)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
+        self.shown[position] = part
+
+
 @router.message(F.text)
 async def handle_message(message: Message, state: FSMContext):
     """Обработка текстовых сообщений"""
@@ -152,33 +249,17 @@ async def handle_message(message: Message, state: FSMContext):
     history = conversation_histories.get(user_id, [])
     
     try:
+        reply = StreamingReply(message)
         async with AsyncSessionLocal() as session:
-            agent = SalesAgent(session)
-            response, updated_history = await agent.chat(user_message, history)
-        
-        # Сохраняем обновлённую историю
-        conversation_histories[user_id] = updated_history
-        
-        # Отправляем ответ (разбиваем на части если слишком длинный)
-        if len(response) > 4000:
-            # Разбиваем на части
-            parts = []
-            current_part = ""
-            
-            for line in response.split("\n"):
-                if len(current_part) + len(line) + 1 > 4000:
-                    parts.append(current_part)
-                    current_part = line
+            agent = SalesAgent(session, vector_store=await aget_vector_store())
+            # Ответ показывается по мере генерации, одно сообщение дописывается
+            async for event in agent.chat_stream(user_message, history):
+                if event["type"] == "delta":
+                    await reply.append(event["text"])
                 else:
-                    current_part += "\n" + line if current_part else line
-            
-            if current_part:
-                parts.append(current_part)
-            
-            for part in parts:
-                await message.answer(part)
-        else:
-            await message.answer(response)
+                    await reply.finish(event["message"])
+                    # Сохраняем обновлённую историю
+                    conversation_histories[user_id] = event["history"]
             
     except Exception as e:
         logger.error(f"Ошибка обработки сообщения: {e}")
@@ -196,7 +277,7 @@ async def handle_callback(callback: CallbackQuery):
         product_id = int(data.replace("product_", ""))
         
         async with AsyncSessionLocal() as session:
-            agent = SalesAgent(session)
+            agent = SalesAgent(session, vector_store=await aget_vector_store())
             product = await agent._get_product_details(product_id)
         
         if product:
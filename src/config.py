@@ -11,10 +11,35 @@ class Settings(BaseSettings):
     
     # Telegram
     telegram_bot_token: str = Field(..., env="TELEGRAM_BOT_TOKEN")
+    # Как часто (в секундах) обновлять сообщение, пока ответ генерируется
+    telegram_edit_interval: float = Field(default=1.0, env="TELEGRAM_EDIT_INTERVAL")
     
     # OpenAI
     openai_api_key: str = Field(..., env="OPENAI_API_KEY")
     openai_model: str = Field(default="gpt-4o-mini", env="OPENAI_MODEL")
+    # OpenAI-совместимый API вместо api.openai.com (пусто — OpenAI),
+    # например локальная заглушка для нагрузочных тестов
+    openai_base_url: str = Field(default="", env="OPENAI_BASE_URL")
+    # Общий для процесса клиент: таймауты (с), пул соединений и HTTP/2
+    openai_timeout: float = Field(default=60.0, env="OPENAI_TIMEOUT")
+    openai_connect_timeout: float = Field(default=5.0, env="OPENAI_CONNECT_TIMEOUT")
+    openai_max_connections: int = Field(default=100, env="OPENAI_MAX_CONNECTIONS")
+    openai_max_keepalive: int = Field(default=20, env="OPENAI_MAX_KEEPALIVE")
+    openai_keepalive_expiry: float = Field(default=60.0, env="OPENAI_KEEPALIVE_EXPIRY")
+    openai_http2: bool = Field(default=True, env="OPENAI_HTTP2")
+    openai_max_retries: int = Field(default=2, env="OPENAI_MAX_RETRIES")
+    # Сколько вызовов функций одного ответа модели выполнять одновременно
+    agent_tool_concurrency: int = Field(default=4, env="AGENT_TOOL_CONCURRENCY")
+    # Сколько токенов истории разговора отправлять модели; ранние реплики
+    # сворачиваются в краткое содержание не длиннее history_summary_tokens
+    history_token_budget: int = Field(default=2000, env="HISTORY_TOKEN_BUDGET")
+    history_summary_tokens: int = Field(default=300, env="HISTORY_SUMMARY_TOKENS")
+    # Семантический кэш ответов на типовые вопросы (размер 0 — отключён)
+    answer_cache_size: int = Field(default=1000, env="ANSWER_CACHE_SIZE")
+    answer_cache_ttl: int = Field(default=3600, env="ANSWER_CACHE_TTL")
+    answer_cache_threshold: float = Field(default=0.92, env="ANSWER_CACHE_THRESHOLD")
+    tool_cache_size: int = Field(default=2048, env="TOOL_CACHE_SIZE")
+    tool_cache_ttl: int = Field(default=600, env="TOOL_CACHE_TTL")
     
     # Database
     database_url: str = Field(
@@ -25,6 +50,53 @@ class Settings(BaseSettings):
     # ChromaDB
     chroma_db_path: str = Field(default="./data/chroma_db", env="CHROMA_DB_PATH")
     
+    # Бэкенд векторного индекса: "chroma", "numpy" (точный поиск в памяти)
+    # или "snapshot" (NumPy-индекс из снимка, только для чтения)
+    vector_backend: str = Field(default="chroma", env="VECTOR_BACKEND")
+    numpy_index_path: str = Field(default="./data/numpy_index.npz", env="NUMPY_INDEX_PATH")
+    # Разбиение индекса на шарды: "" (одна коллекция) или "category".
+    # После смены нужна полная переиндексация (python sync_vectors.py --full)
+    vector_partition_by: str = Field(default="", env="VECTOR_PARTITION_BY")
+    # Снимок индекса (python sync_vectors.py --snapshot)
+    snapshot_path: str = Field(default="./data/vectors.snapshot", env="SNAPSHOT_PATH")
+    # Тип хранения векторов в NumPy-индексе: float32, float16 или int8
+    vector_dtype: str = Field(default="float32", env="VECTOR_DTYPE")
+    # Как часто (в секундах) проверять, не обновил ли каталог другой процесс
+    catalog_check_interval: float = Field(default=5.0, env="CATALOG_CHECK_INTERVAL")
+    
+    # Бэкенд модели эмбеддингов: torch или onnx (см. export_onnx.py)
+    embedding_backend: str = Field(default="torch", env="EMBEDDING_BACKEND")
+    onnx_model_path: str = Field(default="./data/onnx/model.onnx", env="ONNX_MODEL_PATH")
+    
+    # Гибридный поиск: BM25 по тексту товаров + векторный, слияние RRF
+    lexical_search: bool = Field(default=True, env="LEXICAL_SEARCH")
+    rrf_k: int = Field(default=60, env="RRF_K")
+    
+    # Предрассчитанные похожие товары для рекомендаций
+    neighbours_k: int = Field(default=24, env="NEIGHBOURS_K")
+    neighbours_path: str = Field(default="./data/neighbours.npz", env="NEIGHBOURS_PATH")
+    
+    # Индексация товаров
+    embedding_batch_size: int = Field(default=64, env="EMBEDDING_BATCH_SIZE")
+    vector_upsert_chunk_size: int = Field(default=1000, env="VECTOR_UPSERT_CHUNK_SIZE")
+    
+    # Асинхронный поиск: потоки для эмбеддингов и размер очереди ожидающих запросов
+    vector_workers: int = Field(default=2, env="VECTOR_WORKERS")
+    vector_queue_size: int = Field(default=32, env="VECTOR_QUEUE_SIZE")
+    
+    # Кэш эмбеддингов запросов (пустой путь — без дискового уровня)
+    query_cache_size: int = Field(default=2048, env="QUERY_CACHE_SIZE")
+    query_cache_ttl: int = Field(default=86400, env="QUERY_CACHE_TTL")
+    query_cache_path: str = Field(default="", env="QUERY_CACHE_PATH")
+    
+    # Дисковый кэш эмбеддингов товаров (пустой путь — без кэша)
+    embedding_cache_path: str = Field(default="./data/embedding_cache", env="EMBEDDING_CACHE_PATH")
+    embedding_cache_size: int = Field(default=100000, env="EMBEDDING_CACHE_SIZE")
+    
+    # Микробатчинг кодирования одновременных запросов
+    embedding_batch_window_ms: float = Field(default=5.0, env="EMBEDDING_BATCH_WINDOW_MS")
+    embedding_max_batch: int = Field(default=32, env="EMBEDDING_MAX_BATCH")
+    
     # API Server
     api_host: str = Field(default="0.0.0.0", env="API_HOST")
     api_port: int = Field(default=8000, env="API_PORT")
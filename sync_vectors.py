@@ -1,11 +1,21 @@
 """
 Синхронизация товаров из БД в векторное хранилище
 Запустите после парсинга каталога
+
+По умолчанию синхронизация инкрементальная: пересчитываются эмбеддинги только
+изменившихся товаров, а удалённые из БД товары убираются из хранилища.
+Для полной переиндексации используйте флаг --full.
+
+С флагом --snapshot после синхронизации сохраняется снимок индекса
+для быстрого старта реплик (VECTOR_BACKEND=snapshot).
 """
+import argparse
 import asyncio
 import sys
+import time
+from typing import Optional
 from loguru import logger
-from sqlalchemy import select
+from sqlalchemy import select, func
 
 # Настройка логирования
 logger.remove()
@@ -16,51 +26,135 @@ logger.add(
 )
 
 
-async def sync_to_vectors():
+async def sync_to_vectors(full: bool = False, snapshot: Optional[str] = None):
     """Синхронизация товаров в векторное хранилище"""
+    from src.config import get_settings
     from src.database.session import AsyncSessionLocal, init_db
     from src.database.models import Product
-    from src.ai.vector_store import ProductVectorStore
+    from src.ai.vector_store import get_vector_store, peak_memory_mb
     from sqlalchemy.orm import selectinload
     
+    settings = get_settings()
+    
+    if settings.vector_backend == "snapshot":
+        logger.error(
+            "Снимок открывается только для чтения: запустите синхронизацию "
+            "с основным индексом (VECTOR_BACKEND=chroma или numpy)"
+        )
+        return
+    
     logger.info("Инициализация базы данных...")
     await init_db()
     
     logger.info("Инициализация векторного хранилища...")
-    vector_store = ProductVectorStore()
+    vector_store = get_vector_store()
     
     logger.info("Загрузка товаров из базы данных...")
     
     async with AsyncSessionLocal() as session:
-        result = await session.execute(
-            select(Product).options(selectinload(Product.category))
-        )
-        products = result.scalars().all()
+        total = await session.scalar(select(func.count(Product.id)))
         
-        if not products:
+        if not total:
             logger.warning("Товары не найдены в базе данных!")
             logger.info("Сначала запустите парсер: python run_parser.py")
             return
         
-        logger.info(f"Найдено товаров: {len(products)}")
+        logger.info(f"Найдено товаров: {total}")
+        
+        # Читаем товары порциями, чтобы не держать весь каталог в памяти
+        chunk_size = settings.vector_upsert_chunk_size
+        result = await session.stream_scalars(
+            select(Product)
+            .options(selectinload(Product.category))
+            .order_by(Product.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        
+        if full:
+            logger.info("Полная переиндексация...")
+            vector_store.clear()
+            indexed = {}
+        else:
+            indexed = vector_store.get_indexed_metadata()
+            logger.info(f"Уже в векторном хранилище: {len(indexed)}")
         
-        # Добавляем товары в векторное хранилище
-        vector_store.add_products(list(products))
+        started = time.perf_counter()
+        processed = 0
+        totals = {"added": 0, "reembedded": 0, "updated": 0, "unchanged": 0}
         
-        logger.info(f"Товаров в векторном хранилище: {vector_store.count}")
+        async for partition in result.partitions(chunk_size):
+            if full:
+                stats = vector_store.add_products(partition)
+                totals["added"] += stats["products"]
+            else:
+                stats = vector_store.sync_products(partition, indexed)
+                for key, value in stats.items():
+                    totals[key] += value
+            
+            processed += len(partition)
+            
+            # Освобождаем уже проиндексированные объекты
+            session.expunge_all()
+            logger.info(f"Прогресс: {processed}/{total}")
         
-        # Показываем категории и бренды
-        categories = vector_store.get_categories()
-        brands = vector_store.get_brands()
+        # В indexed остались товары, которых больше нет в БД
+        deleted = vector_store.delete_products(indexed.keys())
         
-        logger.info(f"Категории: {categories}")
-        logger.info(f"Бренды: {brands}")
+        # Снимок пишется до обновления версии каталога, чтобы реплики перечитали уже новый
+        if snapshot is not None:
+            vector_store.export_snapshot(snapshot or None)
+        vector_store.flush()
+        
+        seconds = time.perf_counter() - started
+        encoded = totals["added"] + totals["reembedded"]
+        logger.info(
+            f"Добавлено: {totals['added']}, перекодировано: {totals['reembedded']}, "
+            f"обновлены метаданные: {totals['updated']}, без изменений: {totals['unchanged']}, "
+            f"удалено: {deleted}"
+        )
+        if encoded and seconds > 0:
+            logger.info(f"Скорость индексации: {encoded / seconds:.1f} товаров/с за {seconds:.1f} с")
+        
+        cache = vector_store.stats()["document_cache"]
+        if cache and cache["size"] is not None:
+            logger.info(
+                f"Кэш эмбеддингов товаров: взято из кэша {cache['hits']}, "
+                f"закодировано моделью {cache['misses']} (записей в кэше: {cache['size']})"
+            )
+        
+        peak_memory = peak_memory_mb()
+        if peak_memory is not None:
+            logger.info(f"Пиковое потребление памяти: {peak_memory:.0f} МБ")
+    
+    logger.info(f"Товаров в векторном хранилище: {vector_store.count}")
+    
+    # Показываем категории и бренды
+    categories = vector_store.get_categories()
+    brands = vector_store.get_brands()
+    
+    logger.info(f"Категории: {categories}")
+    logger.info(f"Бренды: {brands}")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Синхронизация товаров в векторное хранилище")
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Очистить хранилище и переиндексировать весь каталог",
+    )
+    parser.add_argument(
+        "--snapshot",
+        nargs="?",
+        const="",
+        metavar="PATH",
+        help="Сохранить снимок индекса для VECTOR_BACKEND=snapshot (по умолчанию SNAPSHOT_PATH)",
+    )
+    args = parser.parse_args()
+    
     logger.info("Синхронизация товаров в векторное хранилище...")
     try:
-        asyncio.run(sync_to_vectors())
+        asyncio.run(sync_to_vectors(full=args.full, snapshot=args.snapshot))
         logger.info("Синхронизация завершена!")
     except Exception as e:
         logger.error(f"Ошибка: {e}")
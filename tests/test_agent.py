@@ -5,6 +5,15 @@ import pytest
 import asyncio
 from unittest.mock import AsyncMock, MagicMock, patch
 
+from src.ai.memory import ConversationMemory, TokenCounter
+
+
+class WordCounter(TokenCounter):
+    """Счётчик токенов по словам: не зависит от словаря tiktoken"""
+    
+    def count(self, text):
+        return len(text.split())
+
 
 class TestSalesAgent:
     """Тесты для SalesAgent"""
@@ -30,13 +39,14 @@ class TestSalesAgent:
                     }
                 }
             ]
+            store.asearch = AsyncMock(return_value=store.search.return_value)
             mock.return_value = store
             yield store
     
     @pytest.fixture
     def mock_openai(self):
         """Мок OpenAI клиента"""
-        with patch('src.ai.agent.AsyncOpenAI') as mock:
+        with patch('src.ai.agent.get_openai_client') as mock:
             client = AsyncMock()
             
             # Мок ответа без вызова функций
@@ -63,9 +73,12 @@ class TestSalesAgent:
             agent = SalesAgent(mock_db_session)
             agent.client = mock_openai
             agent.db = mock_db_session
+            agent._db_lock = asyncio.Lock()
             agent.vector_store = mock_vector_store
             agent.model = "gpt-4o-mini"
             agent.system_prompt = "Тестовый промпт"
+            agent.memory = ConversationMemory(WordCounter("gpt-4o-mini"), 2000, AsyncMock())
+            agent.answer_cache = None
             
             response, history = await agent.chat("Привет!")
             
@@ -74,6 +87,87 @@ class TestSalesAgent:
             assert history[0]["role"] == "user"
             assert history[1]["role"] == "assistant"
     
+    @pytest.mark.asyncio
+    async def test_chat_answers_repeated_question_from_cache(
+        self,
+        mock_db_session,
+        mock_vector_store,
+        mock_openai
+    ):
+        """Тест семантического кэша: похожий вопрос без истории не доходит до модели"""
+        from src.ai.agent import SalesAgent
+        from src.ai.answer_cache import AnswerCache
+        
+        embeddings = {
+            "Какая гарантия на технику?": [1.0, 0.0, 0.0],
+            "какая гарантия на технику": [1.0, 0.0, 0.0],
+            "Сколько стоит доставка?": [0.0, 1.0, 0.0],
+        }
+        
+        with patch.object(SalesAgent, '__init__', lambda self, db: None):
+            agent = SalesAgent(mock_db_session)
+            agent.client = mock_openai
+            agent.db = mock_db_session
+            agent.vector_store = mock_vector_store
+            agent.model = "gpt-4o-mini"
+            agent.system_prompt = "Тестовый промпт"
+            agent.memory = ConversationMemory(WordCounter("gpt-4o-mini"), 2000, AsyncMock())
+            agent.answer_cache = AnswerCache(max_size=10, ttl=60, threshold=0.9)
+            mock_vector_store.catalog_version = "1"
+            mock_vector_store.acatalog_version = AsyncMock(return_value="1")
+            mock_vector_store.aembed_query = AsyncMock(side_effect=lambda text: embeddings[text])
+            
+            response, history = await agent.chat("Какая гарантия на технику?")
+            assert mock_openai.chat.completions.create.await_count == 1
+            
+            cached, cached_history = await agent.chat("какая гарантия на технику")
+            assert cached == response
+            assert mock_openai.chat.completions.create.await_count == 1
+            assert cached_history[-1] == {"role": "assistant", "content": response}
+            
+            # Другой вопрос и вопрос с отсылкой к истории идут к модели
+            await agent.chat("Сколько стоит доставка?")
+            await agent.chat("А на него какая гарантия?", history)
+            assert mock_openai.chat.completions.create.await_count == 3
+            
+            # Обновление каталога сбрасывает кэш
+            mock_vector_store.acatalog_version = AsyncMock(return_value="2")
+            await agent.chat("Какая гарантия на технику?")
+            assert mock_openai.chat.completions.create.await_count == 4
+            assert agent.answer_cache.stats()["hits"] == 1
+    
+    def test_answer_cache_ignores_expired_nearest_question(self):
+        """Тест кэша ответов: устаревший ближайший вопрос не заслоняет действующий"""
+        from src.ai.answer_cache import AnswerCache
+        
+        cache = AnswerCache(max_size=10, ttl=60, threshold=0.9)
+        cache.put("Какая гарантия?", [1.0, 0.0], "Старый ответ", "1")
+        cache.put("Какая гарантия на технику?", [0.95, 0.31], "Новый ответ", "1")
+        
+        # Первый ответ устарел, хотя его вопрос ближе к новому
+        embedding, answer, created_at, numbers = cache._items["какая гарантия"]
+        cache._items["какая гарантия"] = (embedding, answer, created_at - 120, numbers)
+        
+        assert cache.get("Какая гарантия?", [1.0, 0.0], "1") == "Новый ответ"
+        assert len(cache) == 1
+    
+    def test_answer_cache_requires_same_numbers(self):
+        """Тест кэша ответов: вопросы с другими суммами и номерами не отвечаются чужим ответом"""
+        from src.ai.answer_cache import AnswerCache
+        
+        cache = AnswerCache(max_size=10, ttl=60, threshold=0.9)
+        cache.put("Где мой заказ 12345?", [1.0, 0.0], "Заказ 12345 передан в доставку", "1")
+        cache.put("Холодильник Samsung до 80000", [0.0, 1.0], "Вот холодильники до 80000", "1")
+        
+        assert cache.get("где мой заказ 12345", [1.0, 0.0], "1") == "Заказ 12345 передан в доставку"
+        assert cache.get("Где мой заказ 12346?", [1.0, 0.0], "1") is None
+        assert cache.get("Холодильник Samsung до 50000", [0.0, 1.0], "1") is None
+        assert cache.get("Холодильник Samsung", [0.0, 1.0], "1") is None
+        
+        # Ответы, для которых вызывались функции, не сохраняются вовсе
+        assert AnswerCache.can_store("Какая гарантия?", [])
+        assert not AnswerCache.can_store("Холодильник Samsung до 80000", [], used_tools=True)
+    
     @pytest.mark.asyncio
     async def test_search_products(self, mock_db_session, mock_vector_store):
         """Тест поиска товаров"""
@@ -82,21 +176,355 @@ class TestSalesAgent:
         with patch.object(SalesAgent, '__init__', lambda self, db: None):
             agent = SalesAgent(mock_db_session)
             agent.db = mock_db_session
+            agent._db_lock = asyncio.Lock()
             agent.vector_store = mock_vector_store
             
-            # Мокаем db.get
+            # Мокаем выборку товаров из БД
             mock_product = MagicMock()
+            mock_product.id = 1
             mock_product.to_dict.return_value = {
                 "id": 1,
                 "name": "Тестовый товар",
                 "price": 50000,
             }
-            mock_db_session.get = AsyncMock(return_value=mock_product)
+            result = MagicMock()
+            result.scalars.return_value.all.return_value = [mock_product]
+            mock_db_session.execute = AsyncMock(return_value=result)
             
             products = await agent._search_products("тест")
             
             assert len(products) == 1
             assert products[0]["name"] == "Тестовый товар"
+            assert mock_db_session.execute.await_count == 1
+
+    
+    @pytest.mark.asyncio
+    async def test_create_product_set_batches_search(self, mock_db_session, mock_vector_store):
+        """Тест подбора комплекта одним батчевым поиском и одним запросом к БД"""
+        from src.ai.agent import SalesAgent
+        
+        with patch.object(SalesAgent, '__init__', lambda self, db: None):
+            agent = SalesAgent(mock_db_session)
+            agent.db = mock_db_session
+            agent._db_lock = asyncio.Lock()
+            agent.vector_store = mock_vector_store
+            mock_vector_store.asearch_many = AsyncMock(return_value=[[{"id": 2}], [], [{"id": 1}], []])
+            
+            products = []
+            for product_id, price in ((1, 30000), (2, 50000)):
+                product = MagicMock()
+                product.id = product_id
+                product.to_dict.return_value = {"id": product_id, "price": price}
+                products.append(product)
+            result = MagicMock()
+            result.scalars.return_value.all.return_value = products
+            mock_db_session.execute = AsyncMock(return_value=result)
+            
+            product_set = await agent._create_product_set("ванная и стирка", budget=100000)
+            
+            queries = mock_vector_store.asearch_many.await_args.args[0]
+            assert len(queries) == 4
+            assert mock_vector_store.asearch_many.await_args.kwargs["max_price"] == 25000
+            assert [item["product"]["id"] for item in product_set["items"]] == [2, 1]
+            assert product_set["total_price"] == 80000
+            assert mock_db_session.execute.await_count == 1
+
+    
+    @pytest.mark.asyncio
+    async def test_get_recommendations_uses_neighbour_table(self, mock_db_session, mock_vector_store):
+        """Тест рекомендаций из таблицы соседей без поиска по тексту"""
+        from src.ai.agent import SalesAgent
+        
+        with patch.object(SalesAgent, '__init__', lambda self, db: None):
+            agent = SalesAgent(mock_db_session)
+            agent.db = mock_db_session
+            agent._db_lock = asyncio.Lock()
+            agent.vector_store = mock_vector_store
+            mock_vector_store.aget_similar = AsyncMock(return_value=[{"id": 3}, {"id": 2}])
+            
+            products = []
+            for product_id in (2, 3):
+                product = MagicMock()
+                product.id = product_id
+                product.to_dict.return_value = {"id": product_id}
+                products.append(product)
+            result = MagicMock()
+            result.scalars.return_value.all.return_value = products
+            mock_db_session.execute = AsyncMock(return_value=result)
+            
+            recommendations = await agent._get_recommendations(1, count=2)
+            
+            assert [product["id"] for product in recommendations] == [3, 2]
+            mock_vector_store.aget_similar.assert_awaited_once_with(1, count=2, in_stock_only=True)
+            mock_vector_store.asearch.assert_not_called()
+            assert mock_db_session.execute.await_count == 1
+    
+    @pytest.mark.asyncio
+    async def test_tool_results_are_compact(self, mock_db_session, mock_vector_store):
+        """Тест компактного представления товаров в результатах функций"""
+        from src.ai.agent import SalesAgent
+        
+        product = {
+            "id": 1,
+            "name": "Варочная панель Bosch PIE631FB1E",
+            "brand": "Bosch",
+            "article": "A100",
+            "price": 54990.0,
+            "old_price": None,
+            "description": "Очень подробное описание. " * 100,
+            "short_description": "Индукционная панель на 4 конфорки",
+            "image_url": "https://example.com/1.jpg",
+            "in_stock": True,
+            "category": "Варочные панели",
+            "specifications": {f"Параметр {i}": "значение" for i in range(30)} | {"Тип": "Индукционная"},
+            "features": ["Booster"] * 20,
+        }
+        
+        with patch.object(SalesAgent, '__init__', lambda self, db: None):
+            agent = SalesAgent(mock_db_session)
+            agent._search_products = AsyncMock(return_value=[product])
+            agent._get_product_details = AsyncMock(return_value=product)
+            
+            found = await agent._execute_function("search_products", {"query": "панель"})
+            assert found == [{
+                "id": 1,
+                "name": "Варочная панель Bosch PIE631FB1E",
+                "brand": "Bosch",
+                "price": 54990.0,
+                "stock": True,
+                "cat": "Варочные панели",
+                "desc": "Индукционная панель на 4 конфорки",
+                "specs": {"Тип": "Индукционная", **{f"Параметр {i}": "значение" for i in range(5)}},
+            }]
+            
+            details = await agent._execute_function("get_product_details", {"product_id": 1})
+            agent._get_product_details.assert_awaited_with(product_id=1)
+            assert details["art"] == "A100"
+            assert len(details["desc"]) <= 801
+            assert len(details["specs"]) == 20
+            assert len(details["feat"]) == 8
+            
+            full = await agent._execute_function("get_product_details", {"product_id": 1, "detail": "full"})
+            assert full["desc"] == product["description"]
+            assert len(full["specs"]) == 31
+    
+    @pytest.mark.asyncio
+    async def test_tool_calls_run_concurrently_in_order(self, mock_db_session, mock_vector_store):
+        """Тест параллельного выполнения вызовов функций с сохранением порядка"""
+        from src.ai.agent import SalesAgent
+        
+        with patch.object(SalesAgent, '__init__', lambda self, db: None):
+            agent = SalesAgent(mock_db_session)
+            agent.db = mock_db_session
+            agent._db_lock = asyncio.Lock()
+            agent.vector_store = mock_vector_store
+            agent.tool_cache = None
+            
+            running = 0
+            peak = 0
+            
+            async def execute(function_name, arguments):
+                nonlocal running, peak
+                running += 1
+                peak = max(peak, running)
+                # Первый вызов завершается последним
+                await asyncio.sleep(0.05 if function_name == "slow" else 0.01)
+                running -= 1
+                return {"function": function_name}
+            
+            agent._execute_function = execute
+            
+            tool_calls = []
+            for position, name in enumerate(["slow", "fast", "fast"]):
+                tool_call = MagicMock()
+                tool_call.id = f"call_{position}"
+                tool_call.function.name = name
+                tool_call.function.arguments = "{}"
+                tool_calls.append(tool_call)
+            
+            messages = await agent._execute_tool_calls(tool_calls)
+            
+            assert peak == 3
+            assert [message["tool_call_id"] for message in messages] == ["call_0", "call_1", "call_2"]
+            assert '"slow"' in messages[0]["content"]
+    
+    @pytest.mark.asyncio
+    async def test_tool_results_are_cached_and_deduplicated(self, mock_db_session, mock_vector_store):
+        """Тест кэша результатов функций: одинаковые вызовы выполняются один раз"""
+        from src.ai.agent import SalesAgent
+        from src.ai.tool_cache import ToolResultCache
+        
+        with patch.object(SalesAgent, '__init__', lambda self, db: None):
+            agent = SalesAgent(mock_db_session)
+            agent.db = mock_db_session
+            agent._db_lock = asyncio.Lock()
+            agent.vector_store = mock_vector_store
+            agent.tool_cache = ToolResultCache(max_size=10, ttl=60)
+            mock_vector_store.acatalog_version = AsyncMock(return_value="v1")
+            
+            calls = []
+            
+            async def execute(function_name, arguments):
+                calls.append(arguments)
+                await asyncio.sleep(0.02)
+                return {"query": arguments.get("query")}
+            
+            agent._execute_function = execute
+            
+            def tool_call(position, arguments):
+                item = MagicMock()
+                item.id = f"call_{position}"
+                item.function.name = "search_products"
+                item.function.arguments = arguments
+                return item
+            
+            # Одинаковые по смыслу вызовы в одном ответе: выполняется один
+            messages = await agent._execute_tool_calls([
+                tool_call(0, '{"query": "Холодильник  Samsung"}'),
+                tool_call(1, '{"query": "холодильник samsung", "in_stock_only": true, "category": null}'),
+            ])
+            assert len(calls) == 1
+            assert messages[0]["content"] == messages[1]["content"]
+            assert [message["tool_call_id"] for message in messages] == ["call_0", "call_1"]
+            
+            # Повторный вызов берётся из кэша
+            await agent._execute_tool_calls([tool_call(2, '{"query": "холодильник Samsung"}')])
+            assert len(calls) == 1
+            
+            # Другие аргументы и обновление каталога выполняют функцию заново
+            await agent._execute_tool_calls([tool_call(3, '{"query": "холодильник samsung", "in_stock_only": false}')])
+            assert len(calls) == 2
+            mock_vector_store.acatalog_version.return_value = "v2"
+            await agent._execute_tool_calls([tool_call(4, '{"query": "холодильник samsung"}')])
+            assert len(calls) == 3
+            
+            assert agent.tool_cache.stats()["shared"] == 1
+            assert agent.tool_cache.stats()["hits"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_chat_stream_yields_deltas_after_tool_calls(self, mock_db_session, mock_vector_store):
+        """Тест потокового ответа: вызов функции собирается из частей, текст отдаётся фрагментами"""
+        from src.ai.agent import SalesAgent
+        from src.ai.answer_cache import AnswerCache
+        
+        def chunk(content=None, tool_calls=None):
+            item = MagicMock()
+            item.choices = [MagicMock()]
+            item.choices[0].delta.content = content
+            item.choices[0].delta.tool_calls = tool_calls
+            return item
+        
+        def tool_call_delta(call_id, name, arguments):
+            delta = MagicMock()
+            delta.index = 0
+            delta.id = call_id
+            delta.function.name = name
+            delta.function.arguments = arguments
+            return delta
+        
+        async def stream(chunks):
+            for item in chunks:
+                yield item
+        
+        responses = [
+            stream([
+                chunk(tool_calls=[tool_call_delta("call_1", "get_categories", "")]),
+                chunk(tool_calls=[tool_call_delta(None, None, "{}")]),
+            ]),
+            stream([chunk("Есть "), chunk("холодильники")]),
+        ]
+        
+        with patch.object(SalesAgent, '__init__', lambda self, db: None):
+            agent = SalesAgent(mock_db_session)
+            agent.client = AsyncMock()
+            agent.client.chat.completions.create = AsyncMock(side_effect=responses)
+            agent.db = mock_db_session
+            agent._db_lock = asyncio.Lock()
+            agent.vector_store = mock_vector_store
+            agent.model = "gpt-4o-mini"
+            agent.system_prompt = "Тестовый промпт"
+            agent.memory = ConversationMemory(WordCounter("gpt-4o-mini"), 2000, AsyncMock())
+            agent.answer_cache = AnswerCache(max_size=10, ttl=60, threshold=0.9)
+            agent.tool_cache = None
+            mock_vector_store.aget_category_facets = AsyncMock(return_value=[{"name": "Холодильники"}])
+            mock_vector_store.acatalog_version = AsyncMock(return_value="1")
+            mock_vector_store.aembed_query = AsyncMock(return_value=[1.0, 0.0])
+            
+            events = [event async for event in agent.chat_stream("Какие есть категории?")]
+            
+            assert [event["text"] for event in events[:-1]] == ["Есть ", "холодильники"]
+            assert events[-1]["type"] == "done"
+            assert events[-1]["message"] == "Есть холодильники"
+            assert events[-1]["ttft"] is not None
+            assert events[-1]["history"][-1] == {"role": "assistant", "content": "Есть холодильники"}
+            
+            messages = agent.client.chat.completions.create.await_args_list[1].kwargs["messages"]
+            assert messages[-2]["tool_calls"][0]["function"] == {"name": "get_categories", "arguments": "{}"}
+            assert messages[-1]["tool_call_id"] == "call_1"
+            # Ответ, собранный из результатов функций, в кэш ответов не попадает
+            assert len(agent.answer_cache) == 0
+    
+    @pytest.mark.asyncio
+    async def test_openai_client_is_shared(self):
+        """Тест общего клиента OpenAI: один пул соединений на процесс, закрытие при остановке"""
+        from src.ai import openai_client
+        
+        with patch.object(openai_client, '_client', None), \
+                patch.object(openai_client.settings, 'openai_base_url', "http://127.0.0.1:8080/v1"):
+            first = openai_client.get_openai_client()
+            second = openai_client.get_openai_client()
+            
+            assert first is second
+            assert str(first.base_url) == "http://127.0.0.1:8080/v1/"
+            assert first.max_retries == openai_client.settings.openai_max_retries
+            
+            await openai_client.close_openai_client()
+            assert first.is_closed()
+            assert openai_client.get_openai_client() is not first
+            await openai_client.close_openai_client()
+
+
+class TestConversationMemory:
+    """Тесты для истории разговора в пределах бюджета токенов"""
+    
+    @pytest.mark.asyncio
+    async def test_old_turns_fold_into_summary(self):
+        """Тест свёртки ранних реплик: в запрос попадают краткое содержание и последние реплики"""
+        summarize = AsyncMock(return_value="Клиент выбирает холодильник до 80000")
+        # Каждое сообщение — 4 служебных токена и 10 слов
+        memory = ConversationMemory(WordCounter("gpt-4o-mini"), 40, summarize)
+        
+        def text(label):
+            return " ".join([label] * 10)
+        
+        history = memory.append([], text("вопрос1"), text("ответ1"))
+        assert memory.context(history) == ([
+            {"role": "user", "content": text("вопрос1")},
+            {"role": "assistant", "content": text("ответ1")},
+        ], 28)
+        summarize.assert_not_called()
+        
+        history = memory.append(history, text("вопрос2"), text("ответ2"))
+        
+        # До окончания свёртки в запрос попадает только то, что помещается в бюджет
+        messages, tokens = memory.context(history)
+        assert [message["content"] for message in messages] == [text("вопрос2"), text("ответ2")]
+        assert tokens == 28
+        
+        await asyncio.gather(*ConversationMemory._tasks)
+        
+        folded = summarize.await_args.args[1]
+        assert [message["content"] for message in folded] == [text("вопрос1"), text("ответ1")]
+        
+        messages, tokens = memory.context(history)
+        assert messages[0]["role"] == "system"
+        assert messages[0]["content"].endswith("Клиент выбирает холодильник до 80000")
+        assert [message["content"] for message in messages[1:]] == [text("вопрос2"), text("ответ2")]
+        
+        # Свёрнутые реплики убираются из истории на следующем ходу
+        history = memory.append(history, "спасибо", "пожалуйста")
+        assert [message["content"] for message in history[1:3]] == [text("вопрос2"), text("ответ2")]
+        assert len(history) == 5
 
 
 class TestVectorStore:
@@ -124,6 +552,523 @@ class TestVectorStore:
             assert "Духовой шкаф Bosch" in text
             assert "Bosch" in text
             assert "Духовые шкафы" in text
+    
+    def test_add_products_in_chunks(self):
+        """Тест потоковой индексации порциями"""
+        import numpy as np
+        from src.ai.vector_store import ProductVectorStore
+        from src.ai.facets import FacetIndex
+        from src.ai.keys import ProductKeyIndex
+        from src.ai.lexical import LexicalIndex
+        from src.ai.neighbours import NeighbourTable
+        
+        products = []
+        for i in range(5):
+            product = MagicMock()
+            product.id = i + 1
+            product.name = f"Товар {i}"
+            product.brand = None
+            product.model = None
+            product.description = None
+            product.short_description = None
+            product.category = None
+            product.specifications = None
+            product.price = 1000
+            product.in_stock = True
+            products.append(product)
+        
+        with patch.object(ProductVectorStore, '__init__', lambda self: None):
+            store = ProductVectorStore()
+            store._lock = MagicMock()
+            store.index = MagicMock()
+            store.facets = FacetIndex()
+            store.keys = ProductKeyIndex()
+            store.lexical = LexicalIndex()
+            store.neighbours = NeighbourTable()
+            store.document_cache = None
+            store.index.max_batch_size = 1000
+            store.embedder = MagicMock()
+            store.embedder.encode.side_effect = lambda texts, **kwargs: np.zeros((len(texts), 4))
+            
+            stats = store.add_products(iter(products), batch_size=2, chunk_size=2)
+            
+            assert stats["products"] == 5
+            assert store.index.upsert.call_count == 3
+            assert store.neighbours.ids() == {1, 2, 3, 4, 5}
+            assert store.index.upsert.call_args_list[-1].kwargs["ids"] == ["5"]
+    
+    def test_sync_products_reembeds_only_changed(self):
+        """Тест инкрементальной синхронизации по хэшу текста"""
+        import numpy as np
+        from src.ai.vector_store import ProductVectorStore
+        from src.ai.facets import FacetIndex
+        from src.ai.keys import ProductKeyIndex
+        from src.ai.lexical import LexicalIndex
+        from src.ai.neighbours import NeighbourTable
+        
+        def make_product(product_id, description, price):
+            product = MagicMock()
+            product.id = product_id
+            product.name = f"Товар {product_id}"
+            product.brand = "Bosch"
+            product.model = None
+            product.description = description
+            product.short_description = None
+            product.category = None
+            product.specifications = None
+            product.price = price
+            product.in_stock = True
+            return product
+        
+        with patch.object(ProductVectorStore, '__init__', lambda self: None):
+            store = ProductVectorStore()
+            store._lock = MagicMock()
+            store.index = MagicMock()
+            store.facets = FacetIndex()
+            store.keys = ProductKeyIndex()
+            store.lexical = LexicalIndex()
+            store.neighbours = NeighbourTable()
+            store.document_cache = None
+            store.embedder = MagicMock()
+            store.embedder.encode.side_effect = lambda texts, **kwargs: np.zeros((len(texts), 4))
+            
+            unchanged = make_product(1, "Описание", 1000)
+            price_changed = make_product(2, "Описание", 2000)
+            text_changed = make_product(3, "Новое описание", 3000)
+            new = make_product(4, "Описание", 4000)
+            
+            def indexed_metadata(product, **overrides):
+                text = store._create_product_text(product)
+                return {**store._product_metadata(product, text), **overrides}
+            
+            indexed = {
+                "1": indexed_metadata(unchanged),
+                "2": indexed_metadata(price_changed, price=1500),
+                "3": indexed_metadata(text_changed, text_hash="old"),
+                "5": {"product_id": 5},
+            }
+            
+            stats = store.sync_products([unchanged, price_changed, text_changed, new], indexed)
+            
+            assert stats == {"added": 1, "reembedded": 1, "updated": 1, "unchanged": 1}
+            assert store.index.upsert.call_args.kwargs["ids"] == ["3", "4"]
+            assert store.index.update_metadata.call_args.kwargs["ids"] == ["2"]
+            assert list(indexed) == ["5"]
+    
+    def test_add_products_reuses_cached_embeddings(self, tmp_path):
+        """Тест переиндексации без повторного кодирования из дискового кэша"""
+        import numpy as np
+        from src.ai.vector_store import ProductVectorStore
+        from src.ai.embeddings import DocumentEmbeddingCache
+        
+        with patch.object(ProductVectorStore, '__init__', lambda self: None):
+            store = ProductVectorStore()
+            store.document_cache = DocumentEmbeddingCache(tmp_path, model_id="model")
+            store.embedder = MagicMock()
+            store.embedder.encode.side_effect = lambda texts, **kwargs: np.ones((len(texts), 4))
+            
+            store._encode_documents(["Товар 1", "Товар 2"], batch_size=2)
+            embeddings = store._encode_documents(["Товар 2", "Товар 3", "Товар 1"], batch_size=2)
+            
+            assert embeddings.shape == (3, 4)
+            assert store.embedder.encode.call_count == 2
+            assert store.embedder.encode.call_args.args[0] == ["Товар 3"]
+    
+    def test_query_cache_is_separated_by_embedding_backend(self, tmp_path):
+        """Тест дискового кэша запросов: векторы разных бэкендов не смешиваются"""
+        import json
+        import numpy as np
+        from src.ai import vector_store
+        
+        onnx_dir = tmp_path / "onnx"
+        onnx_dir.mkdir()
+        (onnx_dir / "embedder.json").write_text(json.dumps({"model_name": "test-model"}), encoding="utf-8")
+        
+        def create_store(backend, onnx_file):
+            with patch.multiple(
+                vector_store.settings,
+                chroma_db_path=str(tmp_path / "chroma"),
+                vector_backend="numpy",
+                numpy_index_path=str(tmp_path / "index.npz"),
+                snapshot_path=str(tmp_path / "vectors.snapshot"),
+                neighbours_path=str(tmp_path / "neighbours.npz"),
+                query_cache_path=str(tmp_path / "queries.db"),
+                embedding_cache_path="",
+                embedding_backend=backend,
+                onnx_model_path=str(onnx_dir / onnx_file),
+            ):
+                return vector_store.ProductVectorStore()
+        
+        stores = [
+            create_store("torch", "model.onnx"),
+            create_store("onnx", "model.onnx"),
+            create_store("onnx", "model_int8.onnx"),
+        ]
+        stores[0].query_cache.put("вытяжка", np.ones(4))
+        
+        assert len({store.query_cache.namespace for store in stores}) == 3
+        assert stores[1].query_cache.get("вытяжка") is None
+        assert stores[2].query_cache.get("вытяжка") is None
+        for store in stores:
+            store.close()
+    
+    def test_snapshot_replica_opens_catalog_indexes(self, tmp_path):
+        """Тест снимка: реплика берёт лексический индекс и таблицу соседей из него, не перестраивая"""
+        import numpy as np
+        from types import SimpleNamespace
+        from src.ai import vector_store
+        from src.ai.lexical import LexicalIndex
+        from src.ai.neighbours import NeighbourTable
+        
+        def create_store(backend, neighbours_path):
+            with patch.multiple(
+                vector_store.settings,
+                chroma_db_path=str(tmp_path / "chroma"),
+                vector_backend=backend,
+                numpy_index_path=str(tmp_path / "index.npz"),
+                snapshot_path=str(tmp_path / "vectors.snapshot"),
+                neighbours_path=str(tmp_path / neighbours_path),
+                query_cache_path="",
+                embedding_cache_path="",
+            ):
+                return vector_store.ProductVectorStore()
+        
+        products = [
+            SimpleNamespace(
+                id=i + 1, name=f"Вытяжка {i}", brand="Bosch", model=f"DWB{i}8JQ50", article=f"A{i}",
+                external_id="", description="Ширина 90см", short_description=None, category=None,
+                specifications=None, price=1000 * (i + 1), in_stock=i % 2 == 0,
+            )
+            for i in range(8)
+        ]
+        rng = np.random.default_rng(0)
+        
+        master = create_store("numpy", "neighbours.npz")
+        master.embedder = MagicMock()
+        master.embedder.encode.side_effect = lambda texts, **kwargs: rng.normal(size=(len(texts), 4))
+        master.add_products(products)
+        master.flush()
+        master.export_snapshot(tmp_path / "vectors.snapshot")
+        
+        with patch.object(LexicalIndex, "build", side_effect=AssertionError("перестроение BM25")), \
+                patch.object(NeighbourTable, "build", side_effect=AssertionError("перестроение соседей")):
+            replica = create_store("snapshot", "replica_neighbours.npz")
+        
+        assert replica.neighbours.neighbours(1) == master.neighbours.neighbours(1)
+        assert replica.lexical.search("вытяжка dwb38jq50", 3) == master.lexical.search("вытяжка dwb38jq50", 3)
+        assert replica.lexical.exact_match("DWB38JQ50", 3)[0][0] == "4"
+        
+        # Изменения на реплике по-прежнему применяются к загруженным индексам
+        replica.lexical.remove(["4"])
+        assert replica.lexical.exact_match("DWB38JQ50", 3) is None
+        
+        master.close()
+        replica.close()
+    
+    def test_get_similar_falls_back_to_index_when_neighbours_out_of_stock(self, tmp_path):
+        """Тест похожих товаров: если соседи из таблицы не в наличии, недостающие берутся из индекса"""
+        import numpy as np
+        from types import SimpleNamespace
+        from src.ai import vector_store
+        
+        with patch.multiple(
+            vector_store.settings,
+            chroma_db_path=str(tmp_path / "chroma"),
+            vector_backend="numpy",
+            numpy_index_path=str(tmp_path / "index.npz"),
+            snapshot_path=str(tmp_path / "vectors.snapshot"),
+            neighbours_path=str(tmp_path / "neighbours.npz"),
+            query_cache_path="",
+            embedding_cache_path="",
+            neighbours_k=2,
+        ):
+            store = vector_store.ProductVectorStore()
+        
+        # Ближайшие к товару 1 — товары 2 и 3, оба не в наличии
+        vectors = np.array([[1.0, 0.0], [0.99, 0.1], [0.98, 0.2], [0.9, 0.4], [0.8, 0.6], [0.0, 1.0]])
+        products = [
+            SimpleNamespace(
+                id=i + 1, name=f"Вытяжка {i}", brand="Bosch", model="", article="", external_id="",
+                description="", short_description=None, category=None, specifications=None,
+                price=1000, in_stock=i not in (1, 2),
+            )
+            for i in range(len(vectors))
+        ]
+        store.embedder = MagicMock()
+        store.embedder.encode.side_effect = lambda texts, **kwargs: vectors[:len(texts)]
+        store.add_products(products)
+        store.flush()
+        
+        assert [id_ for id_, _ in store.neighbours.neighbours(1)] == [2, 3]
+        similar = store.get_similar(1, count=2, in_stock_only=True)
+        assert [hit["id"] for hit in similar] == [4, 5]
+        assert similar[0]["score"] == pytest.approx(1.0 - similar[0]["distance"])
+        assert [hit["id"] for hit in store.get_similar(1, count=2, in_stock_only=False)] == [2, 3]
+        
+        store.close()
+    
+    @pytest.mark.asyncio
+    async def test_asearch_does_not_block_event_loop(self):
+        """Тест асинхронного поиска в отдельном пуле потоков"""
+        import time
+        import numpy as np
+        from concurrent.futures import ThreadPoolExecutor
+        from src.ai.embeddings import QueryEmbeddingCache, EmbeddingBatcher
+        from src.ai.vector_store import ProductVectorStore
+        
+        def slow_search(query_embedding, **kwargs):
+            time.sleep(0.2)
+            return [{"id": 1, "embedding": query_embedding, **kwargs}]
+        
+        with patch.object(ProductVectorStore, '__init__', lambda self: None):
+            store = ProductVectorStore()
+            store._executor = ThreadPoolExecutor(max_workers=1)
+            store._slots = asyncio.Semaphore(2)
+            store.query_cache = QueryEmbeddingCache()
+            store.batcher = EmbeddingBatcher(lambda texts: np.zeros((len(texts), 4)))
+            store.document_cache = None
+            store._search_exact = MagicMock(return_value=None)
+            store._search_by_embedding = slow_search
+            
+            ticks = 0
+            
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+            
+            ticker_task = asyncio.create_task(ticker())
+            results = await store.asearch("вытяжка", category="Вытяжки")
+            ticker_task.cancel()
+            store.close()
+            
+            assert results[0]["category"] == "Вытяжки"
+            assert results[0]["embedding"] == [0.0, 0.0, 0.0, 0.0]
+            assert ticks > 5
+    
+    @pytest.mark.asyncio
+    async def test_aencode_query_keeps_disk_cache_off_event_loop(self, tmp_path):
+        """Тест асинхронного кодирования: SQLite-кэш запросов читается и пишется в пуле"""
+        import threading
+        import numpy as np
+        from concurrent.futures import ThreadPoolExecutor
+        from src.ai.embeddings import QueryEmbeddingCache, EmbeddingBatcher
+        from src.ai.vector_store import ProductVectorStore
+        
+        with patch.object(ProductVectorStore, '__init__', lambda self: None):
+            store = ProductVectorStore()
+            store._executor = ThreadPoolExecutor(max_workers=1)
+            store.query_cache = QueryEmbeddingCache(path=str(tmp_path / "queries.db"))
+            store.batcher = EmbeddingBatcher(lambda texts: np.ones((len(texts), 4)))
+            store.document_cache = None
+            
+            threads = []
+            get, put = store.query_cache.get, store.query_cache.put
+            store.query_cache.get = lambda *args: threads.append(threading.current_thread()) or get(*args)
+            store.query_cache.put = lambda *args: threads.append(threading.current_thread()) or put(*args)
+            
+            assert await store._aencode_query("вытяжка") == [1.0] * 4
+            assert await store._aencode_query("Вытяжка ") == [1.0] * 4
+            
+            assert len(threads) == 3
+            assert threading.main_thread() not in threads
+            assert store.query_cache.stats()["memory_hits"] == 1
+            
+            # Сообщения клиентов (эмбеддинги для кэша ответов) на диск не пишутся
+            store.query_cache.get, store.query_cache.put = get, put
+            assert await store.aembed_query("Привет, нужна вытяжка") == [1.0] * 4
+            assert store.query_cache.get("привет, нужна вытяжка", disk=False) is not None
+            assert QueryEmbeddingCache(path=str(tmp_path / "queries.db")).get("привет, нужна вытяжка") is None
+            store.close()
+    
+    def test_search_many_encodes_in_one_batch(self):
+        """Тест батчевого поиска: одно кодирование и один запрос к индексу"""
+        import numpy as np
+        from src.ai.embeddings import QueryEmbeddingCache
+        from src.ai.vector_store import ProductVectorStore
+        
+        with patch.object(ProductVectorStore, '__init__', lambda self: None):
+            store = ProductVectorStore()
+            store.refresh = MagicMock()
+            store._search_exact = MagicMock(side_effect=lambda query, n, **f: [{"id": 9}] if query == "KM7201" else None)
+            store.query_cache = QueryEmbeddingCache()
+            store.query_cache.put("вытяжка", np.ones(4))
+            store.embedder = MagicMock()
+            store.embedder.encode.side_effect = lambda texts, **kwargs: np.zeros((len(texts), 4))
+            store.index = MagicMock()
+            store.index.query.side_effect = lambda embeddings, n, filters: [[{"id": i}] for i in range(len(embeddings))]
+            
+            with patch("src.ai.vector_store.settings") as settings:
+                settings.lexical_search = False
+                results = store.search_many(
+                    ["духовой шкаф", "KM7201", "вытяжка", "варочная панель"],
+                    n_results=1,
+                    in_stock_only=True,
+                )
+            
+            assert results == [[{"id": 0}], [{"id": 9}], [{"id": 1}], [{"id": 2}]]
+            assert store.embedder.encode.call_count == 1
+            assert store.embedder.encode.call_args.args[0] == ["духовой шкаф", "варочная панель"]
+            assert store.index.query.call_count == 1
+            assert store.index.query.call_args.args[2]["in_stock_only"] is True
+    
+    def test_search_by_article_uses_key_index(self):
+        """Тест поиска по артикулу без кодирования и лексического поиска"""
+        from src.ai.keys import ProductKeyIndex
+        from src.ai.lexical import LexicalIndex
+        from src.ai.vector_store import ProductVectorStore
+        
+        metadata = {"article": "BSH-1234", "model": "WAN 28 2X1", "in_stock": True}
+        
+        with patch.object(ProductVectorStore, '__init__', lambda self: None):
+            store = ProductVectorStore()
+            store.refresh = MagicMock()
+            store.keys = ProductKeyIndex()
+            store.keys.update(["7"], [metadata])
+            store.lexical = LexicalIndex()
+            store.lexical.update(["7"], ["Стиральная машина Bosch"], [metadata])
+            store._encode_query = MagicMock()
+            
+            assert [r["id"] for r in store.search("bsh 1234")] == [7]
+            assert [r["id"] for r in store.search("Bosch wan-282x1")] == [7]
+            store._encode_query.assert_not_called()
+            
+            # Найденный по артикулу товар не прошёл фильтры — нужен обычный поиск
+            assert store._search_exact("bsh1234", 5, brand="LG") is None
+            
+            stats = store.keys.stats()
+            assert stats["lookups"] == 3
+            assert stats["hits"] == 3
+    
+    def test_search_exact_model_skips_encoding(self):
+        """Тест точного поиска по модели и гибридного слияния результатов"""
+        from src.ai.keys import ProductKeyIndex
+        from src.ai.lexical import LexicalIndex
+        from src.ai.vector_store import ProductVectorStore
+        
+        with patch.object(ProductVectorStore, '__init__', lambda self: None):
+            store = ProductVectorStore()
+            store.refresh = MagicMock()
+            store.exact_hits = 0
+            store.hybrid_queries = 0
+            store.keys = ProductKeyIndex()
+            store.lexical = LexicalIndex()
+            store.lexical.update(
+                ["1", "2"],
+                ["Холодильник Samsung | Модель: RB37A5470SA", "Холодильник LG | Модель: GA-B509"],
+                [
+                    {"brand": "Samsung", "model": "RB37A5470SA", "price": 90000, "in_stock": True},
+                    {"brand": "LG", "model": "GA-B509", "price": 70000, "in_stock": True},
+                ],
+            )
+            store._encode_query = MagicMock(return_value=[0.0])
+            store.index = MagicMock()
+            store.index.query.return_value = [[
+                {"id": 2, "document": "Холодильник LG", "metadata": {"brand": "LG"}, "distance": 0.1},
+            ]]
+            
+            exact = store.search("Samsung rb37a5470sa")
+            
+            assert [r["id"] for r in exact] == [1]
+            assert exact[0]["metadata"]["brand"] == "Samsung"
+            store._encode_query.assert_not_called()
+            
+            hybrid = store.search("холодильник samsung")
+            
+            assert [r["id"] for r in hybrid] == [2, 1]
+            assert store.exact_hits == 1
+            assert store.hybrid_queries == 1
+    
+    def test_get_vector_store_is_shared(self):
+        """Тест общего экземпляра хранилища на процесс"""
+        from src.ai import vector_store
+        
+        with patch.object(vector_store.ProductVectorStore, '__init__', lambda self: None), \
+                patch.object(vector_store, '_vector_store', None):
+            assert not vector_store.is_vector_store_ready()
+            
+            first = vector_store.get_vector_store()
+            second = vector_store.get_vector_store()
+            
+            assert first is second
+            
+            # Готово только после прогрева
+            first.ready = False
+            assert not vector_store.is_vector_store_ready()
+            first.ready = True
+            assert vector_store.is_vector_store_ready()
+    
+    @pytest.mark.asyncio
+    async def test_aget_vector_store_waits_off_event_loop(self):
+        """Тест ожидания общего хранилища, пока оно создаётся при старте, без блокировки event loop"""
+        import threading
+        from src.ai import vector_store
+        
+        release = threading.Event()
+        
+        def slow_init(self):
+            release.wait(5)
+        
+        with patch.object(vector_store.ProductVectorStore, '__init__', slow_init), \
+                patch.object(vector_store, '_vector_store', None):
+            warmup = asyncio.ensure_future(asyncio.to_thread(vector_store.get_vector_store))
+            request = asyncio.ensure_future(vector_store.aget_vector_store())
+            
+            # Пока хранилище создаётся, цикл событий продолжает работать
+            await asyncio.sleep(0.05)
+            assert not request.done()
+            release.set()
+            
+            assert await asyncio.wait_for(request, timeout=5) is await warmup
+    
+    @pytest.mark.asyncio
+    async def test_category_facets_refresh_off_event_loop(self):
+        """Тест асинхронных категорий: проверка обновления каталога идёт в пуле"""
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        from src.ai.facets import FacetIndex
+        from src.ai.vector_store import ProductVectorStore
+        
+        with patch.object(ProductVectorStore, '__init__', lambda self: None):
+            store = ProductVectorStore()
+            store._executor = ThreadPoolExecutor(max_workers=1)
+            store.facets = FacetIndex()
+            store.facets.update(["1"], [{"category": "Вытяжки", "brand": "Bosch", "price": 30000, "in_stock": True}])
+            threads = []
+            store.refresh = lambda: threads.append(threading.current_thread())
+            
+            facets = await store.aget_category_facets()
+            categories = await store.aget_categories()
+            store._executor.shutdown()
+            
+            assert [facet["name"] for facet in facets] == categories == ["Вытяжки"]
+            assert len(threads) == 2
+            assert threading.main_thread() not in threads
+    
+    def test_warm_up_loads_model_once(self):
+        """Тест прогрева: модель, пробное кодирование и поиск с замером фаз"""
+        import threading
+        import numpy as np
+        from src.ai.vector_store import ProductVectorStore
+        
+        with patch.object(ProductVectorStore, '__init__', lambda self: None):
+            store = ProductVectorStore()
+            store._warmup_lock = threading.Lock()
+            store.ready = False
+            store.warmup_timings = {"open": 0.1}
+            store.embedder = MagicMock()
+            store.embedder.encode.return_value = np.zeros((1, 4))
+            store.index = MagicMock()
+            store.index.count.return_value = 10
+            
+            timings = store.warm_up()
+            store.warm_up()
+            
+            assert list(timings) == ["open", "model", "encode", "index"]
+            assert store.ready
+            assert store.embedder.encode.call_count == 1
+            assert store.index.query.call_count == 1
 
 
 class TestHelpers:
@@ -0,0 +1,226 @@
+"""
+Тесты для компонентов эмбеддингов
+"""
+import pytest
+import numpy as np
+from unittest.mock import MagicMock
+
+
+class TestQueryEmbeddingCache:
+    """Тесты для кэша эмбеддингов запросов"""
+    
+    def test_normalized_queries_share_entry(self):
+        """Тест нормализации ключа запроса"""
+        from src.ai.embeddings import QueryEmbeddingCache
+        
+        cache = QueryEmbeddingCache(max_size=10)
+        compute = MagicMock(return_value=np.ones(4))
+        
+        cache.get_or_compute("Холодильник  Samsung", compute)
+        cache.get_or_compute("холодильник samsung?", compute)
+        
+        assert compute.call_count == 1
+        stats = cache.stats()
+        assert stats["memory_hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["hit_rate"] == 0.5
+    
+    def test_lru_eviction_and_ttl(self):
+        """Тест вытеснения по размеру и времени жизни"""
+        from src.ai.embeddings import QueryEmbeddingCache
+        
+        cache = QueryEmbeddingCache(max_size=2)
+        cache.put("вытяжка", np.ones(4))
+        cache.put("духовой шкаф", np.ones(4))
+        cache.get("вытяжка")
+        cache.put("варочная панель", np.ones(4))
+        
+        assert cache.get("вытяжка") is not None
+        assert cache.get("духовой шкаф") is None
+        
+        expired = QueryEmbeddingCache(max_size=2, ttl=-1)
+        expired.put("вытяжка", np.ones(4))
+        assert expired.get("вытяжка") is None
+    
+    def test_disk_tier(self, tmp_path):
+        """Тест дискового уровня кэша"""
+        from src.ai.embeddings import QueryEmbeddingCache
+        
+        path = str(tmp_path / "cache.sqlite")
+        QueryEmbeddingCache(path=path).put("посудомоечная машина", np.arange(4))
+        
+        cache = QueryEmbeddingCache(path=path)
+        embedding = cache.get("Посудомоечная машина")
+        
+        assert embedding is not None
+        assert embedding.tolist() == [0.0, 1.0, 2.0, 3.0]
+        assert cache.stats()["disk_hits"] == 1
+
+
+class TestDocumentEmbeddingCache:
+    """Тесты для дискового кэша эмбеддингов товаров"""
+    
+    def test_persists_across_instances(self, tmp_path):
+        """Тест повторного открытия кэша и разделения по модели"""
+        from src.ai.embeddings import DocumentEmbeddingCache
+        
+        cache = DocumentEmbeddingCache(tmp_path, model_id="model-a")
+        cache.put_many(["Духовой шкаф Bosch", "Вытяжка Elica"], np.arange(8).reshape(2, 4))
+        cache.flush()
+        
+        reopened = DocumentEmbeddingCache(tmp_path, model_id="model-a")
+        embeddings = reopened.get_many(["Вытяжка Elica", "Холодильник LG"])
+        
+        assert embeddings[0].tolist() == [4.0, 5.0, 6.0, 7.0]
+        assert embeddings[1] is None
+        assert reopened.stats()["hits"] == 1
+        assert DocumentEmbeddingCache(tmp_path, model_id="model-b").get_many(["Вытяжка Elica"]) == [None]
+    
+    def test_file_is_read_on_first_use(self, tmp_path):
+        """Тест ленивого открытия: создание кэша не читает файл записей"""
+        from unittest.mock import patch
+        from src.ai.embeddings import DocumentEmbeddingCache
+        
+        cache = DocumentEmbeddingCache(tmp_path, model_id="model")
+        cache.put_many(["Духовой шкаф Bosch"], np.ones((1, 4)))
+        cache.flush()
+        
+        with patch.object(DocumentEmbeddingCache, "_open", autospec=True) as open_file:
+            reopened = DocumentEmbeddingCache(tmp_path, model_id="model")
+            reopened.flush()
+            assert reopened.stats()["size"] is None
+            open_file.assert_not_called()
+        
+        reopened = DocumentEmbeddingCache(tmp_path, model_id="model")
+        assert reopened.get_many(["Духовой шкаф Bosch"])[0].tolist() == [1.0] * 4
+        assert reopened.stats()["size"] == 1
+    
+    def test_size_bound_evicts_least_recently_used(self, tmp_path):
+        """Тест ограничения размера с вытеснением давно не использованных"""
+        from src.ai.embeddings import DocumentEmbeddingCache
+        
+        cache = DocumentEmbeddingCache(tmp_path, model_id="model", max_items=20)
+        texts = [f"Товар {i}" for i in range(20)]
+        cache.put_many(texts, np.ones((20, 4)))
+        cache.get_many(texts[:1])
+        cache.put_many(["Новый товар"], np.zeros((1, 4)))
+        
+        assert cache.stats()["size"] == 20
+        assert cache.stats()["evictions"] == 1
+        assert cache.get_many(["Товар 0", "Товар 1", "Новый товар"])[1] is None
+        assert cache.get_many(["Товар 0"])[0] is not None
+
+
+class TestEmbeddingBatcher:
+    """Тесты для микробатчинга запросов"""
+    
+    def test_concurrent_queries_share_one_batch(self):
+        """Тест объединения одновременных запросов в один вызов модели"""
+        from src.ai.embeddings import EmbeddingBatcher
+        
+        calls = []
+        
+        def encode_batch(texts):
+            calls.append(list(texts))
+            return np.array([[float(len(text))] for text in texts])
+        
+        batcher = EmbeddingBatcher(encode_batch, window_ms=50, max_batch_size=8)
+        futures = [batcher.submit(text) for text in ["a", "bb", "ccc", "a"]]
+        results = [future.result(timeout=5) for future in futures]
+        batcher.close()
+        
+        assert calls == [["a", "bb", "ccc"]]
+        assert [result[0] for result in results] == [1.0, 2.0, 3.0, 1.0]
+        
+        stats = batcher.stats()
+        assert stats["batch_size"]["count"] == 1
+        assert stats["batch_size"]["buckets"]["<=4"] == 1
+        assert stats["queue_wait_ms"]["count"] == 4
+    
+    def test_errors_are_propagated(self):
+        """Тест передачи ошибки кодирования вызывающему"""
+        from src.ai.embeddings import EmbeddingBatcher
+        
+        def encode_batch(texts):
+            raise ValueError("model failed")
+        
+        batcher = EmbeddingBatcher(encode_batch, window_ms=1)
+        with pytest.raises(ValueError):
+            batcher.encode("вытяжка")
+        batcher.close()
+    
+    @pytest.mark.asyncio
+    async def test_cancelled_caller_does_not_stop_worker(self):
+        """Тест отмены ожидающей корутины: фоновый поток продолжает обрабатывать запросы"""
+        import asyncio
+        import threading
+        from src.ai.embeddings import EmbeddingBatcher
+        
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        
+        def encode_batch(texts):
+            calls.append(list(texts))
+            started.set()
+            release.wait(5)
+            return np.array([[float(len(text))] for text in texts])
+        
+        batcher = EmbeddingBatcher(encode_batch, window_ms=1)
+        running = asyncio.ensure_future(asyncio.wrap_future(batcher.submit("a")))
+        await asyncio.to_thread(started.wait, 5)
+        queued = asyncio.ensure_future(asyncio.wrap_future(batcher.submit("bb")))
+        await asyncio.sleep(0)
+        
+        # Один вызывающий отменён во время кодирования, другой — пока ждал в очереди
+        running.cancel()
+        queued.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        
+        result = await asyncio.wait_for(asyncio.wrap_future(batcher.submit("ccc")), timeout=5)
+        batcher.close()
+        
+        assert result[0] == 3.0
+        assert calls == [["a"], ["ccc"]]
+
+
+class TestOnnxEmbedder:
+    """Тесты для ONNX-бэкенда эмбеддингов"""
+    
+    def test_export_matches_torch(self, tmp_path):
+        """Тест численной эквивалентности экспортированной модели"""
+        pytest.importorskip("onnx")
+        pytest.importorskip("onnxruntime")
+        from transformers import BertConfig, BertModel, BertTokenizerFast
+        from sentence_transformers import SentenceTransformer, models
+        from src.ai.embedders import OnnxEmbedder, TorchEmbedder, export_onnx
+        
+        # Маленькая случайная модель вместо скачивания настоящей
+        letters = list("абвгдежзийклмнопрстуфхцчшщъыьэюяabcdefghijklmnopqrstuvwxyz0123456789")
+        vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + letters + [f"##{c}" for c in letters]
+        (tmp_path / "vocab.txt").write_text("\n".join(vocab), encoding="utf-8")
+        
+        config = BertConfig(
+            vocab_size=len(vocab),
+            hidden_size=32,
+            num_hidden_layers=1,
+            num_attention_heads=2,
+            intermediate_size=64,
+        )
+        BertModel(config).save_pretrained(tmp_path / "bert")
+        BertTokenizerFast(str(tmp_path / "vocab.txt")).save_pretrained(tmp_path / "bert")
+        SentenceTransformer(modules=[
+            models.Transformer(str(tmp_path / "bert"), max_seq_length=64),
+            models.Pooling(32, "mean"),
+        ]).save(str(tmp_path / "model"))
+        
+        model_path = export_onnx(str(tmp_path / "model"), tmp_path / "onnx")
+        
+        texts = ["холодильник", "духовой шкаф bosch с пиролизом", "a"]
+        expected = TorchEmbedder(str(tmp_path / "model")).encode(texts)
+        embedder = OnnxEmbedder(model_path)
+        
+        assert np.allclose(embedder.encode(texts, batch_size=2), expected, atol=1e-4)
+        assert np.allclose(embedder.encode("холодильник"), expected[0], atol=1e-4)
+        assert embedder.get_sentence_embedding_dimension() == 32
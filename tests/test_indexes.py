@@ -0,0 +1,358 @@
+"""
+Тесты для индексов векторного хранилища
+"""
+import pytest
+import numpy as np
+
+
+def make_metadata(product_id, brand, category, price, in_stock=True, model=""):
+    return {
+        "product_id": product_id,
+        "name": f"Товар {product_id}",
+        "brand": brand,
+        "model": model,
+        "category": category,
+        "price": price,
+        "in_stock": in_stock,
+    }
+
+
+class TestNumpyIndex:
+    """Тесты для точного NumPy-индекса"""
+    
+    @pytest.fixture
+    def index(self):
+        from src.ai.indexes import NumpyIndex
+        
+        index = NumpyIndex()
+        index.upsert(
+            ids=["1", "2", "3", "4"],
+            embeddings=np.array([
+                [1.0, 0.0, 0.0],
+                [0.9, 0.1, 0.0],
+                [0.0, 1.0, 0.0],
+                [0.0, 0.0, 1.0],
+            ]),
+            documents=["a", "b", "c", "d"],
+            metadatas=[
+                make_metadata(1, "Bosch", "Духовые шкафы", 50000),
+                make_metadata(2, "Miele", "Духовые шкафы", 90000, in_stock=False),
+                make_metadata(3, "Bosch", "Вытяжки", 30000),
+                make_metadata(4, "LG", "Холодильники", 70000),
+            ],
+        )
+        return index
+    
+    def test_query_orders_by_similarity(self, index):
+        """Тест порядка результатов и косинусного расстояния"""
+        results = index.query(np.array([[1.0, 0.0, 0.0]]), 2, {})[0]
+        
+        assert [r["id"] for r in results] == [1, 2]
+        assert results[0]["distance"] == pytest.approx(0.0, abs=1e-6)
+        assert results[0]["metadata"]["brand"] == "Bosch"
+    
+    def test_filters(self, index):
+        """Тест фильтров по колонкам"""
+        query = np.array([[1.0, 0.0, 0.0]])
+        
+        in_stock = index.query(query, 10, {"in_stock_only": True})[0]
+        assert in_stock[0]["id"] == 1
+        assert {r["id"] for r in in_stock} == {1, 3, 4}
+        
+        bosch_cheap = index.query(query, 10, {"brand": "Bosch", "max_price": 40000})[0]
+        assert [r["id"] for r in bosch_cheap] == [3]
+        
+        assert index.query(query, 10, {"category": "Нет такой"})[0] == []
+    
+    def test_update_and_delete(self, index):
+        """Тест обновления метаданных и удаления"""
+        index.update_metadata(["2"], [make_metadata(2, "Miele", "Духовые шкафы", 90000)])
+        index.delete(["1"])
+        
+        results = index.query(np.array([[1.0, 0.0, 0.0]]), 10, {"in_stock_only": True})[0]
+        
+        assert index.count() == 3
+        assert results[0]["id"] == 2
+        assert set(index.get_metadata()) == {"2", "3", "4"}
+    
+    def test_flush_and_reload(self, index, tmp_path):
+        """Тест сохранения и загрузки индекса"""
+        from src.ai.indexes import NumpyIndex
+        
+        index.path = tmp_path / "index.npz"
+        index.flush()
+        
+        loaded = NumpyIndex(tmp_path / "index.npz")
+        results = loaded.query(np.array([[0.0, 1.0, 0.0]]), 1, {"brand": "Bosch"})[0]
+        
+        assert loaded.count() == 4
+        assert results[0]["id"] == 3
+        assert results[0]["document"] == "c"
+    
+    @pytest.mark.parametrize("dtype", ["float16", "int8"])
+    def test_quantized_storage(self, tmp_path, dtype):
+        """Тест сжатого хранения: тот же порядок выдачи при меньшем объёме"""
+        from src.ai.indexes import NumpyIndex
+        
+        rng = np.random.default_rng(0)
+        embeddings = rng.normal(size=(200, 32))
+        ids = [str(i + 1) for i in range(200)]
+        documents = [f"Товар {i + 1}" for i in range(200)]
+        metadatas = [make_metadata(i + 1, "Bosch", "Вытяжки", 10000) for i in range(200)]
+        queries = embeddings[:10] + 0.05 * rng.normal(size=(10, 32))
+        
+        exact = NumpyIndex()
+        exact.upsert(ids, embeddings, documents, metadatas)
+        quantized = NumpyIndex(tmp_path / "index.npz", dtype=dtype)
+        quantized.upsert(ids, embeddings, documents, metadatas)
+        quantized.flush()
+        
+        assert quantized.memory_bytes() < exact.memory_bytes() * 0.6
+        
+        expected = [r[0]["id"] for r in exact.query(queries, 1, {})]
+        for index in (quantized, NumpyIndex(tmp_path / "index.npz", dtype=dtype)):
+            results = index.query(queries, 1, {})
+            assert [r[0]["id"] for r in results] == expected
+            assert results[0][0]["distance"] == pytest.approx(
+                exact.query(queries, 1, {})[0][0]["distance"], abs=0.01
+            )
+
+
+class TestPartitionedIndex:
+    """Тесты для индекса с шардами по категориям"""
+    
+    def test_matches_single_index(self, tmp_path):
+        """Тест маршрутизации по шардам и слияния результатов"""
+        from src.ai.indexes import NumpyIndex, create_index
+        
+        rng = np.random.default_rng(0)
+        embeddings = rng.normal(size=(60, 8)).astype(np.float32)
+        ids = [str(i) for i in range(60)]
+        documents = [f"Товар {i}" for i in range(60)]
+        metadatas = [
+            make_metadata(i, ["Bosch", "LG"][i % 2], ["Вытяжки", "Духовые шкафы", "Холодильники"][i % 3], 1000 * i)
+            for i in range(60)
+        ]
+        
+        single = NumpyIndex()
+        single.upsert(ids, embeddings, documents, metadatas)
+        partitioned = create_index("numpy", tmp_path / "chroma", tmp_path / "numpy.npz", partition_by="category")
+        partitioned.upsert(ids, embeddings, documents, metadatas)
+        
+        assert len(partitioned.shard_sizes()) == 3
+        for filters in ({}, {"category": "Вытяжки"}, {"category": "Холодильники", "brand": "LG"}, {"category": "Нет"}):
+            assert partitioned.query(embeddings[:4], 5, filters) == single.query(embeddings[:4], 5, filters)
+        
+        # Смена категории переносит товар в другой шард
+        moved = make_metadata(0, "Bosch", "Холодильники", 1000)
+        partitioned.upsert(["0"], embeddings[:1], ["Товар 0"], [moved])
+        partitioned.delete(["1"])
+        partitioned.flush()
+        
+        reopened = create_index("numpy", tmp_path / "chroma", tmp_path / "numpy.npz", partition_by="category")
+        
+        assert reopened.count() == 59
+        assert reopened.get_metadata()["0"]["category"] == "Холодильники"
+        assert reopened.query(embeddings[0], 1, {"category": "Холодильники"})[0][0]["id"] == 0
+        assert 0 not in [hit["id"] for hit in reopened.query(embeddings[0], 60, {"category": "Вытяжки"})[0]]
+
+
+class TestFacetIndex:
+    """Тесты для фасетного индекса категорий и брендов"""
+    
+    def test_counts_and_price_ranges(self):
+        """Тест поддержки счётчиков и цен при изменениях"""
+        from src.ai.facets import FacetIndex
+        
+        facets = FacetIndex()
+        facets.build({
+            "1": make_metadata(1, "Bosch", "Духовые шкафы", 50000),
+            "2": make_metadata(2, "Miele", "Духовые шкафы", 90000, in_stock=False),
+            "3": make_metadata(3, "Bosch", "Вытяжки", 30000),
+        })
+        
+        assert facets.names("category") == ["Вытяжки", "Духовые шкафы"]
+        assert facets.facets("category")[1] == {
+            "name": "Духовые шкафы",
+            "count": 2,
+            "in_stock": 1,
+            "min_price": 50000,
+            "max_price": 90000,
+        }
+        
+        facets.remove(["2"])
+        facets.update(["3"], [make_metadata(3, "LG", "Вытяжки", 35000)])
+        
+        assert facets.names("brand") == ["Bosch", "LG"]
+        assert facets.facets("category")[1]["max_price"] == 50000
+        assert facets.facets("brand")[0]["count"] == 1
+        assert facets.facets("category")[0]["min_price"] == 35000
+        
+        facets.remove(["1", "3"])
+        assert facets.names("category") == []
+        assert len(facets) == 0
+
+
+class TestLexicalIndex:
+    """Тесты для лексического индекса BM25"""
+    
+    def test_bm25_and_incremental_updates(self):
+        """Тест ранжирования, фильтров и обновления индекса"""
+        from src.ai.lexical import LexicalIndex
+        
+        index = LexicalIndex()
+        index.update(
+            ["1", "2", "3"],
+            [
+                "Духовой шкаф Bosch HBG635BS1 | Пиролиз",
+                "Духовой шкаф Miele H 7264 B",
+                "Вытяжка Bosch DWB98JQ50 | Ширина 90см | Производительность 800м3",
+            ],
+            [
+                make_metadata(1, "Bosch", "Духовые шкафы", 50000, model="HBG635BS1"),
+                make_metadata(2, "Miele", "Духовые шкафы", 90000, in_stock=False, model="H 7264 B"),
+                make_metadata(3, "Bosch", "Вытяжки", 30000, model="DWB98JQ50"),
+            ],
+        )
+        
+        assert [id_ for id_, _ in index.search("духовой шкаф с пиролизом", 10)] == ["1", "2"]
+        assert [id_ for id_, _ in index.search("духовой шкаф", 10, {"in_stock_only": True})] == ["1"]
+        assert [id_ for id_, _ in index.exact_match("Bosch hbg635bs1", 5)] == ["1"]
+        # Найденный товар не прошёл фильтры: пустой список заменил бы обычный поиск
+        assert index.exact_match("Bosch hbg635bs1", 5, {"brand": "Miele"}) is None
+        assert index.exact_match("духовой шкаф", 5) is None
+        assert index.exact_match("HBG000XX1", 5) is None
+        # Размеры и параметры — не модели: такие запросы идут в обычный поиск
+        assert index.exact_match("вытяжка 90см", 5) is None
+        assert index.exact_match("вытяжка 800м3", 5) is None
+        
+        index.update(
+            ["1"],
+            ["Духовой шкаф Bosch HBG7741B1"],
+            [make_metadata(1, "Bosch", "Духовые шкафы", 50000, model="HBG7741B1")],
+        )
+        index.remove(["2"])
+        
+        assert index.exact_match("HBG635BS1", 5) is None
+        assert [id_ for id_, _ in index.exact_match("HBG7741B1", 5)] == ["1"]
+        assert [id_ for id_, _ in index.search("шкаф", 10)] == ["1"]
+        assert len(index) == 2
+
+
+class TestProductKeyIndex:
+    """Тесты для индекса артикулов и моделей"""
+    
+    def test_normalized_lookup(self):
+        """Тест нормализации ключей и обновления индекса"""
+        from src.ai.keys import ProductKeyIndex, normalize_key
+        
+        assert normalize_key(" RB-37A 5470SA ") == "rb37a5470sa"
+        
+        keys = ProductKeyIndex()
+        keys.update(
+            ["1", "2"],
+            [
+                {"model": "RB37A5470SA", "article": "", "external_id": "ext-1"},
+                {"model": "KM 7201 FR", "article": "123456", "external_id": None},
+            ],
+        )
+        
+        assert keys.lookup("rb37a5470sa") == ["1"]
+        assert keys.lookup("Samsung RB-37A5470SA") == ["1"]
+        assert keys.lookup("km7201fr") == ["2"]
+        assert keys.lookup("123456") == ["2"]
+        assert keys.lookup("холодильник") is None
+        
+        # Числа внутри запроса — цены и годы, а не артикулы и внешние ID
+        keys.update(["3", "4"], [{"external_id": "50000"}, {"external_id": "2024"}])
+        assert keys.lookup("холодильник до 50000 рублей") is None
+        assert keys.lookup("духовой шкаф 2024 года") is None
+        assert keys.lookup("50000") == ["3"]
+        
+        keys.update(["1"], [{"model": "RB38", "article": "", "external_id": ""}])
+        keys.remove(["2"])
+        
+        assert keys.lookup("RB37A5470SA") is None
+        assert keys.lookup("123456") is None
+        assert keys.stats()["hits"] == 5
+
+
+class TestNeighbourTable:
+    """Тесты для таблицы похожих товаров"""
+    
+    def test_incremental_matches_full_build(self, tmp_path):
+        """Тест инкрементального пересчёта и сохранения таблицы"""
+        from src.ai.neighbours import NeighbourTable
+        
+        rng = np.random.default_rng(0)
+        vectors = rng.normal(size=(60, 8)).astype(np.float32)
+        ids = [str(i) for i in range(60)]
+        
+        table = NeighbourTable(tmp_path / "neighbours.npz", k=5)
+        table.build(ids[:50], vectors[:50])
+        
+        # Новые товары, изменённый вектор и удалённые товары
+        table.update(ids[50:], vectors[50:])
+        vectors[3] = rng.normal(size=8)
+        table.update(["3"], vectors[3:4])
+        table.remove(["7", "8"])
+        
+        kept = [i for i in range(60) if i not in (7, 8)]
+        expected = NeighbourTable(k=5)
+        expected.build([ids[i] for i in kept], vectors[kept])
+        
+        for i in kept:
+            assert [id_ for id_, _ in table.neighbours(i)] == [id_ for id_, _ in expected.neighbours(i)]
+        assert table.neighbours(7) is None
+        assert i not in [id_ for id_, _ in table.neighbours(i)]
+        
+        table.flush()
+        loaded = NeighbourTable(tmp_path / "neighbours.npz", k=5, load_vectors=lambda: (ids, vectors))
+        
+        assert loaded.load()
+        assert loaded.ids() == set(kept)
+        assert loaded.neighbours(3) == table.neighbours(3)
+        
+        # Векторы загружаются из индекса только для пересчёта
+        loaded.remove(["3"])
+        assert 3 not in [id_ for id_, _ in loaded.neighbours(4)]
+        assert not NeighbourTable(tmp_path / "neighbours.npz", k=10).load()
+
+
+class TestSnapshot:
+    """Тесты для снимка NumPy-индекса"""
+    
+    @pytest.mark.parametrize("dtype", ["float32", "int8"])
+    def test_snapshot_matches_source_index(self, tmp_path, dtype):
+        """Тест открытия снимка через отображение в память"""
+        from src.ai.indexes import NumpyIndex
+        
+        rng = np.random.default_rng(0)
+        embeddings = rng.normal(size=(50, 8)).astype(np.float32)
+        ids = [str(i) for i in range(50)]
+        metadatas = [
+            make_metadata(i, ["Bosch", "LG"][i % 2], "Духовые шкафы", 1000 * i, in_stock=i % 3 > 0)
+            for i in range(50)
+        ]
+        
+        index = NumpyIndex(dtype=dtype)
+        index.upsert(ids, embeddings, [f"Товар {i}" for i in range(50)], metadatas)
+        index.save_snapshot(tmp_path / "vectors.snapshot")
+        
+        snapshot = NumpyIndex(snapshot=tmp_path / "vectors.snapshot")
+        filters = {"brand": "LG", "in_stock_only": True, "max_price": 40000}
+        
+        assert snapshot.dtype == dtype
+        assert isinstance(snapshot._matrix.base, np.memmap)
+        assert snapshot.count() == 50
+        assert snapshot.query(embeddings[:3], 5, filters) == index.query(embeddings[:3], 5, filters)
+        assert snapshot.get_metadata() == index.get_metadata()
+        
+        # Изменения остаются в памяти процесса, файл не меняется
+        snapshot.delete(["1"])
+        snapshot.update_metadata(["3"], [make_metadata(3, "Miele", "Вытяжки", 5)])
+        snapshot.upsert(["60"], embeddings[:1], ["Новый"], [make_metadata(60, "LG", "Вытяжки", 10)])
+        
+        assert snapshot.count() == 50
+        assert snapshot.query(embeddings[0], 1, {"brand": "Miele"})[0][0]["id"] == 3
+        assert NumpyIndex(snapshot=tmp_path / "vectors.snapshot").get_metadata() == index.get_metadata()